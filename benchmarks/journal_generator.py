@@ -0,0 +1,100 @@
+# ============================================================================
+# benchmarks/journal_generator.py - Deterministic synthetic ledger journals
+# ============================================================================
+
+from dataclasses import dataclass
+from typing import List, TextIO
+import datetime
+import random
+
+BASE_COMMODITY = "BRL"
+GROCERY_ITEMS = [
+    ("Arroz", "kg"), ("Feijao", "kg"), ("Carne", "kg"), ("Frango", "kg"), ("Tomate", "kg"),
+    ("Batata", "kg"), ("Leite", "un"), ("Ovos", "un"), ("Pao", "un"), ("Cafe", "un"),
+]
+
+
+@dataclass
+class JournalSpec:
+    """Shape of a synthetic journal. The same spec always yields the same file."""
+    years: int = 1
+    accounts: int = 50
+    depth: int = 3
+    commodities: int = 2
+    xacts_per_day: int = 5
+    grocery_share: float = 0.2
+    automated: int = 5
+    seed: int = 42
+    start: datetime.date = datetime.date(2015, 1, 1)
+
+
+def _expense_accounts(rng: random.Random, spec: JournalSpec) -> List[str]:
+    """Expense accounts spread over a tree at most spec.depth levels deep"""
+    names = set()
+    while len(names) < spec.accounts:
+        levels = rng.randint(2, max(2, spec.depth))
+        path = ["Despesas"] + [f"C{rng.randrange(8)}{chr(ord('a') + level)}" for level in range(1, levels)]
+        names.add(":".join(path))
+    return sorted(names)
+
+
+def _amount(value: float) -> str:
+    return f"{BASE_COMMODITY} {value:.2f}"
+
+
+def write_journal(out: TextIO, spec: JournalSpec):
+    """Write a journal matching spec to out"""
+    rng = random.Random(spec.seed)
+    expenses = _expense_accounts(rng, spec)
+    commodities = [f"CM{i:02d}" for i in range(spec.commodities)]
+    prices = {c: rng.uniform(1, 100) for c in commodities}
+
+    out.write(f"; synthetic journal {spec}\n\n")
+
+    # Automated transactions: a share of every matching expense goes to a
+    # budget tracking account
+    for account in expenses[:spec.automated]:
+        out.write(f"= /^{account}$/\n    (Orcamento:{account.split(':', 1)[1]})  0.1\n\n")
+
+    # Periodic budget entries
+    if spec.automated:
+        out.write("~ Monthly\n")
+        for account in expenses[:spec.automated]:
+            out.write(f"    {account}  {_amount(rng.uniform(100, 1000))}\n")
+        out.write("    Ativos:Banco:Conta\n\n")
+
+    days = (spec.start.replace(year=spec.start.year + spec.years) - spec.start).days
+    for offset in range(days):
+        date = spec.start + datetime.timedelta(days=offset)
+        stamp = date.strftime("%Y/%m/%d")
+
+        if date.day == 1:
+            for commodity in commodities:
+                prices[commodity] *= rng.uniform(0.9, 1.1)
+                out.write(f"P {stamp} {commodity} {_amount(prices[commodity])}\n")
+            out.write(f"\n{stamp} * Salario\n    Ativos:Banco:Conta  {_amount(rng.uniform(5000, 9000))}\n"
+                      f"    Receitas:Salario\n\n")
+            for commodity in commodities:
+                quantity = rng.randint(1, 20)
+                out.write(f"{stamp} * Compra {commodity}\n"
+                          f"    Ativos:Investimentos:{commodity}  {quantity} {commodity} @ {_amount(prices[commodity])}\n"
+                          f"    Ativos:Banco:Conta\n\n")
+
+        for _ in range(spec.xacts_per_day):
+            cleared = "* " if rng.random() < 0.8 else ""
+            if rng.random() < spec.grocery_share:
+                out.write(f"{stamp} {cleared}Supermercado\n")
+                for item, unit in rng.sample(GROCERY_ITEMS, rng.randint(1, 4)):
+                    quantity = rng.randint(1, 5)
+                    out.write(f"    Despesas:Supermercado:{item}  {quantity} {unit} @ {_amount(rng.uniform(2, 40))}\n")
+            else:
+                out.write(f"{stamp} {cleared}Pagamento {rng.randrange(1000)}\n"
+                          f"    {rng.choice(expenses)}  {_amount(rng.uniform(1, 500))}\n")
+            source = "Passivos:Cartao" if rng.random() < 0.3 else "Ativos:Banco:Conta"
+            out.write(f"    {source}\n\n")
+
+
+def generate_journal(path: str, spec: JournalSpec):
+    """Write a journal matching spec to path"""
+    with open(path, "w", encoding="utf-8") as f:
+        write_journal(f, spec)
@@ -0,0 +1,266 @@
+# ============================================================================
+# benchmarks/run.py - Service and HTTP benchmarks over synthetic journals
+# ============================================================================
+"""
+Time LedgerService methods and the HTTP endpoints of create_app over
+synthetic journals of several sizes.
+
+Run from the repository root, with the ledger bindings available:
+
+    python -m benchmarks.run                         # all sizes
+    python -m benchmarks.run --sizes small --repeat 20
+    python -m benchmarks.run --save benchmarks/baselines/local.json
+    python -m benchmarks.run --compare benchmarks/baselines/local.json
+
+--compare exits with status 1 when a benchmark's median got slower than
+the baseline by more than --threshold. Baselines are only comparable when
+recorded on the same machine and ledger version; each one stores the
+machine details it was recorded with, and --compare warns when they
+differ. Record baselines with the real ledger bindings and the versions
+pinned in requirements.txt; timings taken against anything else say
+nothing about the service. The HTTP benchmarks go through fastapi's
+TestClient, which needs httpx.
+"""
+
+from typing import Callable, Dict, List, Optional
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks.journal_generator import JournalSpec, generate_journal
+
+SIZES = {
+    "small": JournalSpec(years=1, accounts=50, depth=3, commodities=2, xacts_per_day=5),
+    "medium": JournalSpec(years=5, accounts=200, depth=4, commodities=5, xacts_per_day=10),
+    "large": JournalSpec(years=10, accounts=1000, depth=5, commodities=10, xacts_per_day=20),
+}
+
+Timings = Dict[str, float]
+
+
+def measure(fn: Callable[[], object], repeat: int, warmup: int = 1) -> Timings:
+    """Time fn repeat times after warmup untimed calls; seconds"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return {
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.fmean(samples),
+        "runs": repeat,
+    }
+
+
+def bench_service(journal_path: str, repeat: int) -> Dict[str, Timings]:
+    from services.ledger_service import LedgerService
+
+    results = {"service.load": measure(lambda: LedgerService(journal_path, watch="off"),
+                                        max(1, repeat // 5), warmup=0)}
+    service = LedgerService(journal_path, watch="off")
+    window_lower, window_upper = datetime.date(2015, 6, 1), datetime.date(2016, 1, 1)
+    cases = {
+        "service.get_balance": lambda: service.get_balance(None, None),
+        "service.get_balance.window": lambda: service.get_balance(window_lower, window_upper),
+        "service.get_balance.subtree": lambda: service.get_balance(None, None, "Despesas", 1),
+        "service.get_balance.exchange": lambda: service.get_balance(None, None, None, None, "BRL"),
+        "service.get_balance_windows.monthly": lambda: service.get_balance_windows(
+            (), "monthly", datetime.date(2015, 1, 1), datetime.date(2018, 1, 1)),
+        "service.render.get_balance": lambda: service.render("get_balance", None, None),
+        "service.iter_balance.ndjson": lambda: service.collect("iter_balance", None, None, True),
+        "service.get_prices": service.get_prices,
+        "service.get_price_history": lambda: service.get_price_history("CM00", None, None, None, None),
+        "service.get_price_history.monthly": lambda: service.get_price_history(
+            None, "Arroz", None, None, None, "monthly"),
+        "service.get_account_transactions": lambda: service.get_account_transactions(
+            "Ativos:Banco:Conta", window_lower, window_upper, None, 100),
+        "service.get_cash_flow.monthly": lambda: service.get_cash_flow("monthly", None, None),
+        "service.get_budget_report": lambda: service.get_budget_report(window_lower, window_upper),
+    }
+    for name, fn in cases.items():
+        results[name] = measure(fn, repeat)
+    service.close()
+
+    # Every run of the cases below grows the journal, so they work on a copy
+    # and leave journal_path as generated for the HTTP benchmarks
+    mutable_path = journal_path + ".mutable"
+    shutil.copyfile(journal_path, mutable_path)
+    service = LedgerService(mutable_path, watch="off")
+
+    def append_and_reload():
+        with open(mutable_path, "a", encoding="utf-8") as f:
+            f.write("\n2015/12/31 * Appended\n    Despesas:Appended  BRL 1.00\n    Ativos:Banco:Conta\n")
+        service.reload()
+    results["service.reload.append"] = measure(append_and_reload, repeat)
+
+    from models import LedgerTransactionInput
+    batch = tuple(
+        (LedgerTransactionInput(date=datetime.date(2015, 12, 31), description=f"Written {i}", postings=[
+            {"account": "Ativos:Banco:Conta", "amount": "-1.00", "commodity": "BRL"},
+            {"account": "Receitas:Salario"}]),)
+        for i in range(100))
+    results["service.write_transactions.batch100"] = measure(lambda: service.write_transactions(batch), repeat)
+    service.close()
+    return results
+
+
+def bench_http(journal_path: str, repeat: int) -> Dict[str, Timings]:
+    from fastapi.testclient import TestClient
+    from main import create_app
+
+    # Measure the work behind each endpoint, not the response cache
+    os.environ["LEDGER_WATCH"] = "off"
+    os.environ["LEDGER_CACHE_ENTRIES"] = "0"
+    urls = {
+        "http.balance": "/api/balance",
+        "http.balance.window": "/api/balance?after=2015-06-01&before=2016-01-01",
+        "http.balance.ndjson": "/api/balance?stream=ndjson",
+        "http.balance.exchange": "/api/balance?exchange=BRL",
+        "http.balance_windows.monthly": "/api/balance/windows?step=monthly&after=2015-01-01&before=2018-01-01",
+        "http.prices": "/api/prices",
+        "http.prices_history.monthly": "/api/prices/history?item=Arroz&step=monthly",
+        "http.transactions": "/api/transactions/Ativos:Banco:Conta?after=2015-06-01&limit=100",
+        "http.cash_flow.monthly": "/api/cash-flow?period=monthly",
+        "http.budget": "/api/budget?after=2015-06-01&before=2016-01-01",
+        "http.health": "/api/health",
+    }
+    results = {}
+    with TestClient(create_app(journal_path)) as client:
+        for name, url in urls.items():
+            def get(url=url):
+                response = client.get(url)
+                response.raise_for_status()
+            results[name] = measure(get, repeat)
+    return results
+
+
+def machine() -> Dict[str, object]:
+    """What the timings depend on besides the code: hardware and library versions"""
+    details: Dict[str, object] = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+    try:
+        with open("/proc/cpuinfo", encoding="utf-8") as f:
+            models = [line.split(":", 1)[1].strip() for line in f if line.startswith("model name")]
+        if models:
+            details["processor"] = models[0]
+    except OSError:
+        pass
+    try:
+        details["memory_mb"] = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 1024 ** 2
+    except (AttributeError, ValueError, OSError):
+        pass
+    for module in ("ledger", "numpy", "fastapi"):
+        try:
+            details[module] = getattr(__import__(module), "__version__", "unknown")
+        except ImportError:
+            details[module] = None
+    return details
+
+
+def run(sizes: List[str], repeat: int, http: bool, workdir: str, note: Optional[str] = None) -> dict:
+    results: Dict[str, Dict[str, Timings]] = {}
+    journal_sizes: Dict[str, int] = {}
+    for size in sizes:
+        spec = SIZES[size]
+        journal_path = os.path.join(workdir, f"{size}.ledger")
+        generate_journal(journal_path, spec)
+        journal_sizes[size] = os.path.getsize(journal_path)
+        print(f"{size}: {journal_sizes[size] / 1e6:.1f} MB journal", file=sys.stderr)
+        results[size] = bench_service(journal_path, repeat)
+        if http:
+            results[size].update(bench_http(journal_path, repeat))
+    return {
+        "meta": {
+            "recorded_at": datetime.datetime.now().isoformat(),
+            "machine": machine(),
+            "sizes": journal_sizes,
+            "repeat": repeat,
+            "note": note,
+        },
+        "results": results,
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> List[str]:
+    """Benchmarks whose median regressed by more than threshold (0.2 = 20%)"""
+    regressions = []
+    for size, benchmarks in current["results"].items():
+        for name, timings in benchmarks.items():
+            reference = baseline["results"].get(size, {}).get(name)
+            if reference is None:
+                continue
+            ratio = timings["median"] / reference["median"]
+            if ratio > 1 + threshold:
+                regressions.append(f"{size} {name}: {reference['median'] * 1000:.2f} ms -> "
+                                   f"{timings['median'] * 1000:.2f} ms ({ratio:.2f}x)")
+    return regressions
+
+
+def print_results(report: dict, baseline: Optional[dict]):
+    for size, benchmarks in report["results"].items():
+        print(f"\n{size}")
+        for name, timings in benchmarks.items():
+            line = f"  {name:<32} median {timings['median'] * 1000:10.2f} ms   min {timings['min'] * 1000:10.2f} ms"
+            reference = (baseline or {}).get("results", {}).get(size, {}).get(name)
+            if reference:
+                line += f"   {timings['median'] / reference['median']:.2f}x baseline"
+            print(line)
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the ledger service and API.")
+    parser.add_argument("--sizes", nargs="+", choices=sorted(SIZES), default=list(SIZES),
+                        help="Journal sizes to run (default: all)")
+    parser.add_argument("--repeat", type=int, default=10, help="Timed runs per benchmark (default: 10)")
+    parser.add_argument("--no-http", dest="http", action="store_false", help="Skip the HTTP benchmarks")
+    parser.add_argument("--save", metavar="PATH", help="Write the results as a baseline to PATH")
+    parser.add_argument("--compare", metavar="PATH", help="Compare against the baseline at PATH")
+    parser.add_argument("--note", help="Free-form note stored with --save, e.g. how the run was set up")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Allowed slowdown of the median before --compare fails (default: 0.2)")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = _parse_args()
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    with tempfile.TemporaryDirectory(prefix="ledger-bench-") as workdir:
+        report = run(args.sizes, args.repeat, args.http, workdir, args.note)
+    print_results(report, baseline)
+    if baseline is not None and baseline["meta"].get("machine") != report["meta"]["machine"]:
+        print("\nWarning: the baseline was recorded on another machine or library versions", file=sys.stderr)
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.save) or ".", exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved baseline to {args.save}")
+
+    if baseline is not None:
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print("\nRegressions:\n  " + "\n  ".join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
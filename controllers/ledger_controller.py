@@ -2,50 +2,235 @@
 # controllers/ledger_controller.py - FastAPI route handlers
 # ============================================================================
 
-from fastapi import APIRouter, HTTPException, Query, Path
-from services.ledger_service import LedgerService
+from fastapi import APIRouter, Depends, HTTPException, Query, Path, Request, Response
+from fastapi.responses import StreamingResponse
+from services.cash_flow_index import next_period_start
+from services.journal_registry import JournalRegistry, LoadedJournal
 from models import (
     LedgerBalanceResponse,
+    LedgerBalanceWindowsResponse,
     LedgerPriceResponse,
+    LedgerPriceHistoryResponse,
     LedgerTransactionResponse,
+    LedgerTransactionsRequest,
+    LedgerTransactionsWriteResponse,
     LedgerSubTotalsResponse,
     BudgetResponse,
     )
-from typing import Optional
-from datetime import date, datetime
-import traceback
+from typing import Dict, List, Optional
+from datetime import date, datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+import hashlib
+import logging
 
-router = APIRouter(prefix="/api", tags=["ledger"])
+logger = logging.getLogger(__name__)
 
+# Selects the journal of a request made under /api
+JOURNAL_HEADER = "X-Ledger-Journal"
+
+
+def _journal_segment(journal: str = Path(..., description="Name of the journal, as in LEDGER_JOURNALS")):
+    """Documents the {journal} path segment of the per-journal routes"""
+
+
+def create_ledger_router(journals: JournalRegistry, per_journal: bool = False) -> APIRouter:
+    """
+    Factory function to create router with injected journals. The routes
+    live under /api, serving the journal named by the X-Ledger-Journal
+    header or the default one, or with per_journal under
+    /api/journals/{journal}. Ledger work runs in the journal's executor;
+    the health check never waits on it. Serialized responses are served
+    from the journal's response cache while the journal generation they
+    were computed from is current.
+
+    Read endpoints carry an ETag derived from the journal generation and the
+    query params, plus the journal's Last-Modified time, and answer
+    conditional requests with 304 without doing any ledger work.
+    """
+    if per_journal:
+        router = APIRouter(prefix="/api/journals/{journal}", tags=["ledger"],
+                           dependencies=[Depends(_journal_segment)])
+    else:
+        router = APIRouter(prefix="/api", tags=["ledger"])
+
+    async def journal_of(request: Request) -> LoadedJournal:
+        name = request.path_params.get("journal") or request.headers.get(JOURNAL_HEADER)
+        return await journals.get(name)
+
+    def validators(journal: LoadedJournal, endpoint: str, args: tuple,
+                   generation: Optional[str] = None) -> Dict[str, str]:
+        """Validators of a response computed from generation, by default the current one"""
+        executor = journal.executor
+        generation = generation or executor.generation
+        tag = hashlib.sha1(repr((journal.name, endpoint, args, generation)).encode()).hexdigest()
+        modified = datetime.fromtimestamp(int(executor.modified_at), tz=timezone.utc)
+        return {
+            "ETag": f'"{tag}"',
+            "Last-Modified": format_datetime(modified, usegmt=True),
+            "Cache-Control": "no-cache",
+        }
+
+    def result_validators(journal: LoadedJournal, endpoint: str, args: tuple,
+                          generation: Optional[str]) -> Dict[str, str]:
+        """
+        Validators of a response the executor computed from generation.
+        One computed from another generation than the current one (a
+        worker that has not reloaded yet, or a reload while computing) gets
+        none, so it is never confirmed as current later on.
+        """
+        if generation is None or generation != journal.executor.generation:
+            return {"Cache-Control": "no-cache"}
+        return validators(journal, endpoint, args, generation)
+
+    def not_modified(request: Request, headers: Dict[str, str]) -> Optional[Response]:
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            candidates = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+            if "*" in candidates or headers["ETag"] in candidates:
+                return Response(status_code=304, headers=headers)
+            return None
+
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return None
+            if since.tzinfo is not None and parsedate_to_datetime(headers["Last-Modified"]) <= since:
+                return Response(status_code=304, headers=headers)
+        return None
+
+    async def streamed(journal: LoadedJournal, endpoint: str, method: str, media_type: str,
+                       *args) -> StreamingResponse:
+        """
+        Stream a ledger generator method. Its first chunk is awaited before
+        the response starts, so errors raised up to then (an unknown
+        account, a full queue) still get their own status code.
+        """
+        generation, chunks = await journal.executor.stream(method, *args)
+        headers = result_validators(journal, endpoint, args, generation)
+        return StreamingResponse(chunks, media_type=media_type, headers=headers)
+
+    async def cached_json(request: Request, endpoint: str, method: str, *args) -> Response:
+        journal = await journal_of(request)
+        unchanged = not_modified(request, validators(journal, endpoint, args))
+        if unchanged is not None:
+            return unchanged
+
+        generation = journal.executor.generation
+        body = journal.cache.get(endpoint, args, generation)
+        if body is None:
+            generation, body = await journal.executor.run("render", method, *args)
+            if generation is not None and generation == journal.executor.generation:
+                journal.cache.put(endpoint, args, generation, body)
+        return Response(content=body, media_type="application/json",
+                        headers=result_validators(journal, endpoint, args, generation))
 
-def create_ledger_router(ledger_service: LedgerService) -> APIRouter:
-    """Factory function to create router with injected service"""
-    
     @router.get("/balance", response_model=LedgerBalanceResponse)
     async def get_balance(
+            request: Request,
             before: Optional[date] = Query(None, description="Format: YYYY-MM-DD"),
             after: Optional[date] = Query(None, description="Format: YYYY-MM-DD"),
+            stream: Optional[str] = Query(None, pattern="^(json|ndjson)$",
+                                          description="Stream the tree as it is computed: json, or ndjson of flattened accounts"),
+            account: Optional[str] = Query(None, description="Full name of the subtree root, e.g. Ativos"),
+            depth: Optional[int] = Query(None, ge=0, description="Levels of subaccounts to list below the root"),
+            exchange: Optional[str] = Query(None, description="Value amounts in this commodity, e.g. BRL"),
+            as_of: Optional[date] = Query(None, description="Date of the prices used with exchange (default: end of the window). Format: YYYY-MM-DD"),
     ):
-        """Get balance for all accounts"""
+        """Get balance for all accounts, or for one subtree"""
         try:
-            return ledger_service.get_balance(after, before)
+            if stream:
+                journal = await journal_of(request)
+                args = (after, before, stream == "ndjson", account, depth, exchange, as_of)
+                unchanged = not_modified(request, validators(journal, "balance-stream", args))
+                if unchanged is not None:
+                    return unchanged
+                media_type = "application/x-ndjson" if stream == "ndjson" else "application/json"
+                return await streamed(journal, "balance-stream", "iter_balance", media_type, *args)
+            return await cached_json(request, "balance", "get_balance",
+                                     after, before, account, depth, exchange, as_of)
+        except HTTPException:
+            raise
         except Exception:
-            traceback.print_exc()
-    
-            trace = traceback.format_exc()
-            print(trace)            
+            logger.exception("Failed to get balance")
+            raise
+
+    @router.get("/balance/stream")
+    async def get_balance_stream(request: Request):
+        """
+        Server-Sent Events: the balance tree once ("balance"), then the
+        accounts whose totals changed after each journal reload ("delta")
+        """
+        journal = await journal_of(request)
+        events = journal.feed.subscribe()
+        # The first event is awaited here, so a failure still gets its own status code
+        first = await anext(events)
+
+        async def body():
+            try:
+                yield first
+                async for event in events:
+                    yield event
+            finally:
+                # Unsubscribe as soon as the client goes away
+                await events.aclose()
+
+        return StreamingResponse(body(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    @router.get("/balance/windows", response_model=LedgerBalanceWindowsResponse)
+    async def get_balance_windows(
+            request: Request,
+            window: Optional[List[str]] = Query(None, description="Repeatable; YYYY-MM-DD..YYYY-MM-DD, end exclusive, either side may be empty"),
+            step: Optional[str] = Query(None, pattern="^(daily|weekly|monthly|yearly)$",
+                                        description="Without windows: one window per period between after and before"),
+            before: Optional[date] = Query(None, description="Format: YYYY-MM-DD"),
+            after: Optional[date] = Query(None, description="Format: YYYY-MM-DD"),
+            account: Optional[str] = Query(None, description="Full name of the subtree root, e.g. Ativos"),
+            depth: Optional[int] = Query(None, ge=0, description="Levels of subaccounts to list below the root"),
+    ):
+        """Get balance trees for several windows in one pass"""
+        try:
+            return await cached_json(request, "balance-windows", "get_balance_windows",
+                                     tuple(window or ()), step, after, before, account, depth)
+        except HTTPException:
+            raise
+        except Exception:
+            logger.exception("Failed to get balance windows")
             raise
 
     @router.get("/prices", response_model=LedgerPriceResponse)
-    async def get_prices():
+    async def get_prices(request: Request):
         """Get prices for everything in Despesas:Supermercado:* and commodities"""
         try:
-            return ledger_service.get_prices()
+            # Resolved here so the date is part of the cache key and ETag
+            return await cached_json(request, "prices", "get_prices", date.today())
+        except HTTPException:
+            raise
         except Exception:
-            traceback.print_exc()
-    
-            trace = traceback.format_exc()
-            print(trace)            
+            logger.exception("Failed to get prices")
+            raise
+
+    @router.get("/prices/history", response_model=LedgerPriceHistoryResponse)
+    async def get_price_history(
+            request: Request,
+            commodity: Optional[str] = Query(None, description="Commodity, e.g. USDT"),
+            item: Optional[str] = Query(None, description="Grocery item under Despesas:Supermercado, e.g. Arroz"),
+            target: Optional[str] = Query(None, description="Only prices in this commodity, e.g. BRL"),
+            step: Optional[str] = Query(None, pattern="^(daily|weekly|monthly|yearly)$",
+                                        description="Keep only the last price of each period"),
+            before: Optional[date] = Query(None, description="Format: YYYY-MM-DD"),
+            after: Optional[date] = Query(None, description="Format: YYYY-MM-DD"),
+    ):
+        """Get the price history of a commodity or a grocery item"""
+        try:
+            return await cached_json(request, "prices-history", "get_price_history",
+                                     commodity, item, target, after, before, step)
+        except HTTPException:
+            raise
+        except Exception:
+            logger.exception("Failed to get price history")
             raise
 
     # @router.get("/balance/{account}", response_model=LedgerBalanceResponse)
@@ -58,41 +243,133 @@ def create_ledger_router(ledger_service: LedgerService) -> APIRouter:
     #         raise HTTPException(status_code=400, detail="Account parameter is required")
     #     return ledger_service.get_account_balance(account, period)
 
-    # @router.get("/transactions/{account}", response_model=LedgerTransactionResponse)
-    # async def get_account_transactions(
-    #     account: str = Path(..., description="Account name"),
-    #     period: Optional[str] = Query(None, description="Period filter")
-    # ):
-    #     """Get transactions for specific account"""
-    #     return ledger_service.get_account_transactions(account, period)
+    @router.get("/transactions/{account}", response_model=LedgerTransactionResponse)
+    async def get_account_transactions(
+            request: Request,
+            account: str = Path(..., description="Full account name, e.g. Ativos:Banco:Conta"),
+            before: Optional[date] = Query(None, description="Format: YYYY-MM-DD"),
+            after: Optional[date] = Query(None, description="Format: YYYY-MM-DD"),
+            cursor: Optional[str] = Query(None, description="nextCursor of the previous page"),
+            limit: int = Query(100, ge=1, le=1000, description="Page size"),
+    ):
+        """Get one page of the register of an account"""
+        try:
+            return await cached_json(request, "transactions", "get_account_transactions",
+                                     account, after, before, cursor, limit)
+        except HTTPException:
+            raise
+        except Exception:
+            logger.exception("Failed to get transactions")
+            raise
 
-    # @router.get("/cash-flow", response_model=LedgerSubTotalsResponse)
-    # async def get_cash_flow(
-    #     period: Optional[str] = Query(None, description="Period filter")
-    # ):
-    #     """Get cash flow for all accounts"""
-    #     return ledger_service.get_cash_flow(period)
+    @router.post("/transactions", response_model=LedgerTransactionsWriteResponse, status_code=201)
+    async def post_transactions(request: Request, body: LedgerTransactionsRequest):
+        """
+        Append transactions to the journal, all or none of them. Writes made
+        at the same time are batched into one append and fsync.
+        """
+        journal = await journal_of(request)
+        try:
+            generation = await journal.writer.write(tuple(body.transactions))
+        except HTTPException:
+            raise
+        except Exception:
+            logger.exception("Failed to write transactions")
+            raise
+        return LedgerTransactionsWriteResponse(
+            written=len(body.transactions),
+            generation=generation,
+            timestamp=datetime.now().isoformat(),
+        )
 
-    # @router.get("/cash-flow/{account}", response_model=LedgerSubTotalsResponse)
-    # async def get_account_cash_flow(
-    #     account: str = Path(..., description="Account name"),
-    #     period: Optional[str] = Query(None, description="Period filter")
-    # ):
-    #     """Get cash flow for specific account"""
-    #     if not account or not account.strip():
-    #         raise HTTPException(status_code=400, detail="Account parameter is required")
-    #     return ledger_service.get_cash_flow(period)
+    @router.get("/cash-flow", response_model=LedgerSubTotalsResponse)
+    async def get_cash_flow(
+            request: Request,
+            period: str = Query("monthly", pattern="^(daily|weekly|monthly|yearly)$",
+                                description="Bucket size: daily, weekly, monthly or yearly"),
+            before: Optional[date] = Query(None, description="Format: YYYY-MM-DD"),
+            after: Optional[date] = Query(None, description="Format: YYYY-MM-DD"),
+    ):
+        """Get cash flow for all accounts"""
+        try:
+            return await cached_json(request, "cash-flow", "get_cash_flow", period, after, before, None)
+        except HTTPException:
+            raise
+        except Exception:
+            logger.exception("Failed to get cash flow")
+            raise
 
-    # @router.get("/budget", response_model=BudgetResponse)
-    # async def get_budget_report(
-    #     period: Optional[str] = Query(None, description="Period for the budget report")
-    # ):
-    #     """Get budget vs actual spending report"""
-    #     return ledger_service.get_budget_report(period)
+    @router.get("/cash-flow/{account}", response_model=LedgerSubTotalsResponse)
+    async def get_account_cash_flow(
+            request: Request,
+            account: str = Path(..., description="Account name; its subaccounts are included"),
+            period: str = Query("monthly", pattern="^(daily|weekly|monthly|yearly)$",
+                                description="Bucket size: daily, weekly, monthly or yearly"),
+            before: Optional[date] = Query(None, description="Format: YYYY-MM-DD"),
+            after: Optional[date] = Query(None, description="Format: YYYY-MM-DD"),
+    ):
+        """Get cash flow for specific account"""
+        if not account or not account.strip():
+            raise HTTPException(status_code=400, detail="Account parameter is required")
+        try:
+            return await cached_json(request, "cash-flow", "get_cash_flow", period, after, before, account)
+        except HTTPException:
+            raise
+        except Exception:
+            logger.exception("Failed to get cash flow")
+            raise
+
+    @router.get("/budget", response_model=BudgetResponse)
+    async def get_budget_report(
+            request: Request,
+            before: Optional[date] = Query(None, description="Format: YYYY-MM-DD (default: end of the month)"),
+            after: Optional[date] = Query(None, description="Format: YYYY-MM-DD (default: start of this month)"),
+    ):
+        """Get budget vs actual spending report"""
+        try:
+            # Resolved here so the month is part of the cache key and ETag
+            if after is None:
+                after = (before or date.today()).replace(day=1)
+            if before is None:
+                before = next_period_start(after, 'monthly')
+            return await cached_json(request, "budget", "get_budget_report", after, before)
+        except HTTPException:
+            raise
+        except Exception:
+            logger.exception("Failed to get budget report")
+            raise
+
+    @router.get("/cache")
+    async def get_cache_stats(request: Request):
+        """Response cache counters"""
+        return (await journal_of(request)).cache.stats()
+
+    if not per_journal:
+        @router.get("/journals")
+        async def get_journals():
+            """Configured journals and whether they are loaded"""
+            loaded = {journal.name for journal in journals.loaded()}
+            return {
+                "default": journals.default_name,
+                "journals": [{"name": name, "loaded": name in loaded, "hot": name in journals.hot}
+                             for name in journals.journals],
+            }
 
     @router.get("/health")
-    async def get_health():
-        """Health check endpoint"""
+    async def get_health(request: Request, response: Response):
+        """
+        Health check endpoint. It never loads a journal: one that is not
+        loaded yet gets an answer without validators.
+        """
+        journal = journals.peek(request.path_params.get("journal") or request.headers.get(JOURNAL_HEADER))
+        if journal is not None:
+            headers = validators(journal, "health", ())
+            unchanged = not_modified(request, headers)
+            if unchanged is not None:
+                return unchanged
+            response.headers.update(headers)
+        else:
+            response.headers["Cache-Control"] = "no-cache"
         return {
             "status": "OK",
             "timestamp": datetime.now().isoformat(),
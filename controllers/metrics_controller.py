@@ -0,0 +1,31 @@
+# ============================================================================
+# controllers/metrics_controller.py - Prometheus metrics endpoint
+# ============================================================================
+
+from fastapi import APIRouter, Response
+from services.journal_registry import JournalRegistry
+from services.metrics import EXECUTOR_PENDING, REGISTRY
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def create_metrics_router(journals: JournalRegistry) -> APIRouter:
+    """
+    Router serving /metrics in the Prometheus text format.
+
+    Metrics are per process. In 'process' executor mode the journal load,
+    balance, price, serialization and journal size metrics are recorded in
+    the worker processes, which send them back with the result of each
+    call, so they show up here once a worker has answered a call since
+    recording them. With several uvicorn workers, each one exposes its
+    own. The journal size gauges are labelled with the journal name.
+    """
+    router = APIRouter(tags=["metrics"])
+    EXECUTOR_PENDING.set_function(lambda: journals.pending)
+
+    @router.get("/metrics", include_in_schema=False)
+    async def get_metrics():
+        """Metrics of this process"""
+        return Response(content=REGISTRY.expose(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+    return router
@@ -5,12 +5,24 @@
 import os
 import logging
 import argparse
+import tempfile
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+from services.journal_registry import (
+    DEFAULT_JOURNAL_NAME,
+    MEMORY_PER_TEXT_BYTE,
+    JournalRegistry,
+    parse_journals,
+    )
+from services.ledger_executor import LedgerExecutor
 from services.ledger_service import LedgerService
+from services.response_cache import ResponseCache
+from services.metrics import MetricsMiddleware
+from services.tracing import TRACE_HEADER, TraceMiddleware, configure_logging
 from controllers.ledger_controller import create_ledger_router
+from controllers.metrics_controller import create_metrics_router
 
 DEFAULT_JOURNAL = "/app/ledger-data/main.ledger"
 
@@ -19,11 +31,50 @@ def create_app(journal_path: str | None = None) -> FastAPI:
     """
     App factory. If journal_path is None, resolve from env or default.
     This is safe for uvicorn --factory usage.
+
+    The journal and its includes are watched and reloaded on change;
+    LEDGER_WATCH selects the watcher (auto, inotify, poll or off). Text
+    appended to the journal file is applied without a full parse unless
+    LEDGER_INCREMENTAL=0. With LEDGER_CACHE_FILE set, the parsed journal is
+    also kept in that file: a restart against an unchanged journal serves
+    it at once while the journal content is checked in the background.
+
+    Ledger work runs in an executor configured from the environment:
+    LEDGER_EXECUTOR (thread or process), LEDGER_EXECUTOR_WORKERS (process
+    mode pool size), LEDGER_EXECUTOR_QUEUE (max queued calls) and
+    LEDGER_REQUEST_TIMEOUT (seconds). Responses are cached per journal
+    generation, up to LEDGER_CACHE_ENTRIES entries and LEDGER_CACHE_BYTES
+    bytes.
+
+    LEDGER_LOG_LEVEL sets the log level; at DEBUG, balance requests also log
+    per-subtree timings. With LEDGER_TRACE=1 every request gets a trace id
+    (X-Request-ID, taken from the request or generated) that is included in
+    the log lines written while serving it.
+
+    Identical ledger calls in flight at the same time share one
+    computation. Prometheus metrics (request counts and latency per route,
+    in-flight requests, Server-Sent Events connection lifetimes, executed
+    and coalesced ledger calls, journal load, balance, price and
+    serialization timings and journal size) are served at /metrics.
+
+    When LEDGER_SNAPSHOT_FILE is set the journal is not parsed here: the
+    app maps that snapshot and follows it instead (see run_workers).
+
+    More journals can be served next to this one, the "default" journal:
+    LEDGER_JOURNALS lists them as name=path pairs separated by commas. A
+    request picks one with the X-Ledger-Journal header or by calling the
+    same routes under /api/journals/{name}. Those journals are loaded on
+    first use, except the ones named in LEDGER_JOURNALS_HOT, which are
+    loaded at start. When their estimated memory exceeds
+    LEDGER_JOURNALS_MAX_MB, journals unused for LEDGER_JOURNALS_IDLE_SECONDS
+    are closed, checked after each load and every minute. The estimate is
+    LEDGER_JOURNALS_MEMORY_FACTOR (default 24) bytes per byte of journal
+    text. The snapshot and cache files only apply to the default journal.
+    In thread mode the journals share ledger's single parsed session, so
+    switching between them turns incremental reloads into full parses;
+    process mode does not have that cost.
     """
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    )
+    configure_logging(os.getenv("LEDGER_LOG_LEVEL", "INFO"))
 
     resolved = journal_path or os.getenv("LEDGER_JOURNAL_FILE", DEFAULT_JOURNAL)
     logging.info("Using journal file: %s", resolved)
@@ -40,15 +91,87 @@ def create_app(journal_path: str | None = None) -> FastAPI:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["ETag", "Last-Modified", TRACE_HEADER],
     )
+    if os.getenv("LEDGER_TRACE", "0") == "1":
+        app.add_middleware(TraceMiddleware)
+    app.add_middleware(MetricsMiddleware)
+
+    journals = parse_journals(os.getenv("LEDGER_JOURNALS", ""))
+    if DEFAULT_JOURNAL_NAME in journals:
+        raise ValueError(f"LEDGER_JOURNALS cannot redefine the {DEFAULT_JOURNAL_NAME} journal")
+    journals = {DEFAULT_JOURNAL_NAME: resolved, **journals}
+
+    def create_executor(name: str, path: str) -> LedgerExecutor:
+        default = name == DEFAULT_JOURNAL_NAME
+        return LedgerExecutor(
+            path,
+            mode=os.getenv("LEDGER_EXECUTOR", "thread"),
+            workers=int(os.getenv("LEDGER_EXECUTOR_WORKERS", "2")),
+            max_queue=int(os.getenv("LEDGER_EXECUTOR_QUEUE", "32")),
+            timeout=float(os.getenv("LEDGER_REQUEST_TIMEOUT", "30")),
+            watch=os.getenv("LEDGER_WATCH", "auto"),
+            snapshot_path=os.getenv("LEDGER_SNAPSHOT_FILE") if default else None,
+            incremental=os.getenv("LEDGER_INCREMENTAL", "1") == "1",
+            cache_path=os.getenv("LEDGER_CACHE_FILE") if default else None,
+            journal_name=name,
+        )
+
+    def create_cache() -> ResponseCache:
+        return ResponseCache(
+            max_entries=int(os.getenv("LEDGER_CACHE_ENTRIES", "256")),
+            max_bytes=int(os.getenv("LEDGER_CACHE_BYTES", str(64 * 1024 * 1024))),
+        )
 
-    # Initialize service only now (after path is final)
-    ledger_service = LedgerService(resolved)
-    ledger_router = create_ledger_router(ledger_service)
-    app.include_router(ledger_router)
+    # Initialize services only now (after paths are final)
+    registry = JournalRegistry(
+        journals, create_executor, create_cache,
+        hot=[name for name in os.getenv("LEDGER_JOURNALS_HOT", "").split(",") if name],
+        max_bytes=int(os.getenv("LEDGER_JOURNALS_MAX_MB", "2048")) * 1024 * 1024,
+        idle_seconds=float(os.getenv("LEDGER_JOURNALS_IDLE_SECONDS", "300")),
+        memory_per_text_byte=float(os.getenv("LEDGER_JOURNALS_MEMORY_FACTOR", str(MEMORY_PER_TEXT_BYTE))),
+    )
+    app.include_router(create_ledger_router(registry))
+    app.include_router(create_ledger_router(registry, per_journal=True))
+    app.include_router(create_metrics_router(registry))
+    app.add_event_handler("startup", registry.start)
+    app.add_event_handler("shutdown", registry.close)
     return app
 
 
+def run_workers(journal_path: str, host: str, port: int, workers: int,
+                snapshot_path: str | None = None):
+    """
+    Serve with several uvicorn worker processes sharing one parse.
+
+    The journal is parsed once in this process and written as a read-only
+    snapshot; the workers (create_app through uvicorn's factory support)
+    map it instead of parsing the journal themselves. This process keeps
+    watching the journal and rewrites the snapshot on change, which the
+    workers pick up.
+    """
+    configure_logging(os.getenv("LEDGER_LOG_LEVEL", "INFO"))
+    snapshot_path = snapshot_path or os.path.join(
+        tempfile.gettempdir(), f"ledger-snapshot-{os.getpid()}.bin")
+
+    ledger_service = LedgerService(journal_path, watch=os.getenv("LEDGER_WATCH", "auto"),
+                                   incremental=os.getenv("LEDGER_INCREMENTAL", "1") == "1",
+                                   cache_path=os.getenv("LEDGER_CACHE_FILE"))
+    ledger_service.write_snapshot(snapshot_path)
+    ledger_service.add_reload_listener(lambda state: ledger_service.write_snapshot(snapshot_path))
+    logging.info("Wrote journal snapshot to %s", snapshot_path)
+
+    os.environ["LEDGER_JOURNAL_FILE"] = journal_path
+    os.environ["LEDGER_SNAPSHOT_FILE"] = snapshot_path
+
+    import uvicorn
+    try:
+        uvicorn.run("main:create_app", factory=True, host=host, port=port, workers=workers)
+    finally:
+        ledger_service.close()
+        os.remove(snapshot_path)
+
+
 def _parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Run Ledger API server.")
     parser.add_argument(
@@ -65,12 +188,25 @@ def _parse_args() -> argparse.Namespace:
         "--port", type=int, default=3000,
         help="Server port (default: 3000)",
     )
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="Worker processes sharing one parsed journal snapshot (default: 1)",
+    )
+    parser.add_argument(
+        "--snapshot",
+        metavar="PATH",
+        help="Where to write the shared journal snapshot when --workers > 1 (default: a temp file)",
+    )
     return parser.parse_args()
 
 
 if __name__ == "__main__":
     args = _parse_args()
-    app = create_app(args.journal)
+    if args.workers > 1:
+        journal = args.journal or os.getenv("LEDGER_JOURNAL_FILE", DEFAULT_JOURNAL)
+        run_workers(journal, args.host, args.port, args.workers, args.snapshot)
+    else:
+        app = create_app(args.journal)
 
-    import uvicorn
-    uvicorn.run(app, host=args.host, port=args.port)
+        import uvicorn
+        uvicorn.run(app, host=args.host, port=args.port)
@@ -2,9 +2,9 @@
 # models.py - Pydantic models for request/response types
 # ============================================================================
 
-from pydantic import BaseModel, Field, PrivateAttr
+from pydantic import BaseModel, Field
 from typing import Optional, List, Dict
-import ledger
+import datetime
 
 class LedgerAccount(BaseModel):
     account: str
@@ -12,32 +12,11 @@ class LedgerAccount(BaseModel):
     amounts: Dict[str, str]
     cleared_amounts: Dict[str, str] = Field(alias="clearedAmounts")
     last_cleared_date: Optional[str] = Field(None, alias="lastClearedDate")
-    _amount_values: Dict[str, ledger.Value] = PrivateAttr(default = [])
-    _cleared_amount_values: Dict[str, ledger.Value] = PrivateAttr(default = [])
-
-    def get_amount_values(self) -> Dict[str, ledger.Value]:
-        return self._amount_values
-    def get_cleared_amount_values(self) -> Dict[str, ledger.Value]:
-        return self._cleared_amount_values
-
     children: List['LedgerAccount'] = Field(default_factory=list)
 
     class Config:
         populate_by_name = True
 
-    @classmethod
-    def with_amount_values(
-        cls,
-        *,
-        amount_values: Dict[str, ledger.Value],
-        cleared_amount_values: Dict[str, ledger.Value],
-        **data
-    ) -> "LedgerAccount":
-        obj = cls(**data)
-        obj._amount_values = amount_values
-        obj._cleared_amount_values = cleared_amount_values
-        return obj
-
 class LedgerPrice(BaseModel):
     what: str
     amounts: Dict[str, str]
@@ -47,17 +26,41 @@ class LedgerPriceResponse(BaseModel):
     prices: List[LedgerPrice]
     timestamp: str
 
+class LedgerPricePoint(BaseModel):
+    date: str
+    price: str
+
+class LedgerPriceSeries(BaseModel):
+    target: str
+    points: List[LedgerPricePoint]
+
+class LedgerPriceHistoryResponse(BaseModel):
+    what: str
+    is_commodity: bool
+    step: Optional[str]
+    series: List[LedgerPriceSeries]
+    timestamp: str
+
 class LedgerBalanceResponse(BaseModel):
     account: LedgerAccount
     timestamp: str
 
+class LedgerBalanceWindow(BaseModel):
+    after: Optional[str]
+    before: Optional[str]
+    account: LedgerAccount
+
+class LedgerBalanceWindowsResponse(BaseModel):
+    windows: List[LedgerBalanceWindow]
+    timestamp: str
+
 class LedgerTransactionNode(BaseModel):
     date: str
     description: str
-    amount: float
-    formatted_amount: str = Field(alias="formattedAmount")
-    running_balance: float = Field(alias="runningBalance")
-    formatted_running_balance: str = Field(alias="formattedRunningBalance")
+    commodity: str
+    amount: str
+    running_balance: str = Field(alias="runningBalance")
+    cleared: bool
 
     class Config:
         populate_by_name = True
@@ -66,15 +69,43 @@ class LedgerTransactionNode(BaseModel):
 class LedgerTransactionResponse(BaseModel):
     transactions: List[LedgerTransactionNode]
     account: str
-    period: Optional[str]
+    next_cursor: Optional[str] = Field(None, alias="nextCursor")
+    timestamp: str
+
+    class Config:
+        populate_by_name = True
+
+
+class LedgerPostingInput(BaseModel):
+    account: str
+    amount: Optional[str] = Field(None, description="Decimal amount, e.g. -12.50; left out on at most one posting")
+    commodity: Optional[str] = None
+
+
+class LedgerTransactionInput(BaseModel):
+    date: datetime.date
+    description: str
+    cleared: bool = False
+    postings: List[LedgerPostingInput] = Field(min_length=2)
+
+
+class LedgerTransactionsRequest(BaseModel):
+    transactions: List[LedgerTransactionInput] = Field(min_length=1, max_length=1000)
+
+
+class LedgerTransactionsWriteResponse(BaseModel):
+    written: int
+    generation: str
     timestamp: str
 
 
 class LedgerSubTotalNode(BaseModel):
-    description: str
-    inflow_amount: float = Field(alias="inflowAmount")
-    outflow_amount: float = Field(alias="outflowAmount")
-    running_balance: float = Field(alias="runningBalance")
+    date: str
+    full_path: str = Field(alias="fullPath")
+    commodity: str
+    inflow_amount: str = Field(alias="inflowAmount")
+    outflow_amount: str = Field(alias="outflowAmount")
+    running_balance: str = Field(alias="runningBalance")
 
     class Config:
         populate_by_name = True
@@ -0,0 +1,147 @@
+# ============================================================================
+# services/balance_feed.py - Balance changes pushed as Server-Sent Events
+# ============================================================================
+
+from typing import AsyncIterator, Dict, Optional, Set, Tuple
+import asyncio
+import json
+import logging
+
+from services.ledger_executor import LedgerExecutor
+from services.metrics import BALANCE_STREAM_SUBSCRIBERS
+
+logger = logging.getLogger(__name__)
+
+# Comment line sent to idle subscribers so proxies keep the connection open
+KEEPALIVE_SECONDS = 15.0
+# Events a subscriber may fall behind by before it is sent the whole tree again
+MAX_BACKLOG = 32
+# In process mode the workers reload on their own, shortly after this
+# process sees the change; how long to wait for them
+WORKER_RELOAD_WAIT = 0.2
+WORKER_RELOAD_TRIES = 25
+
+
+def sse_event(event: str, data: bytes, event_id: Optional[str] = None) -> bytes:
+    """One Server-Sent Event; data must be a single line"""
+    head = b'event: %s\n' % event.encode()
+    if event_id is not None:
+        head += b'id: %s\n' % event_id.encode()
+    return head + b'data: ' + data + b'\n\n'
+
+
+class BalanceFeed:
+    """
+    Balance tree of one journal, followed across reloads for any number of
+    subscribers.
+
+    A subscriber first gets the whole tree (a "balance" event holding the
+    /api/balance response), then a "delta" event after every reload that
+    changed any total: the accounts whose amounts or cleared amounts
+    changed, in the NDJSON form of /api/balance, and the names of those
+    that are gone. Each delta is computed and encoded once per reload and
+    the same bytes are queued for every subscriber, so idle subscribers
+    cost a queue each and nothing while the journal does not change. A
+    subscriber that falls more than MAX_BACKLOG events behind is sent the
+    whole tree again instead.
+
+    The feed only follows the journal while it has subscribers. Methods
+    other than the reload listener must be called from the event loop.
+    """
+
+    def __init__(self, executor: LedgerExecutor):
+        self.executor = executor
+        self._subscribers: Set[asyncio.Queue] = set()
+        # (generation, balance event, JSON of every account by full name)
+        self._current: Optional[Tuple[str, bytes, Dict[str, bytes]]] = None
+        self._refreshing: Optional[asyncio.Task] = None
+        self._stale = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        executor.add_reload_listener(self._reloaded)
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    def _reloaded(self):
+        # Called from a watcher or ledger thread
+        loop = self._loop
+        if loop is not None and self._subscribers:
+            loop.call_soon_threadsafe(self._schedule_refresh)
+
+    def _schedule_refresh(self) -> asyncio.Task:
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.ensure_future(self._refresh())
+            self._refreshing.add_done_callback(self._refreshed)
+        else:
+            # Reloaded while computing: look again once done
+            self._stale = True
+        return self._refreshing
+
+    def _refreshed(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Could not refresh the balance feed: %s", task.exception())
+
+    async def _refresh(self):
+        while True:
+            self._stale = False
+            for _ in range(WORKER_RELOAD_TRIES):
+                generation, tree, entries = await self.executor.run("get_balance_feed")
+                if generation == self.executor.generation:
+                    break
+                await asyncio.sleep(WORKER_RELOAD_WAIT)
+            self._update(generation, tree, dict(entries))
+            if not self._stale:
+                return
+
+    def _update(self, generation: str, tree: bytes, entries: Dict[str, bytes]):
+        previous = self._current
+        balance = sse_event("balance", tree, generation)
+        self._current = (generation, balance, entries)
+        if previous is None:
+            return
+
+        old = previous[2]
+        changed = [line for account, line in entries.items() if old.get(account) != line]
+        removed = [account for account in old if account not in entries]
+        if not changed and not removed:
+            return
+        delta = sse_event("delta", b'{"generation":%s,"previous":%s,"changed":[%s],"removed":%s}' % (
+            json.dumps(generation).encode(), json.dumps(previous[0]).encode(),
+            b','.join(changed), json.dumps(removed).encode()), generation)
+        logger.debug("Balance delta %s -> %s: %d changed, %d removed accounts",
+                     previous[0], generation, len(changed), len(removed))
+
+        for queue in self._subscribers:
+            if queue.full():
+                # Too far behind: start it over from the current tree
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(balance)
+            else:
+                queue.put_nowait(delta)
+
+    async def subscribe(self) -> AsyncIterator[bytes]:
+        """Events for one subscriber, until it goes away"""
+        self._loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=MAX_BACKLOG)
+        self._subscribers.add(queue)
+        BALANCE_STREAM_SUBSCRIBERS.inc()
+        try:
+            if self._refreshing is not None and not self._refreshing.done():
+                await asyncio.shield(self._refreshing)
+            elif self._current is None or self._current[0] != self.executor.generation:
+                await asyncio.shield(self._schedule_refresh())
+            # Whatever was queued while refreshing is already part of this tree
+            while not queue.empty():
+                queue.get_nowait()
+            yield self._current[1]
+
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b': keepalive\n\n'
+        finally:
+            self._subscribers.discard(queue)
+            BALANCE_STREAM_SUBSCRIBERS.dec()
@@ -0,0 +1,241 @@
+# ============================================================================
+# services/balance_index.py - Precomputed per-account balance index
+# ============================================================================
+
+from bisect import bisect_left, bisect_right, insort
+from decimal import Decimal
+from itertools import accumulate
+from operator import sub
+from typing import Dict, List, Optional, Sequence, Tuple
+import datetime
+import heapq
+import ledger
+
+# Quantity commodities are booked at their cost in balances (see
+# posting_amount), so groceries show up as money and not as kg/un.
+QUANTITY_COMMODITIES = ('kg', 'un')
+
+
+def posting_amount(post) -> ledger.Amount:
+    """Amount a posting contributes to its account balance"""
+    amount = post.amount
+    if str(amount.commodity) in QUANTITY_COMMODITIES:
+        amount = post.given_cost if post.given_cost else post.amount
+    return amount
+
+
+def to_decimal(amount) -> Decimal:
+    """Exact decimal quantity of a ledger amount, without its commodity"""
+    return Decimal(amount.number().to_fullstring())
+
+
+def decimal_scale(value: Decimal) -> int:
+    """Number of fractional digits needed to represent value exactly"""
+    exponent = value.as_tuple().exponent
+    return -exponent if exponent < 0 else 0
+
+
+def format_scaled(value: int, scale: int) -> str:
+    """
+    Format an integer amount scaled by 10 ** scale the way ledger prints
+    bare numbers, like format(Decimal, 'f') with zero written as '0'
+    """
+    if not value:
+        return '0'
+    if not scale:
+        return str(value)
+    digits = str(abs(value)).rjust(scale + 1, '0')
+    return ('-' if value < 0 else '') + digits[:-scale] + '.' + digits[-scale:]
+
+
+def _merged_series(dates: List[int], totals: List[int], cleared: List[int],
+                   additions: List[Tuple[int, int, bool]]) -> Tuple[List[int], List[int], List[int]]:
+    """
+    Dates and running totals of a series with additions (date ordinal,
+    scaled amount, cleared) merged in after the existing postings of the
+    same day, in one pass from the first addition on.
+    """
+    additions = sorted(additions, key=lambda addition: addition[0])
+    first = bisect_right(dates, additions[0][0])
+    base_total = totals[first - 1] if first else 0
+    base_cleared = cleared[first - 1] if first else 0
+    # Running totals back to the amounts of each posting
+    own_totals = map(sub, totals[first:], [base_total] + totals[first:-1])
+    own_cleared = map(sub, cleared[first:], [base_cleared] + cleared[first:-1])
+    merged = list(heapq.merge(
+        zip(dates[first:], own_totals, own_cleared),
+        ((ordinal, scaled, scaled if is_cleared else 0) for ordinal, scaled, is_cleared in additions),
+        key=lambda posting: posting[0]))
+    return (dates[:first] + [posting[0] for posting in merged],
+            totals[:first] + list(accumulate((posting[1] for posting in merged), initial=base_total))[1:],
+            cleared[:first] + list(accumulate((posting[2] for posting in merged), initial=base_cleared))[1:])
+
+
+class BalanceIndex:
+    """
+    Read-only balance index built once per journal load.
+
+    Postings are stored column-wise, grouped by (account, commodity) and
+    sorted by date inside each group. Amounts are integers scaled by
+    10 ** scales[commodity], and totals/cleared hold the running sum of
+    the group up to and including each posting. The balance of an account
+    over any [start, end) window is therefore two binary searches on the
+    group's dates and one subtraction, without touching ledger objects.
+
+    keys, when given, are the search keys BalanceTable derives from the
+    dates (see balance_table.series_keys), as stored in a snapshot, so the
+    processes mapping it share them instead of each building their own.
+    """
+
+    def __init__(self,
+                 children: Dict[str, List[str]],
+                 series: Dict[str, Dict[str, Tuple[int, int]]],
+                 scales: Dict[str, int],
+                 dates: Sequence[int],
+                 totals: Sequence[int],
+                 cleared: Sequence[int],
+                 keys: Optional[Sequence[int]] = None):
+        self.children = children
+        self.series = series
+        self.scales = scales
+        self.dates = dates
+        self.totals = totals
+        self.cleared = cleared
+        self.keys = keys
+
+    @classmethod
+    def from_journal(cls, journal) -> "BalanceIndex":
+        children: Dict[str, List[str]] = {}
+        groups: Dict[str, Dict[str, List[Tuple[int, Decimal, bool]]]] = {}
+        scales: Dict[str, int] = {}
+
+        stack = [journal.master]
+        while stack:
+            account = stack.pop()
+            full_path = account.fullname()
+            subaccounts = list(account.accounts())
+            children[full_path] = [a.fullname() for a in subaccounts]
+            stack.extend(reversed(subaccounts))
+
+            for post in account.posts():
+                if not post.amount.number().is_nonzero():
+                    continue
+                amount = posting_amount(post)
+                commodity = str(amount.commodity)
+                value = to_decimal(amount)
+                scales[commodity] = max(scales.get(commodity, 0), decimal_scale(value))
+                groups.setdefault(full_path, {}).setdefault(commodity, []).append(
+                    (post.date.toordinal(), value, str(post.state) == 'Cleared'))
+
+        series: Dict[str, Dict[str, Tuple[int, int]]] = {}
+        dates: List[int] = []
+        totals: List[int] = []
+        cleared: List[int] = []
+        for full_path, by_commodity in groups.items():
+            for commodity, postings in by_commodity.items():
+                postings.sort(key=lambda p: p[0])
+                factor = 10 ** scales[commodity]
+                start = len(dates)
+                total = 0
+                cleared_total = 0
+                for ordinal, value, is_cleared in postings:
+                    scaled = int(value * factor)
+                    total += scaled
+                    if is_cleared:
+                        cleared_total += scaled
+                    dates.append(ordinal)
+                    totals.append(total)
+                    cleared.append(cleared_total)
+                series.setdefault(full_path, {})[commodity] = (start, len(dates))
+
+        return cls(children, series, scales, dates, totals, cleared)
+
+    def _bounds(self, start: int, end: int,
+                lower: Optional[datetime.date], upper: Optional[datetime.date]) -> Tuple[int, int]:
+        lo = bisect_left(self.dates, lower.toordinal(), start, end) if lower else start
+        hi = bisect_left(self.dates, upper.toordinal(), start, end) if upper else end
+        return lo, hi
+
+    def _sum(self, running: Sequence[int], start: int, lo: int, hi: int) -> int:
+        before = running[lo - 1] if lo > start else 0
+        return running[hi - 1] - before
+
+    def window(self, account: str,
+               lower: Optional[datetime.date],
+               upper: Optional[datetime.date]) -> Dict[str, Tuple[Decimal, Decimal]]:
+        """
+        Total and cleared amount per commodity of the account's own postings
+        dated in [lower, upper). Commodities without postings in the window
+        are left out.
+        """
+        result: Dict[str, Tuple[Decimal, Decimal]] = {}
+        for commodity, (start, end) in self.series.get(account, {}).items():
+            lo, hi = self._bounds(start, end, lower, upper)
+            if lo >= hi:
+                continue
+            scale = self.scales[commodity]
+            result[commodity] = (
+                Decimal(self._sum(self.totals, start, lo, hi)).scaleb(-scale),
+                Decimal(self._sum(self.cleared, start, lo, hi)).scaleb(-scale),
+            )
+        return result
+
+    def delta(self) -> "BalanceIndex":
+        """
+        Empty index on the same accounts and scales, to collect postings
+        appended after this index was built (see BalanceTable.with_delta)
+        """
+        return BalanceIndex(self.children, {}, self.scales, [], [], [])
+
+    def with_postings(self, postings: List[Tuple[str, int, str, Decimal, bool]]) -> "BalanceIndex":
+        """
+        Copy of the index with postings (account, date ordinal, commodity,
+        amount, cleared) added after the existing postings of the same day.
+        Raises ValueError when an amount needs more decimal places than
+        its commodity has so far, which would rescale every total.
+        """
+        scales = dict(self.scales)
+        added: Dict[str, Dict[str, List[Tuple[int, int, bool]]]] = {}
+        for account, ordinal, commodity, value, is_cleared in postings:
+            scale = decimal_scale(value)
+            if commodity in self.scales and scale > self.scales[commodity]:
+                raise ValueError(f"{commodity} amount needs {scale} decimal places")
+            scales[commodity] = max(scales.get(commodity, 0), scale)
+        for account, ordinal, commodity, value, is_cleared in postings:
+            added.setdefault(account, {}).setdefault(commodity, []).append(
+                (ordinal, int(value * 10 ** scales[commodity]), is_cleared))
+
+        children = dict(self.children)
+        for account in added:
+            path = account.split(':')
+            for depth in range(len(path)):
+                name = ':'.join(path[:depth + 1])
+                if name in children:
+                    continue
+                children[name] = []
+                parent = ':'.join(path[:depth])
+                children[parent] = list(children.get(parent, []))
+                insort(children[parent], name)
+
+        series: Dict[str, Dict[str, Tuple[int, int]]] = {}
+        dates: List[int] = []
+        totals: List[int] = []
+        cleared: List[int] = []
+        groups = [(a, c, bounds) for a, by_commodity in self.series.items() for c, bounds in by_commodity.items()]
+        groups += [(a, c, None) for a, by_commodity in added.items()
+                   for c in by_commodity if c not in self.series.get(a, {})]
+        for account, commodity, bounds in groups:
+            start, end = bounds or (0, 0)
+            group_dates = list(self.dates[start:end])
+            group_totals = list(self.totals[start:end])
+            group_cleared = list(self.cleared[start:end])
+            additions = added.get(account, {}).get(commodity)
+            if additions:
+                group_dates, group_totals, group_cleared = _merged_series(
+                    group_dates, group_totals, group_cleared, additions)
+            series.setdefault(account, {})[commodity] = (len(dates), len(dates) + len(group_dates))
+            dates.extend(group_dates)
+            totals.extend(group_totals)
+            cleared.extend(group_cleared)
+
+        return BalanceIndex(children, series, scales, dates, totals, cleared)
@@ -0,0 +1,317 @@
+# ============================================================================
+# services/balance_table.py - Dense per-account balance rollups
+# ============================================================================
+
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Dict, Iterator, List, Optional, Tuple
+import datetime
+
+import numpy as np
+
+from services.balance_index import BalanceIndex, format_scaled
+from services.cash_flow_index import int_column
+
+# Dates are packed below the series start in the search keys; ordinals fit in 32 bits
+_KEY_SHIFT = 32
+
+# Fractional digits of exchanged totals in a commodity no posting uses
+_DEFAULT_EXCHANGE_SCALE = 2
+
+# Most (account, window, commodity) cells rolled up at once by windows;
+# more windows than fit are computed a chunk at a time
+MAX_WINDOW_CELLS = 1 << 22
+
+
+class BalanceWindow:
+    """
+    Balances of every account over one window, as (account row, commodity
+    column) arrays of scaled integers. amounts and cleared hold the totals
+    of each account's subtree; amount_shown and cleared_shown flag the
+    commodities its JSON lists: those it has postings in itself (for
+    cleared, a non-zero own cleared total) or a child has a non-zero total
+    in.
+
+    With an exchange (see exchanged), the listed commodities that can be
+    converted are reported as one total in the target commodity.
+    """
+
+    def __init__(self, table: "BalanceTable", amounts: np.ndarray, cleared: np.ndarray,
+                 amount_shown: np.ndarray, cleared_shown: np.ndarray,
+                 exchange: Optional[Tuple[str, Dict[str, Decimal]]] = None):
+        self.table = table
+        self.amounts = amounts
+        self.cleared = cleared
+        self.amount_shown = amount_shown
+        self.cleared_shown = cleared_shown
+        self.exchange = exchange
+        self._amounts_of: Optional[List[Dict[str, str]]] = None
+        self._cleared_of: Optional[List[Dict[str, str]]] = None
+
+    def exchanged(self, target: str, rates: Dict[str, Decimal]) -> "BalanceWindow":
+        """
+        The same balances valued in target, rates giving the value of one
+        unit of each convertible commodity (PriceIndex.conversion_rates).
+        """
+        return BalanceWindow(self.table, self.amounts, self.cleared, self.amount_shown,
+                             self.cleared_shown, (target, rates))
+
+    def _formatted(self, totals: np.ndarray, shown: np.ndarray) -> List[Dict[str, str]]:
+        """Listed totals of every row, formatted in one pass"""
+        commodities = self.table.commodities
+        scales = self.table.scales
+        formatted: List[Dict[str, str]] = [{} for _ in self.table.accounts]
+        rows, cols = np.nonzero(shown)
+        if self.exchange is None:
+            for row, col, total in zip(rows.tolist(), cols.tolist(), totals[rows, cols].tolist()):
+                formatted[row][commodities[col]] = format_scaled(total, scales[col])
+            return formatted
+
+        target, rates = self.exchange
+        # Per column: (value of one scaled unit in target) or None if not convertible
+        unit_values = [rates[c].scaleb(-scales[i]) if c in rates else None for i, c in enumerate(commodities)]
+        values: Dict[int, Decimal] = {}
+        for row, col, total in zip(rows.tolist(), cols.tolist(), totals[rows, cols].tolist()):
+            unit_value = unit_values[col]
+            if unit_value is None:
+                formatted[row][commodities[col]] = format_scaled(total, scales[col])
+            else:
+                values[row] = values.get(row, Decimal(0)) + total * unit_value
+
+        target_col = self.table.columns.get(target)
+        scale = scales[target_col] if target_col is not None else _DEFAULT_EXCHANGE_SCALE
+        quantum = Decimal(1).scaleb(-scale)
+        for row, value in values.items():
+            amounts = formatted[row]
+            amounts[target] = format_scaled(int(value.quantize(quantum, ROUND_HALF_UP).scaleb(scale)), scale)
+            if len(amounts) > 1:
+                formatted[row] = dict(sorted(amounts.items()))
+        return formatted
+
+    def amounts_of(self, row: int) -> Dict[str, str]:
+        """Formatted subtree total per listed commodity of the account at row"""
+        if self._amounts_of is None:
+            self._amounts_of = self._formatted(self.amounts, self.amount_shown)
+        return self._amounts_of[row]
+
+    def cleared_of(self, row: int) -> Dict[str, str]:
+        """Formatted subtree cleared total per listed commodity of the account at row"""
+        if self._cleared_of is None:
+            self._cleared_of = self._formatted(self.cleared, self.cleared_shown)
+        return self._cleared_of[row]
+
+    def subtree_total(self, account: str, commodity: str) -> Decimal:
+        """Total of account and its subaccounts in commodity, 0 if unknown"""
+        row = self.table.rows.get(account)
+        col = self.table.columns.get(commodity)
+        if row is None or col is None:
+            return Decimal(0)
+        return Decimal(int(self.amounts[row, col])).scaleb(-self.table.scales[col])
+
+
+def series_keys(index: BalanceIndex) -> np.ndarray:
+    """
+    Search keys of the postings of index: start << 32 | date, start being
+    the position of the first posting of their series. They are sorted
+    because series are contiguous and sorted by date, so the dates of
+    every series are searched at once.
+    """
+    starts = np.zeros(len(index.dates), dtype=np.int64)
+    for by_commodity in index.series.values():
+        for start, end in by_commodity.values():
+            starts[start:end] = start
+    return (starts << _KEY_SHIFT) | np.asarray(index.dates, dtype=np.int64)
+
+
+class _Groups:
+    """
+    The (account, commodity) series of one BalanceIndex placed on the rows
+    and columns of a table, searched through the index's series_keys.
+    """
+
+    def __init__(self, rows: np.ndarray, cols: np.ndarray, starts: np.ndarray, ends: np.ndarray,
+                 keys: np.ndarray, totals: np.ndarray, cleared: np.ndarray):
+        self.rows = rows
+        self.cols = cols
+        self.starts = starts
+        self.ends = ends
+        self.keys = keys
+        self.totals = totals
+        self.cleared = cleared
+
+    @classmethod
+    def of_index(cls, index: BalanceIndex, rows: Dict[str, int], columns: Dict[str, int]) -> "_Groups":
+        groups = [(rows[account], columns[commodity], start, end)
+                  for account, by_commodity in index.series.items()
+                  for commodity, (start, end) in by_commodity.items()]
+        groups.sort(key=lambda group: group[2])
+        group_rows, group_cols, group_starts, group_ends = (
+            np.array([group[i] for group in groups], dtype=np.int64) for i in range(4))
+        # Keys stored with the index (a mapped snapshot) are used in place
+        keys = series_keys(index) if index.keys is None else np.asarray(index.keys, dtype=np.int64)
+        return cls(group_rows, group_cols, group_starts, group_ends, keys,
+                   int_column(index.totals), int_column(index.cleared))
+
+    def renumbered(self, rows: np.ndarray, cols: np.ndarray) -> "_Groups":
+        """The same series on another table, rows and cols mapping the old numbers to the new"""
+        return _Groups(rows[self.rows], cols[self.cols], self.starts, self.ends,
+                       self.keys, self.totals, self.cleared)
+
+    def _sums(self, running: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+        """Sum of each group's postings [lo, hi) from its running totals, per window"""
+        padded = np.concatenate((np.zeros(1, dtype=running.dtype), running))
+        before = np.where(lo > self.starts[:, None], padded[lo], 0)
+        return np.where(hi > lo, padded[hi] - before, 0)
+
+    def sums(self, bounds: List[Tuple[Optional[datetime.date], Optional[datetime.date]]]
+             ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        (group, window) arrays of the total and cleared sums of each group
+        over each window, and whether it has postings in it. Every group
+        is searched for all window edges at once.
+        """
+        edges = sorted({d.toordinal() for window in bounds for d in window if d})
+        positions = np.searchsorted(self.keys, (self.starts << _KEY_SHIFT)[:, None] | np.array(edges, dtype=np.int64))
+        column = {edge: i for i, edge in enumerate(edges)}
+        lo = np.stack([positions[:, column[lower.toordinal()]] if lower else self.starts
+                       for lower, _ in bounds], axis=1)
+        hi = np.stack([positions[:, column[upper.toordinal()]] if upper else self.ends
+                       for _, upper in bounds], axis=1)
+        return self._sums(self.totals, lo, hi), self._sums(self.cleared, lo, hi), hi > lo
+
+
+def _layout(children: Dict[str, List[str]]) -> Tuple[List[str], List[int], List[int]]:
+    """Accounts in depth-first preorder, with the row of each one's parent and the end of its subtree"""
+    accounts: List[str] = []
+    parents: List[int] = []
+    ends: List[int] = []
+    stack = [('', -1)]
+    while stack:
+        account, parent = stack.pop()
+        if account is None:
+            # Marker pushed after the subtree of row parent
+            ends[parent] = len(accounts)
+            continue
+        row = len(accounts)
+        accounts.append(account)
+        parents.append(parent)
+        ends.append(row + 1)
+        stack.append((None, row))
+        stack.extend((child, row) for child in reversed(children.get(account, [])))
+    return accounts, parents, ends
+
+
+class BalanceTable:
+    """
+    Layout for rolling a BalanceIndex up the account tree with array
+    operations, built once per journal load.
+
+    Accounts are numbered in depth-first preorder, so the subtree of the
+    account at row i is the rows [i, ends[i]), and commodities are interned
+    to column ids. The index's (account, commodity) series become groups
+    (see _Groups). A table extended with the postings appended since the
+    load (with_delta) keeps the groups of the loaded index as they are and
+    adds those of the appended postings; their sums are added up before
+    rolling up.
+    """
+
+    def __init__(self, accounts: List[str], parents: np.ndarray, ends: np.ndarray,
+                 commodities: List[str], scales: List[int], groups: List[_Groups]):
+        self.accounts = accounts
+        self.rows = {account: i for i, account in enumerate(accounts)}
+        self.parents = parents
+        self.ends = ends
+        self._children: List[List[int]] = [[] for _ in accounts]
+        for row, parent in enumerate(parents.tolist()):
+            if parent >= 0:
+                self._children[parent].append(row)
+        self.commodities = commodities
+        self.columns = {commodity: i for i, commodity in enumerate(commodities)}
+        self.scales = scales
+        self.groups = groups
+
+    @classmethod
+    def from_index(cls, index: BalanceIndex) -> "BalanceTable":
+        accounts, parents, ends = _layout(index.children)
+        commodities = sorted(index.scales)
+        groups = _Groups.of_index(index, {account: i for i, account in enumerate(accounts)},
+                                  {commodity: i for i, commodity in enumerate(commodities)})
+        return cls(accounts, np.array(parents, dtype=np.int64), np.array(ends, dtype=np.int64),
+                   commodities, [index.scales[commodity] for commodity in commodities], [groups])
+
+    def with_delta(self, delta: BalanceIndex) -> "BalanceTable":
+        """
+        Table of this one's postings and those of delta, an index of
+        postings appended since (see BalanceIndex.delta). Its cost grows
+        with delta and the number of accounts, not with this table's
+        postings, which are shared.
+        """
+        if len(delta.children) == len(self.accounts) and len(delta.scales) == len(self.commodities):
+            # No new account or commodity: same layout
+            groups = _Groups.of_index(delta, self.rows, self.columns)
+            return BalanceTable(self.accounts, self.parents, self.ends, self.commodities, self.scales,
+                                self.groups + [groups])
+
+        accounts, parents, ends = _layout(delta.children)
+        commodities = sorted(delta.scales)
+        rows = {account: i for i, account in enumerate(accounts)}
+        columns = {commodity: i for i, commodity in enumerate(commodities)}
+        row_map = np.array([rows[account] for account in self.accounts], dtype=np.int64)
+        col_map = np.array([columns[commodity] for commodity in self.commodities], dtype=np.int64)
+        groups = [g.renumbered(row_map, col_map) for g in self.groups]
+        groups.append(_Groups.of_index(delta, rows, columns))
+        return BalanceTable(accounts, np.array(parents, dtype=np.int64), np.array(ends, dtype=np.int64),
+                            commodities, [delta.scales[commodity] for commodity in commodities], groups)
+
+    def children(self, row: int) -> List[int]:
+        """Rows of the direct children of the account at row"""
+        return self._children[row]
+
+    def _own(self, values: List[np.ndarray], dtype) -> np.ndarray:
+        """(account, window, commodity) array of per-group values, one array per group set"""
+        own = np.zeros((len(self.accounts), values[0].shape[1], len(self.commodities)), dtype=dtype)
+        for groups, group_values in zip(self.groups, values):
+            # Groups are unique within a set, so += adds each value once
+            own[groups.rows, :, groups.cols] += group_values
+        return own
+
+    def _rolled(self, own: np.ndarray) -> np.ndarray:
+        cumulative = np.concatenate((np.zeros((1,) + own.shape[1:], dtype=own.dtype), np.cumsum(own, axis=0)))
+        return cumulative[self.ends] - cumulative[:-1]
+
+    def _with_children(self, flags: np.ndarray, rolled: np.ndarray) -> np.ndarray:
+        # The root, row 0, is nobody's child
+        np.logical_or.at(flags, self.parents[1:], rolled[1:] != 0)
+        return flags
+
+    def window(self, lower: Optional[datetime.date], upper: Optional[datetime.date]) -> BalanceWindow:
+        """Balances of all accounts over postings dated in [lower, upper)"""
+        return next(self.windows([(lower, upper)]))
+
+    def windows(self, bounds: List[Tuple[Optional[datetime.date], Optional[datetime.date]]]
+                ) -> Iterator[BalanceWindow]:
+        """
+        Balances of all accounts over each (lower, upper) window, in order.
+        Every group is searched for all window edges at once, and the
+        windows are rolled up the tree together, so the cost grows with the
+        number of distinct edges rather than with a full walk per window.
+        The arrays are dense, so windows are computed in chunks of at most
+        MAX_WINDOW_CELLS cells; a chunk is computed when the iteration
+        reaches it, and freed once its windows are no longer referenced.
+        """
+        chunk = max(1, MAX_WINDOW_CELLS // (len(self.accounts) * max(1, len(self.commodities))))
+        for first in range(0, len(bounds), chunk):
+            yield from self._windows(bounds[first:first + chunk])
+
+    def _windows(self, bounds: List[Tuple[Optional[datetime.date], Optional[datetime.date]]]) -> List[BalanceWindow]:
+        sums = [groups.sums(bounds) for groups in self.groups]
+        totals, cleared, posted = ([s[i] for s in sums] for i in range(3))
+        dtype = np.result_type(*totals)
+        own_cleared = self._own(cleared, dtype)
+        amounts = self._rolled(self._own(totals, dtype))
+        rolled_cleared = self._rolled(own_cleared)
+        amount_shown = self._with_children(self._own(posted, bool), amounts)
+        cleared_shown = self._with_children(own_cleared != 0, rolled_cleared)
+        return [
+            BalanceWindow(self, amounts[:, i], rolled_cleared[:, i], amount_shown[:, i], cleared_shown[:, i])
+            for i in range(len(bounds))
+        ]
@@ -0,0 +1,179 @@
+# ============================================================================
+# services/budget_index.py - Budgets from the journal's periodic transactions
+# ============================================================================
+
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+import datetime
+import logging
+import re
+
+from services.balance_index import to_decimal
+from services.price_index import parse_date
+
+logger = logging.getLogger(__name__)
+
+# period keyword -> (calendar unit, units per period)
+_PERIOD_KEYWORDS = {
+    'daily': ('day', 1),
+    'weekly': ('week', 1),
+    'biweekly': ('week', 2),
+    'monthly': ('month', 1),
+    'bimonthly': ('month', 2),
+    'quarterly': ('month', 3),
+    'yearly': ('year', 1),
+    'annually': ('year', 1),
+}
+_EVERY = re.compile(r'^every\s+(?:(\d+)\s+)?(day|week|month|quarter|year)s?$')
+_YEAR = re.compile(r'^(\d{4})$')
+_MONTH = re.compile(r'^(\d{4})[/.-](\d{1,2})$')
+
+# (account, commodity, amount, unit, units per period, start ordinal, end ordinal)
+Budget = Tuple[str, str, Decimal, str, int, Optional[int], Optional[int]]
+
+
+def _span(text: str) -> Optional[Tuple[datetime.date, datetime.date]]:
+    """[start, end) of a date, a month ("2024/01") or a year ("2024") in a period expression"""
+    date = parse_date(text)
+    if date:
+        return date, date + datetime.timedelta(days=1)
+    try:
+        match = _MONTH.match(text)
+        if match:
+            start = datetime.date(int(match.group(1)), int(match.group(2)), 1)
+            return start, (start + datetime.timedelta(days=32)).replace(day=1)
+        match = _YEAR.match(text)
+        if match:
+            year = int(match.group(1))
+            return datetime.date(year, 1, 1), datetime.date(year + 1, 1, 1)
+    except ValueError:
+        pass
+    return None
+
+
+def parse_period(period: str) -> Optional[Tuple[str, int, Optional[int], Optional[int]]]:
+    """
+    (unit, units per period, start ordinal, end ordinal) of a periodic
+    transaction's period expression: an interval ("Monthly", "every 2
+    weeks") followed by any of "from"/"since", "to"/"until" and "in" a
+    date, month or year, e.g. "every month in 2024". The end is exclusive,
+    as in ledger: "to 2024/03" ends before March. None when any part of
+    the expression is not understood.
+    """
+    words = period.strip().lower().split()
+    keyword = words[0] if words else ''
+    if keyword in _PERIOD_KEYWORDS:
+        unit, count = _PERIOD_KEYWORDS[keyword]
+        clauses = words[1:]
+    else:
+        # "every", an optional count and the unit
+        size = 3 if len(words) > 2 and words[1].isdigit() else 2
+        match = _EVERY.match(' '.join(words[:size]))
+        if not match:
+            return None
+        unit, count = match.group(2), int(match.group(1) or 1)
+        if unit == 'quarter':
+            unit, count = 'month', 3 * count
+        clauses = words[size:]
+
+    if len(clauses) % 2:
+        return None
+    start = end = None
+    for word, value in zip(clauses[::2], clauses[1::2]):
+        span = _span(value)
+        if span is None:
+            return None
+        if word in ('from', 'since'):
+            start = span[0]
+        elif word in ('to', 'until'):
+            end = span[0]
+        elif word == 'in':
+            start, end = span
+        else:
+            return None
+    return unit, count, start.toordinal() if start else None, end.toordinal() if end else None
+
+
+def _unit_starts_before(ordinal: int, unit: str) -> int:
+    """Number of unit starts (days, Mondays, 1st of months, Jan 1sts) before ordinal"""
+    if unit == 'day':
+        return ordinal
+    if unit == 'week':
+        # Mondays are the ordinals congruent to 1 modulo 7
+        return (ordinal + 5) // 7
+    date = datetime.date.fromordinal(ordinal)
+    if unit == 'month':
+        return date.year * 12 + date.month - 1 + (date.day > 1)
+    return date.year + ((date.month, date.day) > (1, 1))
+
+
+def _unit_days(ordinal: int, unit: str) -> int:
+    """Length in days of the unit (day, week, month or year) ordinal falls in"""
+    if unit == 'day':
+        return 1
+    if unit == 'week':
+        return 7
+    date = datetime.date.fromordinal(ordinal)
+    if unit == 'month':
+        start = date.replace(day=1)
+        return ((start + datetime.timedelta(days=32)).replace(day=1) - start).days
+    return datetime.date(date.year + 1, 1, 1).toordinal() - datetime.date(date.year, 1, 1).toordinal()
+
+
+class BudgetIndex:
+    """
+    Budgets defined by the journal's periodic transactions ("~ Monthly"),
+    extracted once per load. Automated transactions ("=") are not budgets:
+    ledger applies them to the matching postings, so they are already part
+    of the actual amounts.
+    """
+
+    def __init__(self, budgets: List[Budget]):
+        self.budgets = budgets
+
+    @classmethod
+    def from_journal(cls, journal) -> "BudgetIndex":
+        """Build the index. Callers must hold ledger_lock."""
+        budgets: List[Budget] = []
+        for xact in journal.period_xacts():
+            period = parse_period(xact.period_string)
+            if period is None:
+                logger.warning("Ignoring budget with unsupported period: %s", xact.period_string)
+                continue
+            for post in xact.posts():
+                # The balancing posting has no amount
+                if post.amount.is_null() or not post.amount.is_nonzero():
+                    continue
+                budgets.append((post.account.fullname(), str(post.amount.commodity),
+                                to_decimal(post.amount)) + period)
+        logger.debug("Found %d budget entries", len(budgets))
+        return cls(budgets)
+
+    def window(self, lower: datetime.date, upper: datetime.date) -> Dict[Tuple[str, str], Decimal]:
+        """
+        Budgeted amount per (account, commodity) over [lower, upper): the
+        amount of each budget times the number of its periods that start in
+        the window, partial multi-unit periods counting pro rata. A window
+        inside a single unit, which no period starts in, gets the share of
+        the period it covers in days.
+        """
+        result: Dict[Tuple[str, str], Decimal] = {}
+        for account, commodity, amount, unit, count, start, end in self.budgets:
+            lo = max(lower.toordinal(), start) if start else lower.toordinal()
+            hi = min(upper.toordinal(), end) if end else upper.toordinal()
+            if lo >= hi:
+                continue
+            periods = Decimal(_unit_starts_before(hi, unit) - _unit_starts_before(lo, unit)) / count
+            if not periods:
+                periods = Decimal(hi - lo) / (_unit_days(lo, unit) * count)
+            key = (account, commodity)
+            result[key] = result.get(key, Decimal(0)) + amount * periods
+        return result
+
+    def to_dict(self) -> dict:
+        """JSON-friendly form, for snapshots"""
+        return {"budgets": [[a, c, str(amount), u, n, s, e] for a, c, amount, u, n, s, e in self.budgets]}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BudgetIndex":
+        return cls([(a, c, Decimal(amount), u, n, s, e) for a, c, amount, u, n, s, e in data["budgets"]])
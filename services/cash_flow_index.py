@@ -0,0 +1,199 @@
+# ============================================================================
+# services/cash_flow_index.py - Vectorized per-period cash flow aggregates
+# ============================================================================
+
+from decimal import Decimal
+from typing import Dict, List, Optional, Sequence, Tuple
+import datetime
+import logging
+
+import numpy as np
+
+from services.register_index import RegisterIndex
+
+logger = logging.getLogger(__name__)
+
+PERIODS = ('daily', 'weekly', 'monthly', 'yearly')
+
+_EPOCH = datetime.date(1970, 1, 1).toordinal()
+
+# (period start ordinal, account, commodity, inflow, outflow, running balance)
+CashFlowRow = Tuple[int, str, str, Decimal, Decimal, Decimal]
+
+
+def int_column(values: Sequence[int]) -> np.ndarray:
+    """
+    int64 view or copy of values. Amounts of commodities with many decimal
+    places can exceed 64 bits once scaled; those fall back to exact (and
+    slow) Python integers.
+    """
+    try:
+        return np.asarray(values, dtype=np.int64)
+    except OverflowError:
+        logger.warning("Amounts exceed 64 bits, cash flow falls back to Python integers")
+        return np.array(list(values), dtype=object)
+
+
+def period_starts(ordinals: np.ndarray, period: str) -> np.ndarray:
+    """Ordinal of the first day of the period each date ordinal falls in"""
+    if period == 'daily':
+        return ordinals
+    if period == 'weekly':
+        # date.fromordinal(1) is a Monday
+        return ordinals - (ordinals - 1) % 7
+    unit = {'monthly': 'M', 'yearly': 'Y'}[period]
+    days = (ordinals - _EPOCH).astype('datetime64[D]')
+    return days.astype(f'datetime64[{unit}]').astype('datetime64[D]').astype(np.int64) + _EPOCH
+
+
+def next_period_start(day: datetime.date, period: str) -> datetime.date:
+    """First day of the period after the one day falls in, as in period_starts"""
+    if period == 'daily':
+        return day + datetime.timedelta(days=1)
+    if period == 'weekly':
+        return day + datetime.timedelta(days=7 - day.weekday())
+    if period == 'monthly':
+        return (day.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+    return datetime.date(day.year + 1, 1, 1)
+
+
+def period_windows(period: str, lower: datetime.date, upper: datetime.date,
+                   limit: int) -> List[Tuple[datetime.date, datetime.date]]:
+    """
+    The periods overlapping [lower, upper), clipped to it, as [start, end)
+    pairs. Stops after limit + 1 periods, so callers can tell the range
+    holds more than limit.
+    """
+    windows = []
+    start = lower
+    while start < upper and len(windows) <= limit:
+        end = next_period_start(start, period)
+        windows.append((start, min(end, upper)))
+        start = end
+    return windows
+
+
+class CashFlowIndex:
+    """
+    Columns of (date, account, commodity, amount) for every posting, as
+    NumPy arrays built once per journal load from the register. A cash
+    flow report over any window and period is a mask, a sort and one
+    grouped reduction over these arrays.
+
+    Amounts are integers scaled by 10 ** scales[commodity], as in the
+    register they come from. The postings of a register appended to since
+    (with_register) are kept as a second segment of columns instead of
+    rebuilding the first one; rows do not need to be in any order.
+    """
+
+    def __init__(self, accounts: List[str], commodities: List[str], scales: dict,
+                 segments: List[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]):
+        self.accounts = accounts
+        self.commodities = commodities
+        self.scales = scales
+        # (dates, account ids, commodity ids, amounts) per segment
+        self.segments = segments
+        # Output order: accounts and commodities by name, whatever their ids
+        self._account_ranks = np.argsort(np.argsort(accounts, kind='stable')) if accounts else np.zeros(0, np.int64)
+        self._commodity_ranks = np.argsort(np.argsort(commodities, kind='stable')) if commodities else np.zeros(0, np.int64)
+
+    @staticmethod
+    def _segment(register: RegisterIndex, ids: Dict[str, int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        account_ids = np.empty(len(register.dates), dtype=np.int32)
+        for account, (start, end) in register.accounts.items():
+            account_ids[start:end] = ids[account]
+        return (np.asarray(register.dates, dtype=np.int64), account_ids,
+                np.asarray(register.commodity_ids, dtype=np.int32), int_column(register.amounts))
+
+    @classmethod
+    def from_register(cls, register: RegisterIndex) -> "CashFlowIndex":
+        accounts = sorted(register.accounts)
+        segment = cls._segment(register, {account: i for i, account in enumerate(accounts)})
+        return cls(accounts, register.commodities, register.scales, [segment])
+
+    def with_register(self, delta: RegisterIndex) -> "CashFlowIndex":
+        """
+        Index of this one's postings and those of delta, a register of
+        postings appended since (RegisterIndex.delta), whose commodity ids
+        extend this one's. This index's columns are shared, not copied.
+        """
+        accounts = self.accounts + sorted(set(delta.accounts) - set(self.accounts))
+        segment = self._segment(delta, {account: i for i, account in enumerate(accounts)})
+        return CashFlowIndex(accounts, delta.commodities, delta.scales, self.segments + [segment])
+
+    def _account_mask(self, account_ids: np.ndarray, prefix: str) -> np.ndarray:
+        selected = np.array([a == prefix or a.startswith(prefix + ':') for a in self.accounts], dtype=bool)
+        return selected[account_ids]
+
+    def flows(self, period: str,
+              lower: Optional[datetime.date], upper: Optional[datetime.date],
+              account: Optional[str] = None) -> List[CashFlowRow]:
+        """
+        Inflow (sum of positive postings), outflow (sum of negative ones)
+        and closing running balance per period, account and commodity, over
+        postings dated in [lower, upper) of account and its subaccounts (all
+        accounts when None). Rows are ordered by account, commodity, period.
+        The closing balance of a period is the balance of the account in
+        the commodity before lower plus the flows up to the period's end.
+        """
+        n_commodities = len(self.commodities)
+
+        def groups_of(account_ids: np.ndarray, commodity_ids: np.ndarray) -> np.ndarray:
+            return self._account_ranks[account_ids] * n_commodities + self._commodity_ranks[commodity_ids]
+
+        parts = []
+        openings = []
+        for dates, account_ids, commodity_ids, amounts in self.segments:
+            selected = self._account_mask(account_ids, account) if account else np.ones(len(dates), dtype=bool)
+            mask = selected.copy()
+            if lower:
+                mask &= dates >= lower.toordinal()
+                before = selected & ~mask
+                openings.append((groups_of(account_ids[before], commodity_ids[before]), amounts[before]))
+            if upper:
+                mask &= dates < upper.toordinal()
+            parts.append((groups_of(account_ids[mask], commodity_ids[mask]), dates[mask], amounts[mask]))
+
+        groups = np.concatenate([part[0] for part in parts])
+        if not len(groups):
+            return []
+        buckets = period_starts(np.concatenate([part[1] for part in parts]), period)
+        amounts = np.concatenate([part[2] for part in parts])
+        order = np.lexsort((buckets, groups))
+        groups, buckets, amounts = groups[order], buckets[order], amounts[order]
+
+        boundaries = (groups[1:] != groups[:-1]) | (buckets[1:] != buckets[:-1])
+        starts = np.flatnonzero(np.concatenate(([True], boundaries)))
+        inflows = np.add.reduceat(np.where(amounts > 0, amounts, 0), starts)
+        outflows = np.add.reduceat(np.where(amounts < 0, amounts, 0), starts)
+
+        # Closing balances: opening balance of each group plus its flows so far
+        run_groups = groups[starts]
+        flows = np.cumsum(inflows + outflows)
+        first_runs = np.flatnonzero(np.concatenate(([True], run_groups[1:] != run_groups[:-1])))
+        # Flows of the groups before each run's own
+        earlier = np.concatenate((np.zeros(1, dtype=flows.dtype), flows[first_runs[1:] - 1]))
+        closings = flows - np.repeat(earlier, np.diff(np.append(first_runs, len(run_groups))))
+        if openings:
+            opening = np.zeros(len(self.accounts) * n_commodities, dtype=amounts.dtype)
+            for opening_groups, opening_amounts in openings:
+                np.add.at(opening, opening_groups, opening_amounts)
+            closings = closings + opening[run_groups]
+
+        names = [self.accounts[i] for i in np.argsort(self._account_ranks).tolist()]
+        commodities = [self.commodities[i] for i in np.argsort(self._commodity_ranks).tolist()]
+        rows: List[CashFlowRow] = []
+        for group, bucket, inflow, outflow, closing in zip(
+                run_groups.tolist(), buckets[starts].tolist(),
+                inflows.tolist(), outflows.tolist(), closings.tolist()):
+            commodity = commodities[group % n_commodities]
+            scale = self.scales[commodity]
+            rows.append((
+                bucket,
+                names[group // n_commodities],
+                commodity,
+                Decimal(inflow).scaleb(-scale),
+                Decimal(outflow).scaleb(-scale),
+                Decimal(closing).scaleb(-scale),
+            ))
+        return rows
@@ -0,0 +1,242 @@
+# ============================================================================
+# services/journal_registry.py - Journals served by one process
+# ============================================================================
+
+from collections import OrderedDict
+from fastapi import HTTPException
+from typing import Callable, Dict, Iterable, List, Optional
+import asyncio
+import logging
+import os
+import re
+import time
+
+from services.balance_feed import BalanceFeed
+from services.journal_watcher import find_journal_sources
+from services.ledger_executor import LedgerExecutor
+from services.metrics import JOURNAL_EVICTIONS, JOURNALS_LOADED
+from services.response_cache import ResponseCache
+from services.transaction_writer import TransactionWriter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOURNAL_NAME = "default"
+
+# Default estimate of the bytes of memory a parsed journal and its indexes
+# take per byte of journal text. It varies with the journal (postings per
+# line, commodities, account depth); compare the resident memory of the
+# process before and after loading a journal to set memory_per_text_byte.
+MEMORY_PER_TEXT_BYTE = 24
+
+_NAME = re.compile(r'^[\w.-]+$')
+
+
+def parse_journals(text: str) -> Dict[str, str]:
+    """Journals from "name=path,name=path" (LEDGER_JOURNALS)"""
+    journals: Dict[str, str] = {}
+    for entry in filter(None, (e.strip() for e in text.split(','))):
+        name, sep, path = entry.partition('=')
+        name, path = name.strip(), path.strip()
+        if not sep or not path or not _NAME.match(name):
+            raise ValueError(f"Invalid journal entry: {entry!r} (expected name=path)")
+        if name in journals:
+            raise ValueError(f"Journal {name} is listed twice")
+        journals[name] = path
+    return journals
+
+
+def estimated_bytes(journal_path: str, per_text_byte: float = MEMORY_PER_TEXT_BYTE) -> int:
+    """Rough memory taken by the parsed journal and its indexes"""
+    size = 0
+    for source in find_journal_sources(journal_path):
+        try:
+            size += os.path.getsize(source)
+        except OSError:
+            continue
+    return int(size * per_text_byte)
+
+
+class LoadedJournal:
+    """A journal being served: its executor, response cache, balance feed and writer"""
+
+    def __init__(self, name: str, executor: LedgerExecutor, cache: ResponseCache, size: int):
+        self.name = name
+        self.executor = executor
+        self.cache = cache
+        self.size = size
+        self.last_used = time.monotonic()
+        self._feed: Optional[BalanceFeed] = None
+        self._writer: Optional[TransactionWriter] = None
+
+    @property
+    def feed(self) -> BalanceFeed:
+        """Balance feed of the journal, created on first use"""
+        if self._feed is None:
+            self._feed = BalanceFeed(self.executor)
+        return self._feed
+
+    @property
+    def writer(self) -> TransactionWriter:
+        """Writer appending transactions to the journal, created on first use"""
+        if self._writer is None:
+            self._writer = TransactionWriter(self.executor)
+        return self._writer
+
+    @property
+    def busy(self) -> bool:
+        """Whether ledger calls are queued or running, or clients follow the balance"""
+        return bool(self.executor.pending or (self._feed is not None and self._feed.subscribers))
+
+    def close(self):
+        self.executor.close()
+
+
+class JournalRegistry:
+    """
+    The journals one process serves, by name.
+
+    The default journal and the hot ones are loaded up front and stay
+    loaded. The others are loaded on first use, off the event loop; requests
+    for a journal that is still loading wait for that load instead of
+    starting their own. Once the estimated memory of the loaded journals
+    (memory_per_text_byte times the size of their files) exceeds
+    max_bytes, idle journals (not busy and no use for idle_seconds) are
+    closed, least recently used first. This is checked after each load
+    and, once start has been called, every sweep_seconds, so journals
+    that become idle later are closed as well. A journal is never evicted
+    to make room for itself, and when nothing is idle the budget is
+    exceeded rather than failing requests.
+
+    The ledger module holds one parsed journal per process. In the thread
+    executor mode all journals share it, so each load of another journal
+    makes the next reload of a journal parsed earlier a full parse instead
+    of an incremental one (see LedgerService). The process mode gives
+    every journal worker processes of its own, which avoids this.
+
+    Methods other than close must be called from the event loop.
+    """
+
+    def __init__(self, journals: Dict[str, str],
+                 executor_factory: Callable[[str, str], LedgerExecutor],
+                 cache_factory: Callable[[], ResponseCache],
+                 default: str = DEFAULT_JOURNAL_NAME, hot: Iterable[str] = (),
+                 max_bytes: int = 2 * 1024 ** 3, idle_seconds: float = 300.0,
+                 memory_per_text_byte: float = MEMORY_PER_TEXT_BYTE, sweep_seconds: float = 60.0):
+        if default not in journals:
+            raise ValueError(f"Default journal {default} is not configured")
+        unknown = set(hot) - set(journals)
+        if unknown:
+            raise ValueError(f"Unknown hot journals: {', '.join(sorted(unknown))}")
+        self.journals = journals
+        self.default_name = default
+        self.hot = set(hot) | {default}
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self.memory_per_text_byte = memory_per_text_byte
+        self.sweep_seconds = sweep_seconds
+        self._sweeper: Optional[asyncio.Task] = None
+        self._executor_factory = executor_factory
+        self._cache_factory = cache_factory
+        self._loaded: "OrderedDict[str, LoadedJournal]" = OrderedDict()
+        self._loading: Dict[str, asyncio.Future] = {}
+
+        for name in [default] + sorted(self.hot - {default}):
+            self._loaded[name] = self._load(name)
+        JOURNALS_LOADED.set_function(lambda: len(self._loaded))
+
+    def _load(self, name: str) -> LoadedJournal:
+        path = self.journals[name]
+        logger.info("Loading journal %s from %s", name, path)
+        executor = self._executor_factory(name, path)
+        return LoadedJournal(name, executor, self._cache_factory(),
+                             estimated_bytes(path, self.memory_per_text_byte))
+
+    @property
+    def default(self) -> LoadedJournal:
+        return self._loaded[self.default_name]
+
+    def loaded(self) -> List[LoadedJournal]:
+        """Journals currently loaded, least recently used first"""
+        return list(self._loaded.values())
+
+    def peek(self, name: Optional[str] = None) -> Optional[LoadedJournal]:
+        """
+        The journal called name (the default one if None) if it is loaded,
+        without loading it or counting as a use of it
+        """
+        name = name or self.default_name
+        if name not in self.journals:
+            raise HTTPException(status_code=404, detail=f"Unknown journal {name}")
+        return self._loaded.get(name)
+
+    @property
+    def pending(self) -> int:
+        """Ledger calls queued or running over all loaded journals"""
+        return sum(journal.executor.pending for journal in self._loaded.values())
+
+    async def get(self, name: Optional[str] = None) -> LoadedJournal:
+        """The journal called name (the default one if None), loading it if needed"""
+        name = name or self.default_name
+        journal = self._loaded.get(name)
+        if journal is None:
+            if name not in self.journals:
+                raise HTTPException(status_code=404, detail=f"Unknown journal {name}")
+            future = self._loading.get(name)
+            if future is None:
+                loop = asyncio.get_running_loop()
+                future = asyncio.ensure_future(loop.run_in_executor(None, self._load, name))
+                self._loading[name] = future
+                future.add_done_callback(lambda done: self._loaded_one(name, done))
+            # A caller going away must not cancel the load the others wait for
+            journal = await asyncio.shield(future)
+        if name in self._loaded:
+            self._loaded.move_to_end(name)
+        journal.last_used = time.monotonic()
+        return journal
+
+    def _loaded_one(self, name: str, future: asyncio.Future):
+        del self._loading[name]
+        if future.cancelled() or future.exception() is not None:
+            return
+        self._loaded[name] = future.result()
+        self._evict(keep=name)
+
+    def start(self):
+        """Start sweeping idle journals every sweep_seconds"""
+        if self._sweeper is None:
+            self._sweeper = asyncio.ensure_future(self._sweep())
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(self.sweep_seconds)
+            try:
+                self._evict()
+            except Exception:
+                logger.exception("Journal eviction sweep failed")
+
+    def _evict(self, keep: Optional[str] = None):
+        total = sum(journal.size for journal in self._loaded.values())
+        idle_since = time.monotonic() - self.idle_seconds
+        for journal in list(self._loaded.values()):
+            if total <= self.max_bytes:
+                break
+            if (journal.name == keep or journal.name in self.hot
+                    or journal.busy or journal.last_used > idle_since):
+                continue
+            del self._loaded[journal.name]
+            total -= journal.size
+            journal.close()
+            JOURNAL_EVICTIONS.inc()
+            logger.info("Evicted idle journal %s", journal.name)
+        if total > self.max_bytes:
+            logger.warning("Loaded journals take about %d MB, over the %d MB budget, and none is idle",
+                           total // 1024 ** 2, self.max_bytes // 1024 ** 2)
+
+    def close(self):
+        """Stop sweeping and close every loaded journal"""
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+        for journal in self._loaded.values():
+            journal.close()
+        self._loaded.clear()
@@ -0,0 +1,158 @@
+# ============================================================================
+# services/journal_snapshot.py - Read-only, memory-mapped journal snapshots
+# ============================================================================
+
+from array import array
+from typing import Any, Dict, Optional, Tuple
+import json
+import mmap
+import os
+import struct
+
+from services.balance_index import BalanceIndex
+from services.balance_table import series_keys
+from services.budget_index import BudgetIndex
+from services.price_index import PriceIndex
+from services.register_index import RegisterIndex
+
+# File layout, all little-endian:
+#   magic (8 bytes) | version (u32) | metadata length (u32)
+#   metadata (JSON, padded to 8 bytes)
+#   arrays, each 8-byte aligned, described in metadata["arrays"]
+SNAPSHOT_MAGIC = b"LDGSNAP\0"
+SNAPSHOT_VERSION = 7
+_HEADER = struct.Struct("<8sII")
+
+# name -> typecode of the BalanceIndex columns stored in a snapshot. The
+# columns the NumPy tables read are stored in the dtype they read them in
+# (int64 "q", int32 "i"), so every process mapping a snapshot uses the
+# mapped columns as they are instead of converting its own copy.
+_BALANCE_ARRAYS = {
+    "dates": "i",
+    "totals": "q",
+    "cleared": "q",
+}
+
+# name -> typecode of the RegisterIndex columns, stored as "register_<name>"
+_REGISTER_ARRAYS = {
+    "dates": "q",
+    "payee_ids": "i",
+    "commodity_ids": "i",
+    "amounts": "q",
+    "running": "q",
+    "cleared": "b",
+}
+
+
+class SnapshotError(Exception):
+    """Raised when a snapshot cannot be written or read"""
+
+
+def _padding(size: int) -> bytes:
+    return b"\0" * (-size % 8)
+
+
+def write_snapshot(path: str, balance_index: BalanceIndex, price_index: PriceIndex,
+                   register_index: RegisterIndex, budget_index: BudgetIndex, sources: list,
+                   generation: str, modified_at: float, content_hash: Optional[str] = None):
+    """
+    Write the derived data of a loaded journal to path. The file is written
+    next to path and renamed over it, so readers only ever see complete
+    snapshots. content_hash identifies the journal content the data was
+    derived from, when known.
+    """
+    columns: Dict[str, array] = {}
+    try:
+        for name, typecode in _BALANCE_ARRAYS.items():
+            columns[name] = array(typecode, getattr(balance_index, name))
+        for name, typecode in _REGISTER_ARRAYS.items():
+            columns[f"register_{name}"] = array(typecode, getattr(register_index, name))
+    except OverflowError:
+        raise SnapshotError("Amounts exceed the 64-bit range of a snapshot")
+
+    # The search keys of the balance table (see balance_table.series_keys)
+    columns["keys"] = array("q", series_keys(balance_index).tobytes())
+
+    arrays: Dict[str, Any] = {}
+    offset = 0
+    for name, column in columns.items():
+        arrays[name] = {"typecode": column.typecode, "offset": offset, "length": len(column)}
+        offset += len(column) * column.itemsize
+        offset += len(_padding(offset))
+
+    metadata = json.dumps({
+        "generation": generation,
+        "modified_at": modified_at,
+        "content_hash": content_hash,
+        "sources": sources,
+        "children": balance_index.children,
+        "series": balance_index.series,
+        "scales": balance_index.scales,
+        "price_index": price_index.to_dict(),
+        "budget_index": budget_index.to_dict(),
+        "register": {
+            "accounts": register_index.accounts,
+            "payees": register_index.payees,
+            "commodities": register_index.commodities,
+            "scales": register_index.scales,
+        },
+        "arrays": arrays,
+    }).encode()
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(metadata)))
+        f.write(metadata)
+        f.write(_padding(_HEADER.size + len(metadata)))
+        for column in columns.values():
+            data = column.tobytes()
+            f.write(data)
+            f.write(_padding(len(data)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path: str) -> Tuple[Dict[str, Any], BalanceIndex, RegisterIndex]:
+    """
+    Map a snapshot written by write_snapshot. Returns its metadata, and a
+    BalanceIndex and RegisterIndex whose columns are views straight into
+    the mapped file.
+    """
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, metadata_length = _HEADER.unpack_from(mapped, 0)
+    if magic != SNAPSHOT_MAGIC:
+        raise SnapshotError(f"{path} is not a journal snapshot")
+    if version != SNAPSHOT_VERSION:
+        raise SnapshotError(f"Unsupported snapshot version {version}")
+
+    start = _HEADER.size
+    metadata = json.loads(mapped[start:start + metadata_length])
+    base = start + metadata_length
+    base += len(_padding(base))
+
+    view = memoryview(mapped)
+    columns = {}
+    for name, spec in metadata["arrays"].items():
+        itemsize = array(spec["typecode"]).itemsize
+        begin = base + spec["offset"]
+        end = begin + spec["length"] * itemsize
+        columns[name] = view[begin:end].cast(spec["typecode"])
+
+    series = {
+        account: {commodity: tuple(bounds) for commodity, bounds in by_commodity.items()}
+        for account, by_commodity in metadata["series"].items()
+    }
+    balance_index = BalanceIndex(
+        metadata["children"], series, metadata["scales"],
+        columns["dates"], columns["totals"], columns["cleared"], columns["keys"],
+    )
+    register = metadata["register"]
+    register_index = RegisterIndex(
+        {account: tuple(bounds) for account, bounds in register["accounts"].items()},
+        register["payees"], register["commodities"], register["scales"],
+        *(columns[f"register_{name}"] for name in _REGISTER_ARRAYS),
+    )
+    return metadata, balance_index, register_index
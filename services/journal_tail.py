@@ -0,0 +1,109 @@
+# ============================================================================
+# services/journal_tail.py - Detecting and reading appends to the journal
+# ============================================================================
+
+from decimal import Decimal
+from typing import List, Optional, Tuple
+import hashlib
+import logging
+import os
+import re
+
+from services.balance_index import posting_amount, to_decimal
+from services.journal_watcher import journal_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# Lines an appended tail may contain: transactions, postings, comments and
+# price directives. Anything else (include, alias, apply, account, automated
+# or periodic transactions, ...) can change how earlier text is read.
+_TAIL_LINE = re.compile(r'^(?:\d|[ \t]|[;#%|*]|P\s|\r?$)')
+
+
+class ParsePosition:
+    """
+    Where the last parse of the root journal file ended: its size, a hash
+    of its content up to there and the number of transactions the session
+    journal held, along with the fingerprint of every included file.
+    """
+
+    def __init__(self, sources: List[str], size: int, digest, xact_count: int):
+        self.sources = sources
+        self.size = size
+        self.digest = digest
+        self.xact_count = xact_count
+        self.includes = journal_fingerprint(sources[1:])
+
+    @classmethod
+    def of_file(cls, sources: List[str], data: bytes, xact_count: int) -> Optional["ParsePosition"]:
+        """
+        Position after parsing data, the content of sources[0]. None if the
+        file no longer has that size, as ledger may then have read more.
+        """
+        try:
+            if os.path.getsize(sources[0]) != len(data):
+                return None
+        except OSError:
+            return None
+        return cls(sources, len(data), hashlib.sha1(data), xact_count)
+
+    def extended(self, tail: bytes, xact_count: int) -> "ParsePosition":
+        digest = self.digest.copy()
+        digest.update(tail)
+        return ParsePosition(self.sources, self.size + len(tail), digest, self.xact_count + xact_count)
+
+
+def read_root(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def appended_text(position: ParsePosition, sources: List[str]) -> Optional[Tuple[bytes, str]]:
+    """
+    The bytes appended to the root journal file since position, and their
+    text, when the journal changed by appending only transactions and
+    prices to its root file. None for any other change.
+    """
+    if sources != position.sources or journal_fingerprint(sources[1:]) != position.includes:
+        return None
+    data = read_root(sources[0])
+    if len(data) <= position.size or not data.endswith(b'\n'):
+        return None
+    if position.size and data[position.size - 1:position.size] != b'\n':
+        return None
+    digest = hashlib.sha1(data[:position.size])
+    if digest.digest() != position.digest.digest():
+        return None
+
+    tail = data[position.size:]
+    try:
+        text = tail.decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+    for line in text.splitlines():
+        if not _TAIL_LINE.match(line):
+            logger.debug("Appended line needs a full parse: %s", line)
+            return None
+    return tail, text
+
+
+def tail_postings(xacts) -> Tuple[List[Tuple[str, int, str, Decimal, bool]],
+                                  List[Tuple[str, int, str, str, Decimal, bool]]]:
+    """
+    Postings of xacts in the forms BalanceIndex.with_postings and
+    RegisterIndex.with_postings take. Callers must hold ledger_lock.
+    """
+    balance_postings = []
+    register_postings = []
+    for xact in xacts:
+        for post in xact.posts():
+            account = post.account.fullname()
+            ordinal = post.date.toordinal()
+            amount = posting_amount(post)
+            commodity = str(amount.commodity)
+            value = to_decimal(amount)
+            is_cleared = str(post.state) == 'Cleared'
+            if post.amount.number().is_nonzero():
+                balance_postings.append((account, ordinal, commodity, value, is_cleared))
+            register_postings.append((account, ordinal, xact.payee or '', commodity, value, is_cleared))
+    return balance_postings, register_postings
@@ -0,0 +1,166 @@
+# ============================================================================
+# services/journal_watcher.py - Change detection for the journal and includes
+# ============================================================================
+
+from typing import Callable, Dict, List, Optional
+import glob
+import hashlib
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+try:
+    import watchfiles
+except ImportError:  # pragma: no cover - depends on uvicorn[standard]
+    watchfiles = None
+
+INCLUDE_DIRECTIVES = ('include', '!include')
+
+
+def find_journal_sources(path: str) -> List[str]:
+    """
+    Return the journal file followed by every file it includes, recursively.
+
+    Only the include directives are looked at; the files are not parsed.
+    Relative includes are resolved against the including file, like ledger
+    does, and glob patterns are expanded.
+    """
+    sources: List[str] = []
+    pending = [os.path.abspath(path)]
+    while pending:
+        current = pending.pop(0)
+        if current in sources:
+            continue
+        sources.append(current)
+        try:
+            with open(current, 'r', encoding='utf-8') as f:
+                for line in f:
+                    parts = line.split(None, 1)
+                    if len(parts) != 2 or parts[0] not in INCLUDE_DIRECTIVES:
+                        continue
+                    pattern = os.path.expanduser(parts[1].split(';')[0].strip())
+                    pattern = os.path.join(os.path.dirname(current), pattern)
+                    pending.extend(sorted(os.path.abspath(p) for p in glob.glob(pattern)))
+        except OSError:
+            continue
+    return sources
+
+
+def journal_fingerprint(sources: List[str]) -> str:
+    """Cheap identity of a set of files, changing whenever any of them is touched"""
+    digest = hashlib.sha1()
+    for source in sources:
+        try:
+            st = os.stat(source)
+            digest.update(f'{source}\0{st.st_mtime_ns}\0{st.st_size}\n'.encode())
+        except OSError:
+            digest.update(f'{source}\0missing\n'.encode())
+    return digest.hexdigest()
+
+
+def journal_digests(sources: List[str]) -> Dict[str, str]:
+    """SHA-1 of the content of each of a set of files; missing files are left out"""
+    digests = {}
+    for source in sources:
+        try:
+            with open(source, 'rb') as f:
+                digests[source] = hashlib.sha1(f.read()).hexdigest()
+        except OSError:
+            continue
+    return digests
+
+
+def content_hash(digests: Dict[str, str]) -> str:
+    """Identity of the content of a set of files, from their journal_digests"""
+    digest = hashlib.sha1()
+    for source in sorted(digests):
+        digest.update(f'{source}\0{digests[source]}\n'.encode())
+    return digest.hexdigest()
+
+
+def journal_mtime(sources: List[str]) -> float:
+    """Most recent modification time of a set of files, 0 if none exists"""
+    mtimes = []
+    for source in sources:
+        try:
+            mtimes.append(os.stat(source).st_mtime)
+        except OSError:
+            continue
+    return max(mtimes, default=0.0)
+
+
+class JournalWatcher:
+    """
+    Background thread calling on_change whenever the journal or one of its
+    includes changes on disk.
+
+    mode is 'inotify' (through watchfiles), 'poll' (mtime polling every
+    interval seconds) or 'auto', which picks inotify when available. With
+    includes=False only path itself is watched, which is what non-journal
+    files such as snapshots need.
+    """
+
+    def __init__(self, path: str, on_change: Callable[[], None],
+                 mode: str = 'auto', interval: float = 1.0, includes: bool = True):
+        if mode == 'auto':
+            mode = 'inotify' if watchfiles is not None else 'poll'
+        if mode == 'inotify' and watchfiles is None:
+            raise ValueError("inotify watching requires the watchfiles package")
+        if mode not in ('inotify', 'poll'):
+            raise ValueError(f"Unknown watch mode: {mode}")
+        self.path = path
+        self.on_change = on_change
+        self.mode = mode
+        self.interval = interval
+        self.includes = includes
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='journal-watcher', daemon=True)
+        self._thread.start()
+        logger.info("Watching %s for changes (%s)", self.path, self.mode)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _sources(self) -> List[str]:
+        if self.includes:
+            return find_journal_sources(self.path)
+        return [os.path.abspath(self.path)]
+
+    def _run(self):
+        sources = self._sources()
+        fingerprint = journal_fingerprint(sources)
+        while not self._stop.is_set():
+            if self.mode == 'inotify':
+                self._wait_inotify(sources)
+            else:
+                self._stop.wait(self.interval)
+            if self._stop.is_set():
+                return
+
+            sources = self._sources()
+            current = journal_fingerprint(sources)
+            if current == fingerprint:
+                continue
+            fingerprint = current
+            try:
+                self.on_change()
+            except Exception:
+                logger.exception("Journal change handler failed")
+
+    def _wait_inotify(self, sources: List[str]):
+        """Block until one of the sources changes (or the watcher is stopped)"""
+        watched = set(sources)
+        directories = sorted({os.path.dirname(s) for s in sources})
+        for _ in watchfiles.watch(
+                *directories,
+                watch_filter=lambda change, p: os.path.abspath(p) in watched,
+                stop_event=self._stop,
+                recursive=False):
+            return
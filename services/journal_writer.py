@@ -0,0 +1,98 @@
+# ============================================================================
+# services/journal_writer.py - Appending transactions to a journal
+# ============================================================================
+
+from decimal import Decimal, InvalidOperation
+from typing import Callable, Dict, Optional
+import fcntl
+import os
+import re
+
+from models import LedgerTransactionInput
+
+# Commodities ledger reads without quotes
+_BARE_COMMODITY = re.compile(r'^[^\W\d]+$')
+# Ledger separates an account from its amount by two spaces or a tab
+_ACCOUNT_SEPARATOR = re.compile(r'\s{2}|\t')
+
+
+def _commodity(symbol: str) -> str:
+    return symbol if _BARE_COMMODITY.match(symbol) else f'"{symbol}"'
+
+
+def format_transaction(transaction: LedgerTransactionInput) -> str:
+    """Journal text of a transaction, preceded by a blank line"""
+    lines = ['', '%s%s %s' % (transaction.date.strftime('%Y/%m/%d'),
+                              ' *' if transaction.cleared else '', transaction.description)]
+    for posting in transaction.postings:
+        if posting.amount is None:
+            lines.append(f'    {posting.account}')
+        else:
+            lines.append('    %s  %s %s' % (posting.account, _commodity(posting.commodity),
+                                            format(Decimal(posting.amount), 'f')))
+    return '\n'.join(lines) + '\n'
+
+
+def transaction_error(transaction: LedgerTransactionInput, is_account: Callable[[str], bool],
+                      is_commodity: Callable[[str], bool]) -> Optional[str]:
+    """
+    Why transaction cannot be written, or None. Accounts and commodities
+    must already be known to the journal, and the postings must balance:
+    per commodity when every amount is given, otherwise the one posting
+    without an amount takes the balance of a single commodity.
+    """
+    if not transaction.description.strip() or '\n' in transaction.description:
+        return "A description is required, on a single line"
+
+    totals: Dict[str, Decimal] = {}
+    elided = 0
+    for posting in transaction.postings:
+        if (not posting.account or '\n' in posting.account or _ACCOUNT_SEPARATOR.search(posting.account)
+                or not is_account(posting.account)):
+            return f"Unknown account {posting.account}"
+        if posting.amount is None:
+            elided += 1
+            continue
+        if posting.commodity is None:
+            return f"Amount of {posting.account} has no commodity"
+        if not is_commodity(posting.commodity):
+            return f"Unknown commodity {posting.commodity}"
+        try:
+            amount = Decimal(posting.amount)
+        except InvalidOperation:
+            return f"Invalid amount {posting.amount}"
+        if not amount.is_finite():
+            return f"Invalid amount {posting.amount}"
+        totals[posting.commodity] = totals.get(posting.commodity, Decimal(0)) + amount
+
+    if elided > 1:
+        return "At most one posting may leave its amount out"
+    if elided and len(totals) != 1:
+        return "A posting without an amount needs the others in a single commodity"
+    if not elided and any(totals.values()):
+        return "Transaction does not balance"
+    return None
+
+
+def append_durably(path: str, data: bytes) -> int:
+    """
+    Append data to the file at path and fsync it; returns the offset data
+    starts at. The file is locked while writing, so appends from other
+    processes do not interleave, and a newline is added first if the file
+    does not end with one.
+    """
+    with open(path, 'a+b') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            offset = f.seek(0, os.SEEK_END)
+            if offset:
+                f.seek(offset - 1)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+                    offset += 1
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+    return offset
@@ -0,0 +1,276 @@
+# ============================================================================
+# services/ledger_executor.py - Runs ledger work off the asyncio event loop
+# ============================================================================
+
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from fastapi import HTTPException
+from typing import Any, AsyncIterator, Callable, Dict, Hashable, List, Optional, Tuple
+import asyncio
+import contextvars
+import logging
+import multiprocessing
+import os
+
+from services.journal_watcher import (
+    JournalWatcher,
+    find_journal_sources,
+    journal_fingerprint,
+    journal_mtime,
+    )
+from services.ledger_service import LedgerService, forget_journal_size
+from services.metrics import EXECUTOR_CALLS, REGISTRY, WORKER_METRICS
+from services.tracing import configure_logging, trace_id_var
+
+logger = logging.getLogger(__name__)
+
+EXECUTOR_MODES = ('thread', 'process')
+
+# Service owned by a worker process of the 'process' mode
+_worker_service: Optional[LedgerService] = None
+
+
+class _RemoteHTTPError(Exception):
+    """Picklable stand-in for an HTTPException raised inside a worker process"""
+
+
+def _init_worker(journal_path: str, watch: str, snapshot_path: Optional[str], incremental: bool,
+                 cache_path: Optional[str], journal_name: str):
+    global _worker_service
+    configure_logging(os.getenv("LEDGER_LOG_LEVEL", "INFO"))
+    _worker_service = LedgerService(journal_path, watch=watch, snapshot_path=snapshot_path,
+                                    incremental=incremental, cache_path=cache_path,
+                                    journal_name=journal_name)
+
+
+def _call_in_worker(method: str, args: tuple, trace_id: Optional[str]) -> Tuple[Any, Dict[str, dict]]:
+    """
+    Result of the call, with the worker metrics recorded since the last
+    call (including those of reloads in between) for the parent to merge
+    """
+    trace_id_var.set(trace_id)
+    try:
+        return getattr(_worker_service, method)(*args), REGISTRY.take(WORKER_METRICS)
+    except HTTPException as e:
+        raise _RemoteHTTPError(e.status_code, e.detail)
+
+
+def _ping() -> bool:
+    return _worker_service is not None
+
+
+def _call(service: LedgerService, method: str, args: tuple) -> Any:
+    return getattr(service, method)(*args)
+
+
+class LedgerExecutor:
+    """
+    Runs LedgerService methods away from the event loop so a slow report
+    cannot stall the other routes.
+
+    The ledger module is not thread-safe:
+
+    - 'thread': one dedicated thread calling a LedgerService owned by this
+      process. The executors of several journals (see JournalRegistry)
+      each have their own thread; ledger_lock keeps their ledger calls
+      from overlapping.
+    - 'process': a pool of worker processes, each holding its own
+      LedgerService and parsed journal.
+
+    At most max_queue calls may be queued or running; further calls are
+    rejected with 503. A call not finished after timeout seconds is answered
+    with 504. The work itself cannot be interrupted and still occupies its
+    worker until it returns, which is accounted for in the queue bound.
+    Calls made through call (writes) are waited for however long they
+    take: a 504 would tell the client a write failed that still completes.
+
+    Calls made through run are single-flight: a call identical to one
+    still in flight (same method, arguments and journal generation) waits
+    for that one's result instead of queueing its own computation.
+    """
+
+    def __init__(self, journal_path: str, mode: str = 'thread', workers: int = 2,
+                 max_queue: int = 32, timeout: float = 30.0, watch: str = 'auto',
+                 snapshot_path: Optional[str] = None, incremental: bool = True,
+                 cache_path: Optional[str] = None, journal_name: str = "default"):
+        if mode not in EXECUTOR_MODES:
+            raise ValueError(f"Unknown executor mode: {mode}")
+        self.mode = mode
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.journal_path = journal_path
+        self.journal_name = journal_name
+        self.service: Optional[LedgerService] = None
+        self._pending = 0
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self._watcher: Optional[JournalWatcher] = None
+        self._generation: Optional[str] = None
+        self._modified_at = 0.0
+        self._reload_listeners: List[Callable[[], None]] = []
+
+        if mode == 'thread':
+            self.service = LedgerService(journal_path, watch=watch, snapshot_path=snapshot_path,
+                                         incremental=incremental, cache_path=cache_path,
+                                         journal_name=journal_name)
+            self._pool: Executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ledger')
+        else:
+            # spawn, not fork: the parent already runs threads and ledger state
+            self._pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(journal_path, watch, snapshot_path, incremental, cache_path, journal_name),
+            )
+            # Start the workers now so they parse before the first request.
+            # The pool starts a process per call only while none is idle,
+            # so it takes one call per worker to start them all.
+            for _ in range(workers):
+                self._pool.submit(_ping)
+            # Workers load on their own; follow the journal here as well to
+            # know which generation they are (or will shortly be) serving.
+            self._refresh_generation()
+            if watch != 'off':
+                self._watcher = JournalWatcher(journal_path, self._refresh_generation, mode=watch)
+                self._watcher.start()
+        logger.info("Ledger executor started (%s mode)", mode)
+
+    def _refresh_generation(self):
+        sources = find_journal_sources(self.journal_path)
+        self._modified_at = journal_mtime(sources)
+        self._generation = journal_fingerprint(sources)
+        self._notify_reload()
+
+    def _notify_reload(self, *_):
+        for listener in self._reload_listeners:
+            try:
+                listener()
+            except Exception:
+                logger.exception("Reload listener failed")
+
+    def add_reload_listener(self, listener: Callable[[], None]):
+        """
+        Call listener whenever the journal served changes. It is called
+        from a watcher or ledger thread; in process mode, when this process
+        sees the change, which the workers may pick up slightly later.
+        """
+        if self.service is not None and not self._reload_listeners:
+            self.service.add_reload_listener(self._notify_reload)
+        self._reload_listeners.append(listener)
+
+    @property
+    def generation(self) -> str:
+        """Generation of the journal the executor's services serve"""
+        if self.service is not None:
+            return self.service.generation
+        return self._generation
+
+    @property
+    def modified_at(self) -> float:
+        """Modification time of the journal the executor's services serve"""
+        if self.service is not None:
+            return self.service.modified_at
+        return self._modified_at
+
+    @property
+    def pending(self) -> int:
+        """Calls currently queued or running"""
+        return self._pending
+
+    def _release(self):
+        self._pending -= 1
+
+    async def _submit(self, label: str, fn, *args, bounded: bool = True) -> Any:
+        if self._pending >= self.max_queue:
+            raise HTTPException(status_code=503, detail="Ledger service is busy, try again later")
+
+        loop = asyncio.get_running_loop()
+        if self.mode == 'thread':
+            # Carry the request's context (trace id) into the ledger thread
+            future = self._pool.submit(contextvars.copy_context().run, fn, *args)
+        else:
+            future = self._pool.submit(fn, *args)
+        self._pending += 1
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release))
+
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout if bounded else None)
+        except asyncio.TimeoutError:
+            logger.error("Ledger call %s timed out after %ss", label, self.timeout)
+            raise HTTPException(status_code=504, detail=f"{label} timed out")
+        except _RemoteHTTPError as e:
+            status_code, detail = e.args
+            raise HTTPException(status_code=status_code, detail=detail)
+
+    async def _run(self, method: str, *args, bounded: bool = True) -> Any:
+        if self.mode == 'thread':
+            return await self._submit(method, _call, self.service, method, args, bounded=bounded)
+        result, metrics = await self._submit(method, _call_in_worker, method, args, trace_id_var.get(),
+                                             bounded=bounded)
+        REGISTRY.merge(metrics)
+        return result
+
+    async def run(self, method: str, *args) -> Any:
+        """
+        Call LedgerService.<method>(*args) in the executor, or join the
+        identical call already in flight. Results are shared between the
+        callers, so methods called this way must return immutable values.
+        """
+        label = args[0] if method in ("render", "collect") and args else method
+        key = (method, args, self.generation)
+        future = self._in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._run(method, *args))
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+            EXECUTOR_CALLS.inc(method=label, outcome="executed")
+        else:
+            EXECUTOR_CALLS.inc(method=label, outcome="coalesced")
+        # A caller going away must not cancel the call the others wait for
+        return await asyncio.shield(future)
+
+    async def call(self, method: str, *args) -> Any:
+        """
+        Call LedgerService.<method>(*args) in the executor on its own,
+        never joined with identical calls and without the request timeout;
+        for methods with side effects.
+        """
+        EXECUTOR_CALLS.inc(method=method, outcome="executed")
+        return await self._run(method, *args, bounded=False)
+
+    async def stream(self, method: str, *args) -> Tuple[Optional[str], AsyncIterator[bytes]]:
+        """
+        Start a LedgerService generator method: the generation of its
+        output (see LedgerService.render) and its chunks. In thread mode
+        each chunk is produced by its own executor call, so the first bytes
+        go out before the whole response is computed; the first chunk is
+        computed here, so errors raised up to then reach the caller.
+        Generators cannot cross processes, so process mode sends the output
+        at once.
+        """
+        if self.mode == 'process':
+            generation, body = await self.run("collect", method, *args)
+
+            async def collected():
+                yield body
+            return generation, collected()
+
+        # Generators are consumed by one caller, never shared
+        generation, first, iterator = await self._run("open_stream", method, *args)
+
+        async def chunks():
+            yield first
+            while True:
+                chunk = await self._submit(method, next, iterator, None)
+                if chunk is None:
+                    return
+                yield chunk
+        return generation, chunks()
+
+    def close(self):
+        """Stop the workers and the service they run"""
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        if self._watcher is not None:
+            self._watcher.stop()
+        if self.service is not None:
+            self.service.close()
+        else:
+            forget_journal_size(self.journal_name)
@@ -8,45 +8,547 @@ import datetime
 from models import (
     LedgerAccount,
     LedgerBalanceResponse,
+    LedgerBalanceWindow,
+    LedgerBalanceWindowsResponse,
+    LedgerPrice,
+    LedgerPriceHistoryResponse,
+    LedgerPricePoint,
+    LedgerPriceSeries,
     LedgerPriceResponse,
     LedgerTransactionResponse,
     LedgerTransactionNode,
     LedgerSubTotalNode,
     LedgerSubTotalsResponse,
+    LedgerTransactionInput,
     BudgetItem,
     BudgetResponse,
     )
 import ledger
+import copy
+import heapq
+import itertools
+import json
 import logging
+import os
+import threading
+import time
 import traceback
-from typing import Dict
-from collections import defaultdict
+from typing import Callable, Dict, Iterator, Tuple
+from decimal import Decimal
+from services.balance_index import BalanceIndex
+from services.balance_table import BalanceTable, BalanceWindow
+from services.budget_index import BudgetIndex
+from services.cash_flow_index import PERIODS, CashFlowIndex, next_period_start, period_windows
+from services.price_index import GROCERY_PREFIX, PriceIndex
+from services.register_index import LayeredRegister, RegisterIndex, decode_cursor, encode_cursor
+from services.journal_snapshot import SnapshotError, read_snapshot, write_snapshot
+from services.journal_tail import ParsePosition, appended_text, read_root, tail_postings
+from services.journal_writer import append_durably, format_transaction, transaction_error
+from services.metrics import (
+    BALANCE_TREE_SECONDS,
+    JOURNAL_ACCOUNTS,
+    JOURNAL_COMMODITIES,
+    JOURNAL_LOAD_SECONDS,
+    JOURNAL_POSTS,
+    PRICE_LOOKUP_SECONDS,
+    SERIALIZATION_SECONDS,
+    )
+from services.journal_watcher import (
+    JournalWatcher,
+    content_hash,
+    find_journal_sources,
+    journal_digests,
+    journal_fingerprint,
+    journal_mtime,
+    )
 
 logger = logging.getLogger(__name__)
 
 
+# Most balance windows a single get_balance_windows call computes
+MAX_BALANCE_WINDOWS = 120
+
+# Postings appended since the last full build of the indexes are kept in
+# delta indexes until there are more than this many, or than this share
+# of the journal's postings; then they are merged into the main indexes
+MIN_MERGED_APPENDS = 4096
+MERGED_APPENDS_SHARE = 1 / 16
+
+# Seconds between two writes of the cache file; states swapped in
+# meanwhile are not written, only the latest one
+CACHE_WRITE_INTERVAL = 30.0
+
+
+# The ledger module keeps a single global session and commodity pool, so
+# parsing a journal and touching ledger objects must never overlap.
+ledger_lock = threading.RLock()
+
+# Service whose journal the session last parsed; only that one may read
+# appended text into the session journal. Guarded by ledger_lock.
+_session_owner: Optional["LedgerService"] = None
+
+
+def forget_journal_size(journal_name: str):
+    """Stop exposing the size gauges of a journal that is no longer served"""
+    for gauge in (JOURNAL_POSTS, JOURNAL_ACCOUNTS, JOURNAL_COMMODITIES):
+        gauge.remove(journal=journal_name)
+
+
+class JournalState:
+    """
+    Everything derived from one parse of the journal. A state is never
+    modified once built: reloads build a new one and swap it in, so a
+    request that grabbed a state keeps a consistent view until it is done.
+    Only the ledger journal object is shared with the states later built
+    from appended text, which is why requests never read it.
+
+    balance_index and register_index are built in full, by a parse or by
+    merging appended postings in. A state with postings appended since
+    (with_appended) shares them, and the tables derived from them, with
+    the state it was built from, and keeps the appended postings in small
+    delta indexes that balance_table, register and cash_flow_index read
+    along with them.
+    """
+
+    def __init__(self, journal, balance_index: BalanceIndex, price_index: PriceIndex,
+                 register_index: RegisterIndex, budget_index: BudgetIndex, sources: List[str],
+                 generation: str, modified_at: float, digests: Optional[Dict[str, str]] = None):
+        self.journal = journal
+        self.balance_index = balance_index
+        self.balance_table = BalanceTable.from_index(balance_index)
+        self.price_index = price_index
+        self.register_index = register_index
+        self.register = register_index
+        self.cash_flow_index = CashFlowIndex.from_register(register_index)
+        self.budget_index = budget_index
+        self.sources = sources
+        self.generation = generation
+        self.modified_at = modified_at
+        # SHA-1 of each source file as parsed, when the service tracks content
+        self.digests = digests
+        self.loaded_at = datetime.datetime.now()
+        # Postings appended on top of balance_index and register_index, in
+        # the forms their with_postings take, and the delta indexes of them
+        self.appended: Tuple[Tuple, Tuple] = ((), ())
+        self.balance_delta: Optional[BalanceIndex] = None
+        self.register_delta: Optional[RegisterIndex] = None
+        self._base_table = self.balance_table
+        self._base_cash_flow = self.cash_flow_index
+
+    @property
+    def posting_count(self) -> int:
+        """Postings with a non-zero amount, appended ones included"""
+        return len(self.balance_index.dates) + (len(self.balance_delta.dates) if self.balance_delta else 0)
+
+    def with_appended(self, journal, balance_postings: list, register_postings: list,
+                      price_index: PriceIndex, sources: List[str], generation: str, modified_at: float,
+                      digests: Optional[Dict[str, str]]) -> "JournalState":
+        """
+        State with postings appended to this one's, as BalanceIndex and
+        RegisterIndex.with_postings take them. Only the delta indexes are
+        rebuilt, so this costs in proportion to the postings appended since
+        the last full build, which are merged into full indexes once they
+        outgrow MIN_MERGED_APPENDS and MERGED_APPENDS_SHARE. Raises
+        ValueError as with_postings does.
+        """
+        appended = (self.appended[0] + tuple(balance_postings), self.appended[1] + tuple(register_postings))
+        if len(appended[1]) > max(MIN_MERGED_APPENDS, len(self.register_index.dates) * MERGED_APPENDS_SHARE):
+            balance_index, register_index = self._merged(appended)
+            return JournalState(journal, balance_index, price_index, register_index, self.budget_index,
+                                sources, generation, modified_at, digests)
+
+        state = copy.copy(self)
+        state.journal = journal
+        state.price_index = price_index
+        state.sources = sources
+        state.generation = generation
+        state.modified_at = modified_at
+        state.digests = digests
+        state.loaded_at = datetime.datetime.now()
+        state.appended = appended
+        state.balance_delta = (self.balance_delta or self.balance_index.delta()).with_postings(balance_postings)
+        state.register_delta = (self.register_delta or self.register_index.delta()).with_postings(register_postings)
+        state.balance_table = self._base_table.with_delta(state.balance_delta)
+        state.cash_flow_index = self._base_cash_flow.with_register(state.register_delta)
+        state.register = LayeredRegister(self.register_index, state.register_delta)
+        return state
+
+    def _merged(self, appended: Tuple[Tuple, Tuple]) -> Tuple[BalanceIndex, RegisterIndex]:
+        return (self.balance_index.with_postings(list(appended[0])),
+                self.register_index.with_postings(list(appended[1])))
+
+    def merged_indexes(self) -> Tuple[BalanceIndex, RegisterIndex]:
+        """Balance and register index of all postings, appended ones included, as snapshots store them"""
+        if not any(self.appended):
+            return self.balance_index, self.register_index
+        return self._merged(self.appended)
+
+
 class LedgerService:
-    def __init__(self, ledger_file_path: str = "/home/felipe/ledger-data/main.ledger"):
+    """
+    Ledger queries over the current JournalState.
+
+    With snapshot_path the service never parses the journal itself: it maps
+    the snapshot a parent process wrote with write_snapshot (see main.py)
+    and follows that file instead of the journal.
+
+    With incremental set, a reload after transactions or prices were only
+    appended to the root journal file parses just the appended text into
+    the session journal and adds its postings to the current state (see
+    JournalState.with_appended). Any other change falls back to a full
+    parse.
+
+    With cache_path the latest state is also written there as a snapshot,
+    along with the content hash of the journal it came from, at most once
+    every CACHE_WRITE_INTERVAL seconds and on close. On the next
+    start, if the journal files still have the modification times and
+    sizes recorded in the cache, the service maps the cache and serves it
+    right away, then hashes the journal in the background and reparses it
+    if the content differs after all.
+    """
+
+    def __init__(self, ledger_file_path: str = "/home/felipe/ledger-data/main.ledger",
+                 watch: str = "auto", snapshot_path: Optional[str] = None,
+                 incremental: bool = True, cache_path: Optional[str] = None,
+                 journal_name: str = "default"):
         self.ledger_file_path = ledger_file_path
-        self.session = None
-        self._initialize_session()
+        # Label of the journal in metrics
+        self.journal_name = journal_name
+        self.snapshot_path = snapshot_path
+        self.incremental = incremental
+        self.cache_path = None if snapshot_path else cache_path
+        self._state: Optional[JournalState] = None
+        # End of what the ledger session has parsed, when that is known
+        self._position: Optional[ParsePosition] = None
+        self._reload_lock = threading.Lock()
+        self._reload_listeners: List[Callable[[JournalState], None]] = []
+        # State waiting to be written to cache_path, and the timer that will
+        self._cache_lock = threading.Lock()
+        self._cache_write_lock = threading.Lock()
+        self._cache_pending: Optional[JournalState] = None
+        self._cache_timer: Optional[threading.Timer] = None
+        self._cache_written_at = float('-inf')
+        if self.cache_path:
+            self.add_reload_listener(self._write_cache)
+        if not self._load_cache():
+            self._initialize_session()
+
+        self._watcher = None
+        if watch != "off":
+            if snapshot_path:
+                self._watcher = JournalWatcher(snapshot_path, self.reload, mode=watch, includes=False)
+            else:
+                self._watcher = JournalWatcher(ledger_file_path, self.reload, mode=watch)
+            self._watcher.start()
 
     def _initialize_session(self):
-        """Initialize ledger session"""
+        """Load the journal (or its snapshot) and swap in the derived state"""
         try:
-            self.session = ledger.Session()
-            #journal = self.session.read_journal_from_string("")
-            self.journal = ledger.read_journal(self.ledger_file_path)
-            logger.info(f"Successfully initialized ledger session with {self.ledger_file_path}")
+            with JOURNAL_LOAD_SECONDS.time(source="snapshot" if self.snapshot_path else "journal"):
+                if self.snapshot_path:
+                    state = self._load_snapshot()
+                else:
+                    state = self._parse_journal()
+            logger.info("Successfully initialized ledger session with %s", self.snapshot_path or self.ledger_file_path)
         except Exception as e:
-            logger.error(f"Failed to initialize ledger session: {e}")
+            logger.error("Failed to initialize ledger session: %s", e)
             raise
+        self._swap_state(state)
 
-    def _get_journal(self):
-        """Get or create journal instance"""
-        if not self.session:
+    def _swap_state(self, state: JournalState):
+        self._state = state
+        self._record_size(state)
+        for listener in self._reload_listeners:
+            try:
+                listener(state)
+            except Exception:
+                logger.error("Reload listener failed:\n%s", traceback.format_exc())
+
+    def _parse_journal(self) -> JournalState:
+        sources = find_journal_sources(self.ledger_file_path)
+        generation = journal_fingerprint(sources)
+        modified_at = journal_mtime(sources)
+        digests = journal_digests(sources) if self.cache_path else None
+        data = read_root(sources[0]) if self.incremental else None
+        global _session_owner
+        with ledger_lock:
+            self._position = None
+            _session_owner = self
+            ledger.session.close_journal_files()
+            journal = ledger.read_journal(self.ledger_file_path)
+            assert journal.valid()
+            balance_index = BalanceIndex.from_journal(journal)
+            price_index = PriceIndex.from_journal(journal, sources)
+            register_index = RegisterIndex.from_journal(journal)
+            budget_index = BudgetIndex.from_journal(journal)
+            if data is not None:
+                self._position = ParsePosition.of_file(sources, data, sum(1 for _ in journal.xacts()))
+        return JournalState(journal, balance_index, price_index, register_index, budget_index,
+                            sources, generation, modified_at, digests)
+
+    def _append_tail(self, written: Optional[Tuple[int, bytes]] = None) -> bool:
+        """
+        Apply text appended to the root journal file since the last parse
+        to the current state. Returns False, leaving the state alone, when
+        the journal changed in any other way or the tail cannot be applied
+        incrementally; the session journal then needs a full parse.
+
+        written is (offset, bytes) this service just appended itself; when
+        it starts right where the last parse ended, it is applied without
+        reading the file back.
+        """
+        state = self._state
+        position = self._position
+        if state is None or position is None:
+            return False
+        if (written is not None and written[0] == position.size
+                and journal_fingerprint(position.sources[1:]) == position.includes):
+            # Generated text has no include directives to look for
+            sources = position.sources
+            generation = journal_fingerprint(sources)
+            modified_at = journal_mtime(sources)
+            tail = written[1]
+            text = tail.decode('utf-8')
+        else:
+            sources = find_journal_sources(self.ledger_file_path)
+            generation = journal_fingerprint(sources)
+            modified_at = journal_mtime(sources)
+            appended = appended_text(position, sources)
+            if appended is None:
+                return False
+            tail, text = appended
+
+        try:
+            with ledger_lock:
+                if _session_owner is not self:
+                    logger.info("Another journal was parsed since %s, reparsing it", self.ledger_file_path)
+                    return False
+                with JOURNAL_LOAD_SECONDS.time(source="tail"):
+                    # From here on the session journal holds the tail, so any
+                    # failure must be followed by a full parse
+                    self._position = None
+                    journal = ledger.read_journal_from_string(text)
+                    xacts = list(itertools.islice(journal.xacts(), position.xact_count, None))
+                    balance_postings, register_postings = tail_postings(xacts)
+                    price_index = state.price_index.with_journal_text(xacts, text.splitlines(), sources[0])
+                    digests = None
+                    if state.digests is not None:
+                        digests = dict(state.digests)
+                        digests[sources[0]] = position.extended(tail, len(xacts)).digest.hexdigest()
+                    appended = state.with_appended(journal, balance_postings, register_postings, price_index,
+                                                   sources, generation, modified_at, digests)
+        except Exception:
+            logger.info("Appended text needs a full parse:\n%s", traceback.format_exc())
+            return False
+
+        self._position = position.extended(tail, len(xacts))
+        logger.info("Applied %d appended transactions from %s", len(xacts), sources[0])
+        self._swap_state(appended)
+        return True
+
+    def _record_size(self, state: JournalState):
+        table = state.balance_table
+        JOURNAL_POSTS.set(state.posting_count, journal=self.journal_name)
+        # The root row is not an account
+        JOURNAL_ACCOUNTS.set(len(table.accounts) - 1, journal=self.journal_name)
+        JOURNAL_COMMODITIES.set(len(table.commodities), journal=self.journal_name)
+
+    def _load_snapshot(self) -> JournalState:
+        return self._read_state(self.snapshot_path)[1]
+
+    def _read_state(self, path: str) -> Tuple[Dict, JournalState]:
+        metadata, balance_index, register_index = read_snapshot(path)
+        return metadata, JournalState(None, balance_index, PriceIndex.from_dict(metadata["price_index"]),
+                                      register_index, BudgetIndex.from_dict(metadata["budget_index"]),
+                                      metadata["sources"], metadata["generation"], metadata["modified_at"])
+
+    def _load_cache(self) -> bool:
+        """
+        Swap in the state of the cache file when the journal files still
+        have the modification times and sizes it was written for, and start
+        checking their content in the background. False when there is no
+        usable cache.
+        """
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return False
+        try:
+            with JOURNAL_LOAD_SECONDS.time(source="cache"):
+                metadata, state = self._read_state(self.cache_path)
+        except (OSError, ValueError, KeyError, SnapshotError) as e:
+            logger.warning("Ignoring journal cache %s: %s", self.cache_path, e)
+            return False
+        sources = find_journal_sources(self.ledger_file_path)
+        if sources != state.sources or journal_fingerprint(sources) != state.generation:
+            logger.info("Journal changed since %s was written", self.cache_path)
+            return False
+
+        self._swap_state(state)
+        logger.info("Serving journal cache %s while validating %s", self.cache_path, self.ledger_file_path)
+        threading.Thread(target=self._validate_cache, args=(state, metadata.get("content_hash")),
+                         name="ledger-cache-validate", daemon=True).start()
+        return True
+
+    def _validate_cache(self, state: JournalState, expected: Optional[str]):
+        """Reparse the journal if its content is not the one the cached state came from"""
+        if content_hash(journal_digests(state.sources)) == expected:
+            logger.info("Journal cache %s is up to date", self.cache_path)
+            return
+        logger.warning("Journal cache %s does not match the journal content, reparsing", self.cache_path)
+        with self._reload_lock:
+            # A reload may already have replaced the cached state
+            if self._state is state:
+                try:
+                    self._initialize_session()
+                except Exception:
+                    logger.error("Keeping journal cache:\n%s", traceback.format_exc())
+
+    def _write_cache(self, state: JournalState):
+        """
+        Reload listener scheduling parsed states to be written to the cache
+        file, at most once every CACHE_WRITE_INTERVAL seconds: appends come
+        in batches and each would otherwise rewrite the whole file.
+        """
+        if state.digests is None:
+            return
+        with self._cache_lock:
+            self._cache_pending = state
+            if self._cache_timer is not None:
+                return
+            delay = max(0.0, self._cache_written_at + CACHE_WRITE_INTERVAL - time.monotonic())
+            self._cache_timer = threading.Timer(delay, self._flush_cache)
+            self._cache_timer.daemon = True
+            self._cache_timer.start()
+
+    def _flush_cache(self):
+        """Write the latest state scheduled by _write_cache, if any"""
+        with self._cache_write_lock:
+            with self._cache_lock:
+                state, self._cache_pending = self._cache_pending, None
+                self._cache_timer = None
+            if state is None:
+                return
+            balance_index, register_index = state.merged_indexes()
+            try:
+                write_snapshot(self.cache_path, balance_index, state.price_index, register_index,
+                               state.budget_index, state.sources, state.generation, state.modified_at,
+                               content_hash(state.digests))
+            except (OSError, SnapshotError) as e:
+                logger.warning("Could not write journal cache %s: %s", self.cache_path, e)
+            self._cache_written_at = time.monotonic()
+
+    def add_reload_listener(self, listener: Callable[[JournalState], None]):
+        """Call listener with every state swapped in from now on"""
+        self._reload_listeners.append(listener)
+
+    def write_snapshot(self, path: str):
+        """Write the current state as a snapshot other processes can map"""
+        state = self._get_state()
+        balance_index, register_index = state.merged_indexes()
+        write_snapshot(path, balance_index, state.price_index, register_index,
+                       state.budget_index, state.sources, state.generation, state.modified_at)
+
+    def reload(self):
+        """Re-parse the journal, keeping the current state if parsing fails"""
+        with self._reload_lock:
+            try:
+                if not self.snapshot_path and self._unchanged():
+                    # Already applied, e.g. text this service appended itself
+                    return
+                if self.incremental and not self.snapshot_path and self._append_tail():
+                    return
+                self._initialize_session()
+            except Exception:
+                logger.error("Keeping previously loaded journal:\n%s", traceback.format_exc())
+
+    def _unchanged(self) -> bool:
+        """Whether the journal files are still the ones the current state was loaded from"""
+        state = self._state
+        if state is None or journal_fingerprint(state.sources) != state.generation:
+            return False
+        # The same files may include more, through glob patterns
+        return journal_fingerprint(find_journal_sources(self.ledger_file_path)) == state.generation
+
+    def write_transactions(self, groups: Tuple[Tuple[LedgerTransactionInput, ...], ...]
+                           ) -> Tuple[str, Tuple[Optional[str], ...]]:
+        """
+        Append groups of transactions to the journal file with a single
+        write and fsync, then apply them to the indexes as appended text,
+        without a full parse. A group is written entirely or not at all:
+        its transactions are checked against the accounts and commodities
+        of the loaded journal first. Returns the generation that includes
+        the written groups and, per group, why it was rejected or None.
+
+        With a snapshot the text is only appended; it is served once the
+        snapshot is rewritten, under the generation of the journal files
+        after the append, which is the one returned.
+        """
+        with self._reload_lock:
+            state = self._get_state()
+            table = state.balance_table
+            is_account = table.rows.__contains__
+
+            def is_commodity(commodity: str) -> bool:
+                return commodity in table.columns or state.price_index.knows(commodity)
+
+            errors = []
+            text = []
+            for group in groups:
+                error = None
+                for i, transaction in enumerate(group):
+                    error = transaction_error(transaction, is_account, is_commodity)
+                    if error is not None:
+                        error = f"Transaction {i}: {error}" if len(group) > 1 else error
+                        break
+                errors.append(error)
+                if error is None:
+                    text.extend(format_transaction(transaction) for transaction in group)
+
+            if not text:
+                return state.generation, tuple(errors)
+            data = ''.join(text).encode('utf-8')
+            offset = append_durably(self.ledger_file_path, data)
+            if self.snapshot_path:
+                # The parent process parses the append and rewrites the snapshot
+                return journal_fingerprint(find_journal_sources(self.ledger_file_path)), tuple(errors)
+            try:
+                if not (self.incremental and self._append_tail((offset, data))):
+                    self._initialize_session()
+            except Exception:
+                logger.error("Keeping previously loaded journal:\n%s", traceback.format_exc())
+                # Served once a reload succeeds
+                return journal_fingerprint(find_journal_sources(self.ledger_file_path)), tuple(errors)
+            return self._get_state().generation, tuple(errors)
+
+    def close(self):
+        """Stop watching the journal and write the cache if a write is pending"""
+        if self._watcher is not None:
+            self._watcher.stop()
+        forget_journal_size(self.journal_name)
+        with self._cache_lock:
+            timer = self._cache_timer
+        if timer is not None:
+            timer.cancel()
+            self._flush_cache()
+
+    @property
+    def generation(self) -> str:
+        """Identity of the journal files the current state was loaded from"""
+        return self._get_state().generation
+
+    @property
+    def modified_at(self) -> float:
+        """Modification time of the journal files the current state was loaded from"""
+        return self._get_state().modified_at
+
+    def _get_state(self) -> JournalState:
+        """Get the current journal state, loading it if needed"""
+        if self._state is None:
             self._initialize_session()
-        return self.journal
+        return self._state
+
+    def _get_journal(self):
+        """Get or create journal instance. Callers must hold ledger_lock."""
+        return self._get_state().journal
 
     def _format_amount(self, amount) -> tuple[float, str]:
         """Format ledger amount to float and string"""
@@ -58,6 +560,14 @@ class LedgerService:
         formatted = f"BRL {value:,.2f}"
         return value, formatted
 
+    def _format_prices(self, latest: Dict[str, Tuple[int, Decimal]]) -> Dict[str, str]:
+        """Format the (date, price) pairs of a price lookup, keyed by target"""
+        return {target: format(price, 'f') for target, (_, price) in latest.items()}
+
+    def _format_decimal(self, value: Decimal) -> str:
+        """Format an amount the way ledger prints bare numbers"""
+        return '0' if value.is_zero() else format(value, 'f')
+
     # def _build_account_tree(self, flat_accounts: List[LedgerAccount]) -> List[LedgerAccount]:
     #     """Build hierarchical tree from flat account list"""
     #     tree = []
@@ -97,148 +607,185 @@ class LedgerService:
         
     #     return tree
 
-    def _read_budget_from_file(self) -> dict:
+    def _balance_root(self, table: BalanceTable, account: Optional[str]) -> int:
+        """Row of the subtree a balance starts at: account, or the whole tree"""
+        if account is None:
+            return 0
+        row = table.rows.get(account)
+        if row is None:
+            raise HTTPException(status_code=404, detail=f"Unknown account {account}")
+        return row
+
+    def _balance_window(self, state: JournalState, before: Optional[datetime.date],
+                        after: Optional[datetime.date], exchange: Optional[str],
+                        as_of: Optional[datetime.date]) -> BalanceWindow:
         """
-        Read budget entries directly from the ledger file.
-        Parses automated transactions (~ or =) and periodic transactions marked with tags.
+        Balances over [before, after), valued in exchange when given at the
+        prices of as_of: by default the last day of the window, or the
+        latest prices for a window open at the end.
         """
-        budgets = {}
-        
-        try:
-            with open(self.ledger_file_path, 'r', encoding='utf-8') as f:
-                in_automated_transaction = False
-                current_predicate = None
-                
-                for line in f:
-                    stripped = line.strip()
-                    
-                    # Detect automated transactions
-                    if stripped.startswith('~') or stripped.startswith('='):
-                        in_automated_transaction = True
-                        current_predicate = stripped
-                        continue
-                    
-                    # Empty line ends automated transaction block
-                    if in_automated_transaction and not stripped:
-                        in_automated_transaction = False
-                        current_predicate = None
-                        continue
-                    
-                    # Parse posting lines in automated transactions
-                    if in_automated_transaction and stripped and not stripped.startswith(';'):
-                        # Match account and amount
-                        parts = stripped.split()
-                        if len(parts) >= 2:
-                            account = parts[0].strip('[]')
-                            
-                            # Find amount
-                            amount_str = None
-                            for i, part in enumerate(parts[1:], 1):
-                                if part.upper() == 'BRL' and i + 1 < len(parts):
-                                    amount_str = parts[i + 1]
-                                    break
-                                elif part.replace(',', '').replace('.', '').replace('-', '').isdigit():
-                                    amount_str = part
-                                    break
-                            
-                            if amount_str:
-                                try:
-                                    amount = abs(float(amount_str.replace(',', '')))
-                                    if account not in budgets:
-                                        budgets[account] = 0.0
-                                    budgets[account] += amount
-                                    logger.info(f"Found budget: {account} = {amount}")
-                                except ValueError:
-                                    continue
-                
-        except FileNotFoundError:
-            logger.warning(f"Ledger file not found: {self.ledger_file_path}")
-        except Exception as e:
-            logger.error(f"Error reading budget from file: {e}")
-        
-        return budgets
-
-    def get_account_balance(self, account: ledger.Account,
-                            before: Optional[datetime.date], after: Optional[datetime.date]) -> LedgerAccount:
-        print(f'account name {account.fullname()}')
-        amounts : Dict[str, Value] = {}
-        cleared_amounts : Dict[str, Value] = {}
-        children : [LedgerAccount] = []
-        pool = ledger.commodities
-
-        now = datetime.datetime.now()
-
-        for a in account.accounts():
-            child = self.get_account_balance(a, before, after)
-            print(child.get_amount_values())
-            for commodity,amount in child.get_amount_values().items():
-                if amount.number().is_nonzero():
-                    if commodity not in amounts:
-                        print(f'setting map to cur {commodity} to value {ledger.Value(f'{str(commodity)} 0')}')
-                        amounts[str(commodity)] = ledger.Value(f'{str(commodity)} 0')
-                    print(f'adding to {account.fullname()} the amount {amount} is_amount? {amount.is_amount()}')
-                    amounts[str(commodity)] += amount
-            for commodity,amount in child.get_cleared_amount_values().items():
-                if amount.number().is_nonzero():
-                    if str(commodity) not in cleared_amounts:
-                        print(f'setting map to cur {commodity} to value {ledger.Value(f'{str(commodity)} 0')}')
-                        cleared_amounts[str(commodity)] = ledger.Value(f'{str(commodity)} 0')
-                    print(f'(cleared) adding to {account.fullname()} the amount {amount}')
-                    cleared_amounts[str(commodity)] += amount;
-            children += [child]
-
-        for post in account.posts():
-            if post.amount.number().is_nonzero():
-                if (not before or post.date >= before) and (
-                    not after or post.date < after):
-                    amount = post.amount
-                    if str(amount.commodity) == 'kg' or str(amount.commodity) == 'un':
-                        amount = post.given_cost if post.given_cost else post.amount
-                    if str(amount.commodity) not in amounts:
-                        amounts[str(amount.commodity)] = ledger.Value(f'{str(amount.commodity)} 0')
-
-                    print(f'add amount {str(amount)} to commodity {amount.commodity}')
-                    amounts[str(amount.commodity)] += amount
-
-                    if str(post.state) == 'Cleared':
-                        if str(amount.commodity) not in cleared_amounts:
-                            cleared_amounts[str(amount.commodity)] = ledger.Value(f'{str(amount.commodity)} 0')
-                        cleared_amounts[str(amount.commodity)] += amount
-
-        amountStrs : Dict[str, str] = {}
-        for c,t in amounts.items():
-            print(f'totals {str(t.number())}')
-            amountStrs[c] = '0' if t.number().is_zero() else str(t.number())
-
-        cleared_amount_strs : Dict[str, str] = {}
-        for c,t in cleared_amounts.items():
-            print(f'totals {str(t.number())}')
-            cleared_amount_strs[c] = '0' if t.number().is_zero() else str(t.number())
-
-        full_path = account.fullname()
-        account_name = full_path.split(':')[-1] if ':' in full_path else full_path
-
-        print(f'amounts calculated for {account.fullname()} is {amounts}')
-        print(f'amounts (string) calculated for {account.fullname()} is {amountStrs}')
-        
-        return LedgerAccount.with_amount_values(
-            account=account_name,
-            full_path=full_path,
-            amounts=amountStrs,
-            cleared_amounts=cleared_amount_strs,
-            amount_values=amounts,
-            cleared_amount_values=cleared_amounts,
+        window = state.balance_table.window(before, after)
+        if exchange is None:
+            return window
+        if exchange not in state.balance_table.columns and not state.price_index.knows(exchange):
+            raise HTTPException(status_code=404, detail=f"Unknown commodity {exchange}")
+        if as_of is None and after is not None:
+            as_of = after - datetime.timedelta(days=1)
+        with PRICE_LOOKUP_SECONDS.time():
+            rates = state.price_index.conversion_rates(exchange, as_of)
+        return window.exchanged(exchange, rates)
+
+    def _children(self, table: BalanceTable, row: int, depth: Optional[int]) -> List[int]:
+        """Children to list under row, none once depth levels are exhausted"""
+        return [] if depth == 0 else table.children(row)
+
+    def get_account_balance(self, window: BalanceWindow, row: int,
+                            timings: Optional[Dict[str, float]] = None,
+                            depth: Optional[int] = None) -> LedgerAccount:
+        """
+        Build the LedgerAccount tree of the account at row of a balance
+        window, down to depth levels below it when given; totals always
+        include the whole subtree. When a timings dict is given, the time
+        spent on each subtree is recorded in it, in seconds, keyed by
+        account.
+        """
+        started = time.perf_counter() if timings is not None else 0.0
+        table = window.table
+        below = None if depth is None else depth - 1
+        children = [self.get_account_balance(window, child, timings, below)
+                    for child in self._children(table, row, depth)]
+        account = table.accounts[row]
+
+        if timings is not None:
+            timings[account] = time.perf_counter() - started
+
+        return LedgerAccount(
+            account=account.split(':')[-1],
+            full_path=account,
+            amounts=window.amounts_of(row),
+            cleared_amounts=window.cleared_of(row),
             last_cleared_date=None,
             children = children
         )
 
-    def get_balance(self, before: Optional[datetime.date], after: Optional[datetime.date]) -> LedgerBalanceResponse:
-        """Get balance for all accounts"""
+    def _iter_account_json(self, window: BalanceWindow, row: int, depth: Optional[int]):
+        """Write the LedgerAccount JSON of the account at row piece by piece"""
+        account = window.table.accounts[row]
+        yield b'{"account":%s,"fullPath":%s,"lastClearedDate":null,"children":[' % (
+            json.dumps(account.split(':')[-1]).encode(), json.dumps(account).encode())
+
+        below = None if depth is None else depth - 1
+        for i, child in enumerate(self._children(window.table, row, depth)):
+            if i:
+                yield b','
+            yield from self._iter_account_json(window, child, below)
+
+        yield b'],"amounts":%s,"clearedAmounts":%s}' % (
+            json.dumps(window.amounts_of(row)).encode(),
+            json.dumps(window.cleared_of(row)).encode())
+
+    def _iter_account_ndjson(self, window: BalanceWindow, row: int, depth: int, max_depth: Optional[int]):
+        """One JSON line per account, children before their parent"""
+        if max_depth is None or depth < max_depth:
+            for child in window.table.children(row):
+                yield from self._iter_account_ndjson(window, child, depth + 1, max_depth)
+
+        account = window.table.accounts[row]
+        yield json.dumps({
+            "account": account.split(':')[-1],
+            "fullPath": account,
+            "depth": depth,
+            "amounts": window.amounts_of(row),
+            "clearedAmounts": window.cleared_of(row),
+        }).encode() + b'\n'
+
+    def iter_balance(self, before: Optional[datetime.date], after: Optional[datetime.date],
+                     ndjson: bool = False, account: Optional[str] = None, depth: Optional[int] = None,
+                     exchange: Optional[str] = None, as_of: Optional[datetime.date] = None,
+                     chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        """
+        Stream the balance tree straight from the index, without building
+        LedgerAccount models: as a LedgerBalanceResponse JSON document, or
+        as NDJSON of flattened accounts when ndjson is set. account, depth,
+        exchange and as_of work as in get_balance. Output is buffered into
+        chunks of about chunk_size bytes.
+        """
+        state = self._get_state()
+        row = self._balance_root(state.balance_table, account)
+        window = self._balance_window(state, before, after, exchange, as_of)
+        if ndjson:
+            pieces = self._iter_account_ndjson(window, row, 0, depth)
+        else:
+            pieces = itertools.chain(
+                [b'{"timestamp":%s,"account":' % json.dumps(datetime.datetime.now().isoformat()).encode()],
+                self._iter_account_json(window, row, depth),
+                [b'}'])
+
+        buffer = []
+        size = 0
+        for piece in pieces:
+            buffer.append(piece)
+            size += len(piece)
+            if size >= chunk_size:
+                yield b''.join(buffer)
+                buffer = []
+                size = 0
+        if buffer:
+            yield b''.join(buffer)
+
+    def collect(self, method: str, *args) -> Tuple[Optional[str], bytes]:
+        """
+        Run a streaming method to completion, for callers that cannot
+        iterate it. Returns the generation of its output as render does.
+        """
+        generation = self.generation
+        body = b''.join(getattr(self, method)(*args))
+        return self._same_generation(generation), body
+
+    def open_stream(self, method: str, *args) -> Tuple[Optional[str], bytes, Iterator[bytes]]:
+        """
+        Start a streaming method: the generation of its output as render
+        returns it, its first chunk and the iterator of the others. The
+        state a stream reads is the one it starts with, so the generation
+        is known once the first chunk is out.
+        """
+        generation = self.generation
+        chunks = getattr(self, method)(*args)
+        first = next(chunks, b'')
+        return self._same_generation(generation), first, chunks
+
+    def _same_generation(self, generation: str) -> Optional[str]:
+        """generation if it is still current, None if a reload swapped in another state meanwhile"""
+        return generation if self.generation == generation else None
+
+    def get_balance(self, before: Optional[datetime.date], after: Optional[datetime.date],
+                    account: Optional[str] = None, depth: Optional[int] = None,
+                    exchange: Optional[str] = None, as_of: Optional[datetime.date] = None
+                    ) -> LedgerBalanceResponse:
+        """
+        Get balance for all accounts, or for the subtree of account. With
+        depth, accounts more than depth levels below the root of the tree
+        are left out, their totals still counting in their ancestors. With
+        exchange, amounts are valued in that commodity like ledger's -X:
+        each node's convertible amounts become one total in it, at the
+        prices of as_of (see _balance_window); the others are kept as they
+        are.
+        """
         try:
-            assert self._get_journal().valid()
-            journal = self._get_journal()
+            state = self._get_state()
+            table = state.balance_table
+            row = self._balance_root(table, account)
+            window = self._balance_window(state, before, after, exchange, as_of)
 
-            root = self.get_account_balance(journal.master, before, after)
+            # Per-subtree timings only cost anything when debug logging is on
+            timings = {} if logger.isEnabledFor(logging.DEBUG) else None
+            with BALANCE_TREE_SECONDS.time():
+                root = self.get_account_balance(window, row, timings, depth)
+            if timings is not None:
+                slowest = heapq.nlargest(10, timings.items(), key=lambda item: item[1])
+                logger.debug("Balance tree computed in %.2f ms; slowest subtrees: %s",
+                             timings[table.accounts[row]] * 1000,
+                             ', '.join('%s=%.2fms' % (a or '<root>', t * 1000) for a, t in slowest))
             
             return LedgerBalanceResponse(
                 account=root,
@@ -246,84 +793,201 @@ class LedgerService:
                 #total=sum(acc.amount for acc in accounts_data)
             )
             
+        except HTTPException:
+            raise
         except Exception as e:
             tb_str = traceback.format_exc()
-            logging.error("Something went wrong:\n%s", tb_str)
-            logging.error(f"Failed to get balance: {e}")
+            logger.error("Something went wrong:\n%s", tb_str)
+            logger.error("Failed to get balance: %s", e)
             raise HTTPException(status_code=500, detail=str(e))
 
-    def get_prices(self) -> LedgerPriceResponse:
-        """Get prices for everything in Despesas:Supermercado:* and commodities"""
+    def _parse_window(self, text: str) -> Tuple[Optional[datetime.date], Optional[datetime.date]]:
+        """Bounds of a "YYYY-MM-DD..YYYY-MM-DD" window, either side possibly empty"""
+        lower, separator, upper = text.partition('..')
+        if not separator:
+            raise ValueError(f"Invalid window: {text}")
+        return (datetime.date.fromisoformat(lower) if lower else None,
+                datetime.date.fromisoformat(upper) if upper else None)
+
+    def get_balance_windows(self, windows: Tuple[str, ...], period: Optional[str],
+                            before: Optional[datetime.date], after: Optional[datetime.date],
+                            account: Optional[str] = None, depth: Optional[int] = None
+                            ) -> LedgerBalanceWindowsResponse:
+        """
+        Balance trees of several windows computed together: the given
+        windows ("YYYY-MM-DD..YYYY-MM-DD", lower bound inclusive, upper
+        exclusive, either side may be left open) or, without them, the
+        consecutive periods (daily, weekly, monthly or yearly) covering
+        [before, after). Each window reports its bounds as the after and
+        before query parameters of /balance would. account and depth limit
+        the trees as in get_balance.
+        """
         try:
-            print(f'get_prices')
-            assert self._get_journal().valid()
-            journal = self._get_journal()
-            print(f'get_prices')
-            latest_prices = defaultdict(dict)
+            if windows:
+                try:
+                    bounds = [self._parse_window(window) for window in windows]
+                except ValueError as e:
+                    raise HTTPException(status_code=400, detail=str(e))
+            elif period is None:
+                raise HTTPException(status_code=400, detail="Either windows or a period is required")
+            elif period not in PERIODS:
+                raise HTTPException(status_code=400, detail=f"Unknown period: {period}")
+            elif before is None or after is None:
+                raise HTTPException(status_code=400, detail="Both bounds are required with a period")
+            else:
+                bounds = period_windows(period, before, after, MAX_BALANCE_WINDOWS)
+            if not bounds:
+                raise HTTPException(status_code=400, detail="No windows to compute")
+            if len(bounds) > MAX_BALANCE_WINDOWS:
+                raise HTTPException(status_code=400,
+                                    detail=f"At most {MAX_BALANCE_WINDOWS} windows per request")
 
-            for post in journal.query(""):
-                post_date = post.date
+            table = self._get_state().balance_table
+            row = self._balance_root(table, account)
+            with BALANCE_TREE_SECONDS.time():
+                balances = [
+                    LedgerBalanceWindow(
+                        after=lower.isoformat() if lower else None,
+                        before=upper.isoformat() if upper else None,
+                        account=self.get_account_balance(window, row, depth=depth),
+                    )
+                    for (lower, upper), window in zip(bounds, table.windows(bounds))
+                ]
 
-                full_account = post.account.fullname()
-                account = post.account.name
+            return LedgerBalanceWindowsResponse(
+                windows=balances,
+                timestamp=datetime.datetime.now().isoformat(),
+            )
 
-                #print(f'post from account {full_account}')
-        
-                # Only process Despesa:Supermercado accounts
-                if not full_account.startswith("Despesas:Supermercado:"):
-                    continue
-
-                if post.amount.has_annotation():
-                    annotation = post.amount.annotation
-
-                    if annotation.price:
-                        # Get the total price paid
-                        total_price = annotation.price
-
-                        # Store or update if this is newer
-                        if account not in latest_prices or post_date > latest_prices[account][str(total_price.commodity)]['date']:
-                            latest_prices[account][str(total_price.commodity)] = {
-                                'date': post_date,
-                                'total_price': total_price,
-                                'is_commodity': False
-                            }
-            brl = ledger.commodities.find('USDT')
-            for dest_commodity in ledger.commodities.itervalues():
-                if str(dest_commodity) == 'kg' or str(dest_commodity) == 'un':
-                    continue
-
-                for commodity in ledger.commodities.itervalues():
-                    if str(commodity) == 'kg' or str(commodity) == 'un':
-                        continue
-
-                    now = datetime.datetime.now()
-                    epoch = datetime.datetime.fromtimestamp(0, tz=datetime.timezone.utc)
-                    updated_price = commodity.find_price(dest_commodity, now, epoch)
-                
-                    if updated_price:
-                        latest_prices[str(commodity)][str(dest_commodity)] = {
-                            'date': updated_price.when,
-                            'total_price': updated_price.price,
-                            'is_commodity': True
-                            }
-
-            prices : [LedgerPrice] = []
-            for dest,inner_elem in latest_prices.items():
-                amounts = {}
-                for source,price in inner_elem.items():
-                    print(f'prices final {dest} {price}')
-                    amounts[source] = str(price['total_price'].number())
-                prices.append({ 'what': dest,
-                                'amounts': amounts,
-                                'is_commodity': price['is_commodity'],
-                               })
-            return { 'prices': prices,
-                     'timestamp': datetime.datetime.now().isoformat(), }
+        except HTTPException:
+            raise
+        except Exception as e:
+            tb_str = traceback.format_exc()
+            logger.error("Something went wrong:\n%s", tb_str)
+            logger.error("Failed to get balance windows: %s", e)
+            raise HTTPException(status_code=500, detail=str(e))
+
+    def get_balance_feed(self) -> Tuple[str, bytes, Tuple[Tuple[str, bytes], ...]]:
+        """
+        The whole balance tree in the two forms a balance stream needs,
+        both from the same state: its generation, the LedgerBalanceResponse
+        JSON, and (full name, JSON) of every account in the NDJSON form of
+        iter_balance, in preorder.
+        """
+        state = self._get_state()
+        table = state.balance_table
+        with BALANCE_TREE_SECONDS.time():
+            window = table.window(None, None)
+            response = LedgerBalanceResponse(
+                account=self.get_account_balance(window, 0),
+                timestamp=datetime.datetime.now().isoformat(),
+            )
+            entries = tuple(
+                (account, json.dumps({
+                    "account": account.split(':')[-1],
+                    "fullPath": account,
+                    "depth": account.count(':') + 1 if account else 0,
+                    "amounts": window.amounts_of(row),
+                    "clearedAmounts": window.cleared_of(row),
+                }).encode())
+                for row, account in enumerate(table.accounts)
+            )
+        with SERIALIZATION_SECONDS.time(method="get_balance_feed"):
+            body = response.model_dump_json(by_alias=True).encode()
+        return state.generation, body, entries
+
+    def render(self, method: str, *args) -> Tuple[Optional[str], bytes]:
+        """
+        Call method and serialize its response model to JSON. Returns the
+        generation the response was computed from along with the body, so
+        callers can cache it, or None when the journal was reloaded while
+        computing it and either state may have been read.
+        """
+        generation = self.generation
+        response = getattr(self, method)(*args)
+        with SERIALIZATION_SECONDS.time(method=method):
+            body = response.model_dump_json(by_alias=True).encode()
+        return self._same_generation(generation), body
+
+    def get_prices(self, as_of: Optional[datetime.date] = None) -> LedgerPriceResponse:
+        """
+        Get prices for everything in Despesas:Supermercado:* and
+        commodities, the latest ones up to as_of (default: today)
+        """
+        try:
+            index = self._get_state().price_index
+            as_of = as_of or datetime.date.today()
+            prices : List[LedgerPrice] = []
+
+            with PRICE_LOOKUP_SECONDS.time():
+                account_prices = index.latest_account_prices(GROCERY_PREFIX, as_of)
+                commodity_prices = index.latest_commodity_prices(as_of)
+
+            for what, latest in account_prices.items():
+                prices.append(LedgerPrice(what=what, amounts=self._format_prices(latest), is_commodity=False))
+            for what, latest in commodity_prices.items():
+                prices.append(LedgerPrice(what=what, amounts=self._format_prices(latest), is_commodity=True))
+
+            return LedgerPriceResponse(
+                prices=prices,
+                timestamp=datetime.datetime.now().isoformat(),
+            )
 
         except Exception as e:
             tb_str = traceback.format_exc()
-            logging.error("Something went wrong:\n%s", tb_str)
-            logging.error(f"Failed to get prices: {e}")
+            logger.error("Something went wrong:\n%s", tb_str)
+            logger.error("Failed to get prices: %s", e)
+            raise HTTPException(status_code=500, detail=str(e))
+
+    def get_price_history(self, commodity: Optional[str], item: Optional[str], target: Optional[str],
+                          before: Optional[datetime.date], after: Optional[datetime.date],
+                          period: Optional[str] = None) -> LedgerPriceHistoryResponse:
+        """
+        Price history over [before, after) of a commodity (from P directives
+        and posting costs) or of a grocery item (the annotated prices of its
+        Despesas:Supermercado:* account), one series per target commodity.
+        With period (daily, weekly, monthly or yearly), each series keeps
+        only the last price of every period.
+        """
+        try:
+            if (commodity is None) == (item is None):
+                raise HTTPException(status_code=400, detail="Exactly one of commodity and item is required")
+            if period is not None and period not in PERIODS:
+                raise HTTPException(status_code=400, detail=f"Unknown period: {period}")
+            index = self._get_state().price_index
+
+            with PRICE_LOOKUP_SECONDS.time():
+                if commodity is not None:
+                    history = index.commodity_history(commodity, target, before, after, period)
+                else:
+                    history = index.account_history(GROCERY_PREFIX, item, target, before, after, period)
+            what = commodity if commodity is not None else item
+            if not history:
+                raise HTTPException(status_code=404, detail=f"No prices for {what}")
+
+            series = [
+                LedgerPriceSeries(target=t, points=[
+                    LedgerPricePoint(date=datetime.date.fromordinal(ordinal).strftime('%Y/%m/%d'),
+                                     price=format(price, 'f'))
+                    for ordinal, price in points
+                ])
+                for t, points in history.items()
+            ]
+
+            return LedgerPriceHistoryResponse(
+                what=what,
+                is_commodity=commodity is not None,
+                step=period,
+                series=series,
+                timestamp=datetime.datetime.now().isoformat(),
+            )
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            tb_str = traceback.format_exc()
+            logger.error("Something went wrong:\n%s", tb_str)
+            logger.error("Failed to get price history: %s", e)
             raise HTTPException(status_code=500, detail=str(e))
 
     # def get_account_balance(self, account_name: str, period: Optional[str] = None) -> LedgerBalanceResponse:
@@ -366,179 +1030,155 @@ class LedgerService:
     #         logger.error(f"Failed to get account balance: {e}")
     #         raise HTTPException(status_code=500, detail=str(e))
 
-    # def get_account_transactions(self, account_name: str, period: Optional[str] = None) -> LedgerTransactionResponse:
-    #     """Get transactions for specific account"""
-    #     try:
-    #         journal = self._get_journal()
-    #         transactions = []
-    #         running_balance = 0.0
-            
-    #         for xact in journal.xacts():
-    #             if not xact:
-    #                 continue
-                
-    #             for post in xact.posts():
-    #                 if not post or not post.account:
-    #                     continue
-                    
-    #                 full_path = post.account.fullname()
-    #                 if account_name.lower() in full_path.lower():
-    #                     amount_val, amount_str = self._format_amount(post.amount)
-    #                     running_balance += amount_val
-                        
-    #                     transactions.append(LedgerTransactionNode(
-    #                         date=xact.date.strftime('%Y/%m/%d'),
-    #                         description=xact.payee or '',
-    #                         amount=amount_val,
-    #                         formattedAmount=amount_str,
-    #                         runningBalance=running_balance,
-    #                         formattedRunningBalance=f"BRL {running_balance:,.2f}"
-    #                     ))
-            
-    #         transactions.sort(key=lambda x: x.date)
-            
-    #         return LedgerTransactionResponse(
-    #             transactions=transactions,
-    #             account=account_name,
-    #             period=period,
-    #             timestamp=datetime.now().isoformat()
-    #         )
-            
-    #     except Exception as e:
-    #         logger.error(f"Failed to get account transactions: {e}")
-    #         raise HTTPException(status_code=500, detail=str(e))
+    def get_account_transactions(self, account: str,
+                                 before: Optional[datetime.date], after: Optional[datetime.date],
+                                 cursor: Optional[str], limit: int) -> LedgerTransactionResponse:
+        """
+        One page of the register of account (its own postings, not its
+        subaccounts'), dated in [before, after). Each posting carries the
+        running balance of the account in its commodity over the whole
+        journal.
+        """
+        try:
+            index = self._get_state().register
+            if not index.knows(account):
+                raise HTTPException(status_code=404, detail=f"No postings for account {account}")
+            try:
+                position = decode_cursor(cursor) if cursor else None
+            except ValueError:
+                raise HTTPException(status_code=400, detail=f"Invalid cursor: {cursor}")
 
-    # def get_cash_flow(self, period: Optional[str] = None) -> LedgerSubTotalsResponse:
-    #     """Get cash flow (inflows and outflows)"""
-    #     try:
-    #         journal = self._get_journal()
-    #         cash_flow_map = {}
-            
-    #         for xact in journal.xacts():
-    #             if not xact:
-    #                 continue
-                
-    #             for post in xact.posts():
-    #                 if not post or not post.account:
-    #                     continue
-                    
-    #                 amount_val, _ = self._format_amount(post.amount)
-    #                 account_name = post.account.fullname()
-                    
-    #                 if account_name not in cash_flow_map:
-    #                     cash_flow_map[account_name] = {
-    #                         'inflow': 0.0,
-    #                         'outflow': 0.0,
-    #                         'balance': 0.0
-    #                     }
-                    
-    #                 if amount_val > 0:
-    #                     cash_flow_map[account_name]['inflow'] += amount_val
-    #                 else:
-    #                     cash_flow_map[account_name]['outflow'] += amount_val
-                    
-    #                 cash_flow_map[account_name]['balance'] += amount_val
-            
-    #         subtotals = [
-    #             LedgerSubTotalNode(
-    #                 description=account,
-    #                 inflowAmount=data['inflow'],
-    #                 outflowAmount=data['outflow'],
-    #                 runningBalance=data['balance']
-    #             )
-    #             for account, data in cash_flow_map.items()
-    #         ]
-            
-    #         return LedgerSubTotalsResponse(
-    #             subtotals=subtotals,
-    #             period=period,
-    #             timestamp=datetime.now().isoformat()
-    #         )
-            
-    #     except Exception as e:
-    #         logger.error(f"Failed to get cash flow: {e}")
-    #         raise HTTPException(status_code=500, detail=str(e))
+            rows, next_cursor = index.page(account, before, after, position, limit)
+            transactions = [
+                LedgerTransactionNode(
+                    date=datetime.date.fromordinal(ordinal).strftime('%Y/%m/%d'),
+                    description=payee,
+                    commodity=commodity,
+                    amount=self._format_decimal(amount),
+                    running_balance=self._format_decimal(running),
+                    cleared=cleared,
+                )
+                for ordinal, payee, commodity, amount, running, cleared in rows
+            ]
 
-    # def get_budget_report(self, period: Optional[str] = None) -> BudgetResponse:
-    #     """Get budget vs actual spending report"""
-    #     try:
-    #         journal = self._get_journal()
-            
-    #         budget_data = self._read_budget_from_file()
-    #         logger.info(f"Found {len(budget_data)} budget entries")
-            
-    #         actual_data = {}
-            
-    #         for xact in journal.xacts():
-    #             if not xact:
-    #                 continue
-                
-    #             payee = (xact.payee or '').lower()
-    #             if 'budget' in payee and not xact.posts():
-    #                 continue
-                
-    #             for post in xact.posts():
-    #                 if not post or not post.account:
-    #                     continue
-                    
-    #                 account_name = post.account.fullname()
-    #                 amount_val, _ = self._format_amount(post.amount)
-                    
-    #                 if account_name not in actual_data:
-    #                     actual_data[account_name] = 0.0
-    #                 actual_data[account_name] += abs(amount_val)
-            
-    #         budgeted_accounts = set(budget_data.keys())
-            
-    #         budget_items = []
-    #         total_actual = 0.0
-    #         total_budget = 0.0
-    #         total_variance = 0.0
-            
-    #         for account_path in sorted(budgeted_accounts):
-    #             actual_amount = actual_data.get(account_path, 0.0)
-    #             budget_amount = budget_data.get(account_path, 0.0)
-    #             variance = actual_amount - budget_amount
-                
-    #             if budget_amount != 0:
-    #                 variance_percentage = (variance / budget_amount) * 100
-    #             else:
-    #                 variance_percentage = 0.0
-                
-    #             account_parts = account_path.split(':')
-    #             account_name = account_parts[-1]
-                
-    #             is_over_budget = actual_amount > budget_amount
-                
-    #             budget_items.append(BudgetItem(
-    #                 account=account_name,
-    #                 fullPath=account_path,
-    #                 actualAmount=actual_amount,
-    #                 budgetAmount=budget_amount,
-    #                 variance=variance,
-    #                 variancePercentage=variance_percentage,
-    #                 formattedActual=f"BRL {actual_amount:,.2f}",
-    #                 formattedBudget=f"BRL {budget_amount:,.2f}",
-    #                 formattedVariance=f"BRL {variance:,.2f}",
-    #                 isOverBudget=is_over_budget
-    #             ))
-                
-    #             total_actual += actual_amount
-    #             total_budget += budget_amount
-    #             total_variance += variance
-            
-    #         logger.info(f"Generated budget report with {len(budget_items)} items")
-            
-    #         return BudgetResponse(
-    #             budgetItems=budget_items,
-    #             totalActual=total_actual,
-    #             totalBudget=total_budget,
-    #             totalVariance=total_variance,
-    #             period=period or 'this month',
-    #             timestamp=datetime.now().isoformat()
-    #         )
-            
-    #     except Exception as e:
-    #         logger.error(f"Failed to generate budget report: {e}")
-    #         raise HTTPException(status_code=500, detail=str(e))
+            return LedgerTransactionResponse(
+                transactions=transactions,
+                account=account,
+                next_cursor=encode_cursor(next_cursor) if next_cursor else None,
+                timestamp=datetime.datetime.now().isoformat(),
+            )
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            tb_str = traceback.format_exc()
+            logger.error("Something went wrong:\n%s", tb_str)
+            logger.error("Failed to get account transactions: %s", e)
+            raise HTTPException(status_code=500, detail=str(e))
 
+    def get_cash_flow(self, period: str, before: Optional[datetime.date], after: Optional[datetime.date],
+                      account: Optional[str] = None) -> LedgerSubTotalsResponse:
+        """
+        Inflow and outflow per period (daily, weekly, monthly or yearly),
+        account and commodity over [before, after), with the running
+        balance at the end of each period. With account, only that account
+        and its subaccounts are reported.
+        """
+        try:
+            if period not in PERIODS:
+                raise HTTPException(status_code=400, detail=f"Unknown period: {period}")
+            index = self._get_state().cash_flow_index
+
+            subtotals = [
+                LedgerSubTotalNode(
+                    date=datetime.date.fromordinal(start).strftime('%Y/%m/%d'),
+                    full_path=full_path,
+                    commodity=commodity,
+                    inflow_amount=self._format_decimal(inflow),
+                    outflow_amount=self._format_decimal(outflow),
+                    running_balance=self._format_decimal(running),
+                )
+                for start, full_path, commodity, inflow, outflow, running
+                in index.flows(period, before, after, account)
+            ]
+
+            return LedgerSubTotalsResponse(
+                subtotals=subtotals,
+                period=period,
+                timestamp=datetime.datetime.now().isoformat(),
+            )
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            tb_str = traceback.format_exc()
+            logger.error("Something went wrong:\n%s", tb_str)
+            logger.error("Failed to get cash flow: %s", e)
+            raise HTTPException(status_code=500, detail=str(e))
+
+    def get_budget_report(self, before: Optional[datetime.date], after: Optional[datetime.date]) -> BudgetResponse:
+        """
+        Get budget vs actual spending report over [before, after), by
+        default the current month. Budgets come from the journal's periodic
+        transactions; actuals are the balance of each budgeted account and
+        its subaccounts over the window.
+        """
+        try:
+            state = self._get_state()
+            if before is None:
+                before = (after or datetime.date.today()).replace(day=1)
+            if after is None:
+                after = next_period_start(before, 'monthly')
+
+            budget_data = state.budget_index.window(before, after)
+            balances = state.balance_table.window(before, after)
+
+            budget_items = []
+            total_actual = 0.0
+            total_budget = 0.0
+            total_variance = 0.0
+
+            for account_path, commodity in sorted(budget_data):
+                actual = balances.subtree_total(account_path, commodity)
+                actual_amount = float(abs(actual))
+                budget_amount = float(abs(budget_data[account_path, commodity]))
+                variance = actual_amount - budget_amount
+
+                if budget_amount != 0:
+                    variance_percentage = (variance / budget_amount) * 100
+                else:
+                    variance_percentage = 0.0
+
+                budget_items.append(BudgetItem(
+                    account=account_path.split(':')[-1],
+                    full_path=account_path,
+                    actual_amount=actual_amount,
+                    budget_amount=budget_amount,
+                    variance=variance,
+                    variance_percentage=variance_percentage,
+                    formatted_actual=f"{commodity} {actual_amount:,.2f}",
+                    formatted_budget=f"{commodity} {budget_amount:,.2f}",
+                    formatted_variance=f"{commodity} {variance:,.2f}",
+                    is_over_budget=actual_amount > budget_amount,
+                ))
+
+                total_actual += actual_amount
+                total_budget += budget_amount
+                total_variance += variance
+
+            logger.debug("Generated budget report with %d items", len(budget_items))
+
+            return BudgetResponse(
+                budget_items=budget_items,
+                total_actual=total_actual,
+                total_budget=total_budget,
+                total_variance=total_variance,
+                period=f"{before.strftime('%Y/%m/%d')} - {after.strftime('%Y/%m/%d')}",
+                timestamp=datetime.datetime.now().isoformat(),
+            )
+
+        except Exception as e:
+            tb_str = traceback.format_exc()
+            logger.error("Something went wrong:\n%s", tb_str)
+            logger.error("Failed to generate budget report: %s", e)
+            raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,325 @@
+# ============================================================================
+# services/metrics.py - Minimal Prometheus-style metrics
+# ============================================================================
+
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+import math
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Registry:
+    """Set of metrics rendered together in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: List["_Metric"] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: "_Metric"):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def take(self, names: Sequence[str]) -> Dict[str, dict]:
+        """
+        Values of the named metrics recorded since the last take, for a
+        process to hand its metrics to another one (see merge)
+        """
+        with self._lock:
+            metrics = [m for m in self._metrics if m.name in names]
+        return {metric.name: metric.take() for metric in metrics}
+
+    def merge(self, taken: Dict[str, dict]):
+        """Add values taken from another process's registry to these metrics"""
+        with self._lock:
+            metrics = {m.name: m for m in self._metrics}
+        for name, values in taken.items():
+            if name in metrics:
+                metrics[name].merge(values)
+
+    def expose(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        lines: List[str] = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional[Registry] = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def take(self) -> dict:
+        """Values by label values, reset for the next take where they accumulate"""
+        raise NotImplementedError
+
+    def merge(self, values: dict):
+        """Add values from take of the same metric in another process"""
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = dict(self._values)
+        for key, value in values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+    def take(self) -> dict:
+        with self._lock:
+            values, self._values = self._values, {}
+        return values
+
+    def merge(self, values: dict):
+        with self._lock:
+            for key, value in values.items():
+                self._values[key] = self._values.get(key, 0.0) + value
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def remove(self, **labels):
+        """Stop exposing the value of these label values"""
+        key = self._key(labels)
+        with self._lock:
+            self._values.pop(key, None)
+
+    def set_function(self, function: Callable[[], float]):
+        """Read the (unlabelled) value from function at exposition time"""
+        self._function = function
+
+    def samples(self) -> Iterator[str]:
+        if self._function is not None:
+            yield f"{self.name} {_format_value(self._function())}"
+            return
+        with self._lock:
+            values = dict(self._values)
+        for key, value in values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+    def take(self) -> dict:
+        # Current values: a gauge is not a sum, so nothing is reset
+        with self._lock:
+            return dict(self._values)
+
+    def merge(self, values: dict):
+        with self._lock:
+            self._values.update(values)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # label values -> (per-bucket counts, sum)
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with block, in seconds"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = {k: (list(c), s) for k, (c, s) in self._values.items()}
+        for key, (counts, total) in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = 'le="%s"' % _format_value(bound)
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}"
+
+    def take(self) -> dict:
+        with self._lock:
+            values, self._values = self._values, {}
+        return values
+
+    def merge(self, values: dict):
+        with self._lock:
+            for key, (counts, total) in values.items():
+                current, current_total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+                self._values[key] = ([a + b for a, b in zip(current, counts)], current_total + total)
+
+
+# Ledger service metrics
+
+JOURNAL_LOAD_SECONDS = Histogram(
+    "ledger_journal_load_seconds", "Time to parse the journal and build its indexes", ["source"])
+BALANCE_TREE_SECONDS = Histogram(
+    "ledger_balance_tree_seconds", "Time to compute a balance tree from the index")
+PRICE_LOOKUP_SECONDS = Histogram(
+    "ledger_price_lookup_seconds", "Time to look up the latest prices in the price index")
+SERIALIZATION_SECONDS = Histogram(
+    "ledger_serialization_seconds", "Time to serialize a response model to JSON", ["method"])
+JOURNAL_POSTS = Gauge("ledger_journal_posts", "Postings in the loaded journal", ["journal"])
+JOURNAL_ACCOUNTS = Gauge("ledger_journal_accounts", "Accounts in the loaded journal", ["journal"])
+JOURNAL_COMMODITIES = Gauge(
+    "ledger_journal_commodities", "Commodities used by postings of the loaded journal", ["journal"])
+EXECUTOR_PENDING = Gauge("ledger_executor_pending", "Ledger calls queued or running in the executor")
+BALANCE_STREAM_SUBSCRIBERS = Gauge(
+    "ledger_balance_stream_subscribers", "Clients following /api/balance/stream")
+JOURNALS_LOADED = Gauge("ledger_journals_loaded", "Journals loaded by this process")
+JOURNAL_EVICTIONS = Counter("ledger_journal_evictions_total", "Idle journals closed to stay within the memory budget")
+EXECUTOR_CALLS = Counter(
+    "ledger_executor_calls_total",
+    "Ledger calls, executed or coalesced into an identical call already in flight", ["method", "outcome"])
+
+# Metrics recorded where the ledger work runs; in the executor's process
+# mode, workers send them back with the result of each call
+WORKER_METRICS = tuple(metric.name for metric in (
+    JOURNAL_LOAD_SECONDS, BALANCE_TREE_SECONDS, PRICE_LOOKUP_SECONDS, SERIALIZATION_SECONDS,
+    JOURNAL_POSTS, JOURNAL_ACCOUNTS, JOURNAL_COMMODITIES))
+
+# HTTP metrics
+
+HTTP_REQUESTS = Counter(
+    "ledger_http_requests_total", "HTTP requests by route and status", ["method", "route", "status"])
+HTTP_REQUEST_SECONDS = Histogram(
+    "ledger_http_request_seconds", "HTTP request latency by route", ["method", "route"])
+HTTP_IN_FLIGHT = Gauge("ledger_http_requests_in_flight", "HTTP requests being served")
+HTTP_EVENT_STREAM_SECONDS = Histogram(
+    "ledger_http_event_stream_seconds", "Lifetime of Server-Sent Events connections by route",
+    ["method", "route"], buckets=(1.0, 10.0, 60.0, 300.0, 900.0, 3600.0, 14400.0, 86400.0))
+
+_EVENT_STREAM = b"text/event-stream"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting requests per route and timing them.
+
+    Server-Sent Events responses (text/event-stream) stay open as long as
+    the client follows them: they leave the in-flight gauge once their
+    response starts, their request latency is the time until then, and
+    the lifetime of the connection goes to a histogram of its own.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+        # Set once an event stream response starts
+        stream_started: List[float] = []
+
+        async def send_recording_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                content_type = dict(message.get("headers", ())).get(b"content-type", b"")
+                if content_type.startswith(_EVENT_STREAM):
+                    stream_started.append(time.perf_counter())
+                    HTTP_IN_FLIGHT.dec()
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_recording_status)
+        finally:
+            finished = time.perf_counter()
+            if not stream_started:
+                HTTP_IN_FLIGHT.dec()
+            # The router stores the matched route in the scope; use its
+            # template so path parameters do not explode the label space
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            method = scope["method"]
+            if stream_started:
+                HTTP_REQUEST_SECONDS.observe(stream_started[0] - started, method=method, route=path)
+                HTTP_EVENT_STREAM_SECONDS.observe(finished - started, method=method, route=path)
+            else:
+                HTTP_REQUEST_SECONDS.observe(finished - started, method=method, route=path)
+            HTTP_REQUESTS.inc(method=method, route=path, status=str(status["code"]))
@@ -0,0 +1,355 @@
+# ============================================================================
+# services/price_index.py - Price graph and annotated-posting price index
+# ============================================================================
+
+from bisect import bisect_left, bisect_right
+from decimal import Decimal
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import datetime
+import heapq
+import logging
+import re
+
+import ledger
+
+from services.balance_index import QUANTITY_COMMODITIES, to_decimal
+from services.cash_flow_index import next_period_start
+
+logger = logging.getLogger(__name__)
+
+# Accounts whose postings carry item prices (e.g. "2 kg @ BRL 6.00")
+GROCERY_PREFIX = "Despesas:Supermercado:"
+
+_DATE_FORMATS = ('%Y/%m/%d', '%Y-%m-%d', '%Y.%m.%d')
+
+# Blocks ledger reads nothing from, up to a line starting with their end
+_BLOCK_START = re.compile(r'^(?:comment|test)(?:\s|$)')
+_BLOCK_END = ('end comment', 'end test')
+
+# (date ordinals, prices) sorted by date
+PriceSeries = Tuple[List[int], List[Decimal]]
+
+# Conversion tables kept per index, one per (target, date) asked for
+_MAX_RATE_TABLES = 64
+
+
+def parse_date(text: str) -> Optional[datetime.date]:
+    """Date in one of ledger's date formats, or None"""
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _add(series: Dict[str, Dict[str, list]], key: str, target: str,
+         ordinal: int, price: Decimal):
+    series.setdefault(key, {}).setdefault(target, []).append((ordinal, price))
+
+
+def _freeze(points: Dict[str, Dict[str, list]]) -> Dict[str, Dict[str, PriceSeries]]:
+    frozen: Dict[str, Dict[str, PriceSeries]] = {}
+    for key, by_target in points.items():
+        for target, pairs in by_target.items():
+            # Stable sort: for equal dates the entry read last wins, as in ledger
+            pairs.sort(key=lambda p: p[0])
+            frozen.setdefault(key, {})[target] = ([p[0] for p in pairs], [p[1] for p in pairs])
+    return frozen
+
+
+def _merge(series: Dict[str, Dict[str, PriceSeries]],
+           points: Dict[str, Dict[str, list]]) -> Dict[str, Dict[str, PriceSeries]]:
+    """Copy of series with points added; only the series that change are copied"""
+    merged = dict(series)
+    for key, by_target in points.items():
+        merged[key] = dict(merged.get(key, {}))
+        for target, pairs in by_target.items():
+            dates, prices = merged[key].get(target, ([], []))
+            dates, prices = list(dates), list(prices)
+            for ordinal, price in pairs:
+                i = bisect_right(dates, ordinal)
+                dates.insert(i, ordinal)
+                prices.insert(i, price)
+            merged[key][target] = (dates, prices)
+    return merged
+
+
+def _price_directives(lines: Iterable[str], path: str) -> Iterator[Tuple[int, str, "ledger.Amount"]]:
+    """
+    (date ordinal, commodity, price) of the P directives among lines, as
+    ledger's commodity pool parses them; the prices are not added to the
+    pool again. Lines inside comment and test blocks are skipped, as
+    ledger skips them. Callers must hold ledger_lock.
+    """
+    pool = ledger.commodities
+    in_block = False
+    for line in lines:
+        if in_block:
+            in_block = not line.startswith(_BLOCK_END)
+            continue
+        if _BLOCK_START.match(line):
+            in_block = True
+            continue
+        if not line.startswith('P'):
+            continue
+        try:
+            directive = pool.parse_price_directive(line[1:].strip(), True, False)
+        except Exception as e:
+            # Ledger raises amount and date errors as several exception types
+            logger.warning("Ignoring malformed price directive in %s: %s (%s)", path, line.rstrip(), e)
+            continue
+        if not directive:
+            logger.warning("Ignoring malformed price directive in %s: %s", path, line.rstrip())
+            continue
+        commodity, point = directive
+        yield point.when.date().toordinal(), str(commodity).strip('"'), point.price
+
+
+def _latest(series: PriceSeries, as_of: Optional[int]) -> Optional[Tuple[int, Decimal]]:
+    dates, prices = series
+    i = bisect_right(dates, as_of) if as_of is not None else len(dates)
+    if i == 0:
+        return None
+    return dates[i - 1], prices[i - 1]
+
+
+def _history(series: PriceSeries, lower: Optional[int], upper: Optional[int],
+             period: Optional[str]) -> List[Tuple[int, Decimal]]:
+    """
+    (date ordinal, price) of series dated in [lower, upper). With period,
+    only the last price of each period (as in period_starts) is kept; each
+    period costs one binary search, not a pass over its prices.
+    """
+    dates, prices = series
+    lo = bisect_left(dates, lower) if lower is not None else 0
+    hi = bisect_left(dates, upper) if upper is not None else len(dates)
+    if period is None:
+        return list(zip(dates[lo:hi], prices[lo:hi]))
+    points = []
+    while lo < hi:
+        end = next_period_start(datetime.date.fromordinal(dates[lo]), period).toordinal()
+        lo = bisect_left(dates, end, lo, hi)
+        points.append((dates[lo - 1], prices[lo - 1]))
+    return points
+
+
+class PriceIndex:
+    """
+    Prices known to a journal, built once per load.
+
+    commodity_series is the price graph: for every commodity, the dated
+    series of direct prices per target commodity, from P directives and
+    from costs on postings (`@` prices). account_series holds the prices
+    of annotated postings per account, so item prices under an account
+    prefix are a range lookup over the sorted account names.
+    """
+
+    def __init__(self, commodity_series: Dict[str, Dict[str, PriceSeries]],
+                 account_series: Dict[str, Dict[str, PriceSeries]]):
+        self.commodity_series = commodity_series
+        self.account_series = account_series
+        self.accounts = sorted(account_series)
+        # Commodities priced in terms of each other, in either direction
+        self._neighbors: Dict[str, List[str]] = {}
+        for commodity, by_target in commodity_series.items():
+            for target in by_target:
+                self._neighbors.setdefault(commodity, []).append(target)
+                self._neighbors.setdefault(target, []).append(commodity)
+        for neighbors in self._neighbors.values():
+            neighbors.sort()
+        # (target, as_of ordinal) -> conversion_rates, filled on demand
+        self._rates: Dict[Tuple[str, Optional[int]], Dict[str, Decimal]] = {}
+
+    @classmethod
+    def from_journal(cls, journal, sources: Iterable[str]) -> "PriceIndex":
+        """Build the index. Callers must hold ledger_lock."""
+        commodities: Dict[str, Dict[str, list]] = {}
+        accounts: Dict[str, Dict[str, list]] = {}
+
+        for source in sources:
+            try:
+                with open(source, 'r', encoding='utf-8') as f:
+                    cls._collect_directives(commodities, f, source)
+            except OSError as e:
+                logger.warning("Could not read prices from %s: %s", source, e)
+        cls._collect_postings(commodities, accounts, journal.xacts())
+
+        return cls(_freeze(commodities), _freeze(accounts))
+
+    @staticmethod
+    def _collect_directives(commodities: Dict[str, Dict[str, list]], lines: Iterable[str], path: str):
+        for ordinal, commodity, price in _price_directives(lines, path):
+            _add(commodities, commodity, str(price.commodity), ordinal, to_decimal(price))
+
+    @staticmethod
+    def _collect_postings(commodities: Dict[str, Dict[str, list]], accounts: Dict[str, Dict[str, list]], xacts):
+        for xact in xacts:
+            for post in xact.posts():
+                if not post.amount.has_annotation():
+                    continue
+                price = post.amount.annotation.price
+                if not price:
+                    continue
+                ordinal = post.date.toordinal()
+                target = str(price.commodity)
+                value = to_decimal(price)
+                commodity = str(post.amount.commodity)
+                if commodity not in QUANTITY_COMMODITIES and target not in QUANTITY_COMMODITIES:
+                    _add(commodities, commodity, target, ordinal, value)
+                _add(accounts, post.account.fullname(), target, ordinal, value)
+
+    def with_journal_text(self, xacts, lines: Iterable[str], path: str) -> "PriceIndex":
+        """
+        Copy of the index with the prices of xacts and of the P directives
+        in lines added after the existing prices of the same day. Callers
+        must hold ledger_lock.
+        """
+        commodities: Dict[str, Dict[str, list]] = {}
+        accounts: Dict[str, Dict[str, list]] = {}
+        self._collect_directives(commodities, lines, path)
+        self._collect_postings(commodities, accounts, xacts)
+        return PriceIndex(_merge(self.commodity_series, commodities), _merge(self.account_series, accounts))
+
+    def latest_commodity_prices(self, as_of: Optional[datetime.date] = None
+                                ) -> Dict[str, Dict[str, Tuple[int, Decimal]]]:
+        """Latest direct price of every commodity per target, as of a date"""
+        ordinal = as_of.toordinal() if as_of else None
+        result: Dict[str, Dict[str, Tuple[int, Decimal]]] = {}
+        for commodity, by_target in self.commodity_series.items():
+            for target, series in by_target.items():
+                latest = _latest(series, ordinal)
+                if latest:
+                    result.setdefault(commodity, {})[target] = latest
+        return result
+
+    def latest_account_prices(self, prefix: str, as_of: Optional[datetime.date] = None
+                              ) -> Dict[str, Dict[str, Tuple[int, Decimal]]]:
+        """
+        Latest annotated price per target of every account under prefix,
+        keyed by the account's own name (its last path component).
+        """
+        ordinal = as_of.toordinal() if as_of else None
+        result: Dict[str, Dict[str, Tuple[int, Decimal]]] = {}
+        start = bisect_left(self.accounts, prefix)
+        for account in self.accounts[start:]:
+            if not account.startswith(prefix):
+                break
+            name = account.split(':')[-1]
+            for target, series in self.account_series[account].items():
+                latest = _latest(series, ordinal)
+                if not latest:
+                    continue
+                current = result.setdefault(name, {}).get(target)
+                if current is None or latest[0] >= current[0]:
+                    result[name][target] = latest
+        return result
+
+    def knows(self, commodity: str) -> bool:
+        """Whether any price involves commodity"""
+        return commodity in self._neighbors
+
+    def _rate(self, commodity: str, target: str, ordinal: Optional[int]) -> Optional[Decimal]:
+        """
+        Price of one commodity in target as of ordinal, from the latest of
+        the direct prices and the inverted prices of target in commodity;
+        on the same day the direct price wins.
+        """
+        direct = self.commodity_series.get(commodity, {}).get(target)
+        inverse = self.commodity_series.get(target, {}).get(commodity)
+        direct = _latest(direct, ordinal) if direct else None
+        inverse = _latest(inverse, ordinal) if inverse else None
+        if inverse is not None and inverse[1] and (direct is None or inverse[0] > direct[0]):
+            return 1 / inverse[1]
+        return direct[1] if direct is not None else None
+
+    def conversion_rates(self, target: str, as_of: Optional[datetime.date] = None) -> Dict[str, Decimal]:
+        """
+        Value in target of one unit of every commodity that can be
+        converted to it as of a date (the latest prices without one),
+        target itself included. Conversions follow the shortest chain of
+        prices, as ledger does for commodities without a direct price.
+        Tables are kept per (target, date), so converting many balances
+        costs one table lookup per amount.
+        """
+        ordinal = as_of.toordinal() if as_of else None
+        rates = self._rates.get((target, ordinal))
+        if rates is not None:
+            return rates
+
+        rates = {target: Decimal(1)}
+        frontier = [target]
+        while frontier:
+            reached = []
+            for known in frontier:
+                for commodity in self._neighbors.get(known, ()):
+                    if commodity in rates:
+                        continue
+                    rate = self._rate(commodity, known, ordinal)
+                    if rate is not None:
+                        rates[commodity] = rate * rates[known]
+                        reached.append(commodity)
+            frontier = reached
+
+        if len(self._rates) >= _MAX_RATE_TABLES:
+            self._rates.clear()
+        self._rates[(target, ordinal)] = rates
+        return rates
+
+    def commodity_history(self, commodity: str, target: Optional[str],
+                          lower: Optional[datetime.date], upper: Optional[datetime.date],
+                          period: Optional[str] = None) -> Dict[str, List[Tuple[int, Decimal]]]:
+        """
+        Direct prices of commodity per target (only target when given)
+        dated in [lower, upper), optionally reduced to one per period.
+        """
+        by_target = self.commodity_series.get(commodity, {})
+        return {
+            t: _history(series, lower.toordinal() if lower else None, upper.toordinal() if upper else None, period)
+            for t, series in sorted(by_target.items()) if target is None or t == target
+        }
+
+    def account_history(self, prefix: str, name: str, target: Optional[str],
+                        lower: Optional[datetime.date], upper: Optional[datetime.date],
+                        period: Optional[str] = None) -> Dict[str, List[Tuple[int, Decimal]]]:
+        """
+        Annotated prices per target of the accounts under prefix named
+        name (their last path component, as in latest_account_prices),
+        dated in [lower, upper), optionally reduced to one per period.
+        """
+        merged: Dict[str, List[PriceSeries]] = {}
+        start = bisect_left(self.accounts, prefix)
+        for account in self.accounts[start:]:
+            if not account.startswith(prefix):
+                break
+            if account.split(':')[-1] != name:
+                continue
+            for t, series in self.account_series[account].items():
+                if target is None or t == target:
+                    merged.setdefault(t, []).append(series)
+
+        result = {}
+        for t, parts in sorted(merged.items()):
+            series = parts[0]
+            if len(parts) > 1:
+                pairs = list(heapq.merge(*(zip(*part) for part in parts), key=lambda p: p[0]))
+                series = ([p[0] for p in pairs], [p[1] for p in pairs])
+            result[t] = _history(series, lower.toordinal() if lower else None,
+                                 upper.toordinal() if upper else None, period)
+        return result
+
+    def to_dict(self) -> dict:
+        """JSON-friendly form, for snapshots"""
+        def dump(series):
+            return {key: {target: [dates, [str(p) for p in prices]]
+                          for target, (dates, prices) in by_target.items()}
+                    for key, by_target in series.items()}
+        return {"commodities": dump(self.commodity_series), "accounts": dump(self.account_series)}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "PriceIndex":
+        def load(series):
+            return {key: {target: (dates, [Decimal(p) for p in prices])
+                          for target, (dates, prices) in by_target.items()}
+                    for key, by_target in series.items()}
+        return cls(load(data["commodities"]), load(data["accounts"]))
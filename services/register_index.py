@@ -0,0 +1,354 @@
+# ============================================================================
+# services/register_index.py - Per-account posting register
+# ============================================================================
+
+from bisect import bisect_left, bisect_right
+from decimal import Decimal
+from typing import Dict, List, Optional, Sequence, Tuple
+import datetime
+
+from services.balance_index import decimal_scale, posting_amount, to_decimal
+
+# (date ordinal, postings of that date already returned)
+Cursor = Tuple[int, int]
+
+# (date ordinal, payee, commodity, amount, running balance, cleared)
+RegisterRow = Tuple[int, str, str, Decimal, Decimal, bool]
+
+
+def encode_cursor(cursor: Cursor) -> str:
+    ordinal, skip = cursor
+    return f"{datetime.date.fromordinal(ordinal).isoformat()}.{skip}"
+
+
+def decode_cursor(text: str) -> Cursor:
+    """Parse a cursor made by encode_cursor; raises ValueError if malformed"""
+    date, _, skip = text.partition('.')
+    cursor = (datetime.date.fromisoformat(date).toordinal(), int(skip))
+    if cursor[1] < 0:
+        raise ValueError(f"Invalid cursor: {text}")
+    return cursor
+
+
+def _merged_rows(group: List[List[int]], additions: List[Tuple[int, int, int, int, int]]) -> List[List[int]]:
+    """
+    Columns (dates, payees, commodities, amounts, running, cleared) of an
+    account's rows with additions (date ordinal, payee, commodity, amount,
+    cleared) merged in after the existing rows of the same day. Existing
+    rows are copied a slice at a time between additions; their running
+    balances are shifted by what was added before them in their commodity.
+    """
+    dates, payees, commodities, amounts, running, cleared = group
+    additions = sorted(additions, key=lambda row: row[0])
+    first = bisect_right(dates, additions[0][0])
+
+    # Balance per commodity just before the first addition
+    needed = {row[2] for row in additions}
+    balances: Dict[int, int] = {}
+    for j in range(first - 1, -1, -1):
+        if len(balances) == len(needed):
+            break
+        if commodities[j] in needed:
+            balances.setdefault(commodities[j], running[j])
+
+    merged = [column[:first] for column in group]
+    merged_running = merged[4]
+    shifts: Dict[int, int] = {}
+    previous = first
+    for ordinal, payee_id, commodity_id, scaled, is_cleared in additions:
+        position = bisect_right(dates, ordinal, previous)
+        if position > previous:
+            segment = commodities[previous:position]
+            for column, values in zip(merged, group):
+                if values is not running:
+                    column.extend(values[previous:position])
+            shifted = [value + shifts.get(c, 0) for value, c in zip(running[previous:position], segment)]
+            merged_running.extend(shifted)
+            balances.update(zip(segment, shifted))
+        balances[commodity_id] = balances.get(commodity_id, 0) + scaled
+        shifts[commodity_id] = shifts.get(commodity_id, 0) + scaled
+        for column, value in zip(merged, (ordinal, payee_id, commodity_id, scaled,
+                                          balances[commodity_id], is_cleared)):
+            column.append(value)
+        previous = position
+
+    for column, values in zip(merged, group):
+        if values is not running:
+            column.extend(values[previous:])
+    merged_running.extend(value + shifts.get(c, 0) for value, c in zip(running[previous:], commodities[previous:]))
+    return merged
+
+
+class RegisterIndex:
+    """
+    Read-only posting register built once per journal load.
+
+    The postings of every account are stored contiguously in the columns,
+    sorted by date and in journal order within a day, next to the running
+    balance of the account in the posting's commodity. Amounts are integers
+    scaled by 10 ** scales[commodity], as in BalanceIndex. A page of an
+    account's register is a binary search on its dates and a slice, so its
+    cost depends on the page size and not on the size of the journal.
+
+    Pages are addressed by keyset cursors (a date and the number of postings
+    of that date already seen) rather than offsets, so a cursor stays
+    meaningful across journal reloads.
+    """
+
+    def __init__(self,
+                 accounts: Dict[str, Tuple[int, int]],
+                 payees: List[str],
+                 commodities: List[str],
+                 scales: Dict[str, int],
+                 dates: Sequence[int],
+                 payee_ids: Sequence[int],
+                 commodity_ids: Sequence[int],
+                 amounts: Sequence[int],
+                 running: Sequence[int],
+                 cleared: Sequence[int]):
+        self.accounts = accounts
+        self.payees = payees
+        self.commodities = commodities
+        self.scales = scales
+        self.dates = dates
+        self.payee_ids = payee_ids
+        self.commodity_ids = commodity_ids
+        self.amounts = amounts
+        self.running = running
+        self.cleared = cleared
+        # account -> commodity id -> positions of the account's rows in it
+        self._commodity_rows: Dict[str, Dict[int, List[int]]] = {}
+
+    @classmethod
+    def from_journal(cls, journal) -> "RegisterIndex":
+        """Build the register. Callers must hold ledger_lock."""
+        postings: Dict[str, List[Tuple[int, str, str, Decimal, bool]]] = {}
+        scales: Dict[str, int] = {}
+
+        stack = [journal.master]
+        while stack:
+            account = stack.pop()
+            stack.extend(account.accounts())
+            rows = []
+            for post in account.posts():
+                amount = posting_amount(post)
+                commodity = str(amount.commodity)
+                value = to_decimal(amount)
+                scales[commodity] = max(scales.get(commodity, 0), decimal_scale(value))
+                rows.append((post.date.toordinal(), post.xact.payee or '', commodity, value,
+                             str(post.state) == 'Cleared'))
+            if rows:
+                # Stable sort: journal order is kept within a day
+                rows.sort(key=lambda r: r[0])
+                postings[account.fullname()] = rows
+
+        accounts: Dict[str, Tuple[int, int]] = {}
+        payees: Dict[str, int] = {}
+        commodities = {c: i for i, c in enumerate(sorted(scales))}
+        dates: List[int] = []
+        payee_ids: List[int] = []
+        commodity_ids: List[int] = []
+        amounts: List[int] = []
+        running: List[int] = []
+        cleared: List[int] = []
+        for full_path, rows in postings.items():
+            start = len(dates)
+            balances: Dict[str, int] = {}
+            for ordinal, payee, commodity, value, is_cleared in rows:
+                scaled = int(value * 10 ** scales[commodity])
+                balances[commodity] = balances.get(commodity, 0) + scaled
+                dates.append(ordinal)
+                payee_ids.append(payees.setdefault(payee, len(payees)))
+                commodity_ids.append(commodities[commodity])
+                amounts.append(scaled)
+                running.append(balances[commodity])
+                cleared.append(1 if is_cleared else 0)
+            accounts[full_path] = (start, len(dates))
+
+        return cls(accounts, list(payees), list(commodities), scales,
+                   dates, payee_ids, commodity_ids, amounts, running, cleared)
+
+    def _row(self, i: int, running: Optional[int] = None) -> RegisterRow:
+        commodity = self.commodities[self.commodity_ids[i]]
+        scale = self.scales[commodity]
+        return (
+            self.dates[i],
+            self.payees[self.payee_ids[i]],
+            commodity,
+            Decimal(self.amounts[i]).scaleb(-scale),
+            Decimal(self.running[i] if running is None else running).scaleb(-scale),
+            bool(self.cleared[i]),
+        )
+
+    def knows(self, account: str) -> bool:
+        """Whether account has postings"""
+        return account in self.accounts
+
+    def balance_before(self, account: str, i: int, commodity_id: int) -> int:
+        """
+        Running balance of account in commodity_id just before position i
+        (0 if none). The positions of the account's rows in each commodity
+        are gathered on first use, so later lookups are a binary search.
+        """
+        if account not in self.accounts:
+            return 0
+        by_commodity = self._commodity_rows.get(account)
+        if by_commodity is None:
+            start, end = self.accounts[account]
+            by_commodity = {}
+            for position, c in enumerate(self.commodity_ids[start:end], start):
+                by_commodity.setdefault(c, []).append(position)
+            self._commodity_rows[account] = by_commodity
+        positions = by_commodity.get(commodity_id, [])
+        k = bisect_left(positions, i)
+        return self.running[positions[k - 1]] if k else 0
+
+    def delta(self) -> "RegisterIndex":
+        """
+        Empty register with the same commodities and scales, to collect
+        postings appended after this one was built (see LayeredRegister)
+        """
+        return RegisterIndex({}, [], self.commodities, self.scales, [], [], [], [], [], [])
+
+    def page(self, account: str,
+             lower: Optional[datetime.date], upper: Optional[datetime.date],
+             cursor: Optional[Cursor], limit: int) -> Tuple[List[RegisterRow], Optional[Cursor]]:
+        """
+        Up to limit postings of account dated in [lower, upper), starting at
+        cursor, with the cursor of the next page (None on the last page).
+        Raises KeyError for an account without postings.
+        """
+        start, end = self.accounts[account]
+        lo = bisect_left(self.dates, lower.toordinal(), start, end) if lower else start
+        hi = bisect_left(self.dates, upper.toordinal(), start, end) if upper else end
+        if cursor is not None:
+            ordinal, skip = cursor
+            lo = max(lo, bisect_left(self.dates, ordinal, start, end) + skip)
+
+        stop = min(lo + limit, hi)
+        rows = [self._row(i) for i in range(lo, stop)]
+        next_cursor = None
+        if stop < hi:
+            ordinal = self.dates[stop]
+            next_cursor = (ordinal, stop - bisect_left(self.dates, ordinal, start, end))
+        return rows, next_cursor
+
+    def with_postings(self, postings: List[Tuple[str, int, str, str, Decimal, bool]]) -> "RegisterIndex":
+        """
+        Copy of the register with postings (account, date ordinal, payee,
+        commodity, amount, cleared) added after the existing postings of the
+        same day. Raises ValueError when an amount needs more decimal places
+        than its commodity has so far.
+        """
+        scales = dict(self.scales)
+        for account, ordinal, payee, commodity, value, is_cleared in postings:
+            scale = decimal_scale(value)
+            if commodity in self.scales and scale > self.scales[commodity]:
+                raise ValueError(f"{commodity} amount needs {scale} decimal places")
+            scales[commodity] = max(scales.get(commodity, 0), scale)
+
+        payees = list(self.payees)
+        payee_ids = {p: i for i, p in enumerate(payees)}
+        commodities = list(self.commodities)
+        commodities += sorted(set(scales) - set(commodities))
+        commodity_ids = {c: i for i, c in enumerate(commodities)}
+        added: Dict[str, List[Tuple[int, int, int, int, int]]] = {}
+        for account, ordinal, payee, commodity, value, is_cleared in postings:
+            if payee not in payee_ids:
+                payee_ids[payee] = len(payees)
+                payees.append(payee)
+            added.setdefault(account, []).append((ordinal, payee_ids[payee], commodity_ids[commodity],
+                                                  int(value * 10 ** scales[commodity]), int(is_cleared)))
+
+        accounts: Dict[str, Tuple[int, int]] = {}
+        columns: Tuple[List[int], ...] = ([], [], [], [], [], [])
+        dates, row_payees, row_commodities, amounts, running, cleared = columns
+        names = list(self.accounts) + [a for a in added if a not in self.accounts]
+        for account in names:
+            start, end = self.accounts.get(account, (0, 0))
+            group = [list(column[start:end]) for column in (
+                self.dates, self.payee_ids, self.commodity_ids, self.amounts, self.running, self.cleared)]
+            additions = added.get(account)
+            if additions:
+                group = _merged_rows(group, additions)
+            accounts[account] = (len(dates), len(dates) + len(group[0]))
+            for column, values in zip(columns, group):
+                column.extend(values)
+
+        return RegisterIndex(accounts, payees, commodities, scales,
+                             dates, row_payees, row_commodities, amounts, running, cleared)
+
+
+class LayeredRegister:
+    """
+    Register of a RegisterIndex and of the postings appended since, kept
+    in a delta register (RegisterIndex.delta) so that appending does not
+    copy the base. Pages merge the two by date, appended postings after
+    the base ones of the same day, and running balances add up the base
+    and delta balances of each posting's commodity.
+    """
+
+    def __init__(self, base: RegisterIndex, delta: RegisterIndex):
+        self.base = base
+        self.delta = delta
+
+    def knows(self, account: str) -> bool:
+        """Whether account has postings"""
+        return self.base.knows(account) or self.delta.knows(account)
+
+    def page(self, account: str,
+             lower: Optional[datetime.date], upper: Optional[datetime.date],
+             cursor: Optional[Cursor], limit: int) -> Tuple[List[RegisterRow], Optional[Cursor]]:
+        """Same as RegisterIndex.page, over the merged postings"""
+        base, delta = self.base, self.delta
+        if not self.knows(account):
+            raise KeyError(account)
+        base_start, base_end = base.accounts.get(account, (0, 0))
+        delta_start, delta_end = delta.accounts.get(account, (0, 0))
+        base_dates, delta_dates = base.dates, delta.dates
+
+        def bounds(ordinal: Optional[int], default_base: int, default_delta: int) -> Tuple[int, int]:
+            if ordinal is None:
+                return default_base, default_delta
+            return (bisect_left(base_dates, ordinal, base_start, base_end),
+                    bisect_left(delta_dates, ordinal, delta_start, delta_end))
+
+        i, j = bounds(lower.toordinal() if lower else None, base_start, delta_start)
+        base_stop, delta_stop = bounds(upper.toordinal() if upper else None, base_end, delta_end)
+        if cursor is not None:
+            ordinal, skip = cursor
+            at_base, at_delta = bounds(ordinal, base_start, delta_start)
+            # Within a day the base postings come first
+            same_day = bisect_right(base_dates, ordinal, base_start, base_end) - at_base
+            if skip <= same_day:
+                i, j = max(i, at_base + skip), max(j, at_delta)
+            else:
+                i, j = max(i, at_base + same_day), max(j, at_delta + skip - same_day)
+
+        def base_next() -> bool:
+            return j >= delta_stop or (i < base_stop and base_dates[i] <= delta_dates[j])
+
+        # Balances per commodity id of the appended postings before the page
+        delta_balances = dict(zip(delta.commodity_ids[delta_start:j], delta.running[delta_start:j]))
+        base_balances: Dict[int, int] = {}
+        rows: List[RegisterRow] = []
+        while len(rows) < limit and (i < base_stop or j < delta_stop):
+            if base_next():
+                commodity_id = base.commodity_ids[i]
+                base_balances[commodity_id] = base.running[i]
+                rows.append(base._row(i, base.running[i] + delta_balances.get(commodity_id, 0)))
+                i += 1
+            else:
+                commodity_id = delta.commodity_ids[j]
+                delta_balances[commodity_id] = delta.running[j]
+                if commodity_id not in base_balances:
+                    base_balances[commodity_id] = base.balance_before(account, i, commodity_id)
+                rows.append(delta._row(j, base_balances[commodity_id] + delta.running[j]))
+                j += 1
+
+        next_cursor = None
+        if i < base_stop or j < delta_stop:
+            ordinal = base_dates[i] if base_next() else delta_dates[j]
+            at_base, at_delta = bounds(ordinal, base_start, delta_start)
+            next_cursor = (ordinal, i - at_base + j - at_delta)
+        return rows, next_cursor
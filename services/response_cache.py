@@ -0,0 +1,69 @@
+# ============================================================================
+# services/response_cache.py - LRU cache of serialized API responses
+# ============================================================================
+
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Tuple
+
+
+class ResponseCache:
+    """
+    LRU cache of serialized responses keyed on (endpoint, params, journal
+    generation), bounded both in entries and in total bytes.
+
+    Entries of an older generation can never be served again, so the whole
+    cache is dropped as soon as a lookup sees a new generation. Meant to be
+    used from the event loop only; it does no locking.
+    """
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[Tuple[str, Hashable], bytes]" = OrderedDict()
+        self._bytes = 0
+        self._generation: Optional[str] = None
+
+    def _invalidate(self, generation: str):
+        if generation != self._generation:
+            self._entries.clear()
+            self._bytes = 0
+            self._generation = generation
+
+    def get(self, endpoint: str, params: Hashable, generation: str) -> Optional[bytes]:
+        self._invalidate(generation)
+        key = (endpoint, params)
+        body = self._entries.get(key)
+        if body is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return body
+
+    def put(self, endpoint: str, params: Hashable, generation: str, body: bytes):
+        # A result computed from another generation than the current one is
+        # either stale or newer than what lookups ask for; keep neither.
+        if generation != self._generation or len(body) > self.max_bytes:
+            return
+        key = (endpoint, params)
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= len(previous)
+        self._entries[key] = body
+        self._bytes += len(body)
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+        }
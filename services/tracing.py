@@ -0,0 +1,62 @@
+# ============================================================================
+# services/tracing.py - Logging setup and per-request trace ids
+# ============================================================================
+
+from contextvars import ContextVar
+from typing import Optional
+import logging
+import uuid
+
+TRACE_HEADER = "X-Request-ID"
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] %(message)s"
+
+trace_id_var: ContextVar[Optional[str]] = ContextVar("trace_id", default=None)
+
+
+class TraceIdFilter(logging.Filter):
+    """Expose the current request's trace id to formatters as %(trace_id)s"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = trace_id_var.get() or "-"
+        return True
+
+
+def configure_logging(level: str = "INFO"):
+    """Configure root logging with the trace id in every line"""
+    logging.basicConfig(level=level.upper(), format=LOG_FORMAT)
+    for handler in logging.getLogger().handlers:
+        if not any(isinstance(f, TraceIdFilter) for f in handler.filters):
+            handler.addFilter(TraceIdFilter())
+
+
+class TraceMiddleware:
+    """
+    ASGI middleware giving every HTTP request a trace id: the incoming
+    X-Request-ID header if any, a new random id otherwise. The id is set
+    for log records produced while handling the request and echoed back in
+    the response headers.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        header = TRACE_HEADER.lower().encode()
+        trace_id = next((v.decode("latin-1") for k, v in scope["headers"] if k == header), None)
+        trace_id = trace_id or uuid.uuid4().hex
+        token = trace_id_var.set(trace_id)
+
+        async def send_with_trace_id(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(header, trace_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_trace_id)
+        finally:
+            trace_id_var.reset(token)
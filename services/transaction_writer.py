@@ -0,0 +1,65 @@
+# ============================================================================
+# services/transaction_writer.py - Group commit of journal writes
+# ============================================================================
+
+from fastapi import HTTPException
+from typing import List, Optional, Tuple
+import asyncio
+import logging
+
+from models import LedgerTransactionInput
+from services.ledger_executor import LedgerExecutor
+
+logger = logging.getLogger(__name__)
+
+# Request groups written together by one ledger call at most
+MAX_BATCH_GROUPS = 256
+
+
+class TransactionWriter:
+    """
+    Group commit for writes to one journal. Each write is a group of
+    transactions that is written entirely or not at all. Writes arriving
+    while a batch is being written wait and go out together as the next
+    batch: one ledger call, one append and fsync, and one update of the
+    indexes for all of them. Each group is validated on its own, so an
+    invalid one only fails its own request.
+
+    Must be used from the event loop.
+    """
+
+    def __init__(self, executor: LedgerExecutor):
+        self.executor = executor
+        self._queue: List[Tuple[Tuple[LedgerTransactionInput, ...], asyncio.Future]] = []
+        self._flushing: Optional[asyncio.Task] = None
+
+    async def write(self, transactions: Tuple[LedgerTransactionInput, ...]) -> str:
+        """Write a group of transactions; returns the generation that includes them"""
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append((transactions, future))
+        if self._flushing is None or self._flushing.done():
+            self._flushing = asyncio.ensure_future(self._flush())
+        # A client going away must not cancel a write the batch may already hold
+        return await asyncio.shield(future)
+
+    async def _flush(self):
+        while self._queue:
+            batch = self._queue[:MAX_BATCH_GROUPS]
+            del self._queue[:MAX_BATCH_GROUPS]
+            try:
+                generation, errors = await self.executor.call(
+                    "write_transactions", tuple(group for group, _ in batch))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            rejected = sum(error is not None for error in errors)
+            if rejected < len(batch):
+                logger.info("Wrote %d transaction groups in one batch", len(batch) - rejected)
+            if rejected:
+                logger.debug("Rejected %d transaction groups of a batch", rejected)
+            for (_, future), error in zip(batch, errors):
+                if error is not None:
+                    future.set_exception(HTTPException(status_code=400, detail=error))
+                else:
+                    future.set_result(generation)
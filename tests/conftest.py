@@ -0,0 +1,57 @@
+import datetime
+import json
+
+import pytest
+
+JOURNAL = """\
+~ Monthly
+    Despesas:Mercado  BRL 500.00
+    Ativos:Banco
+
+2024/01/05 * Salario
+    Ativos:Banco  BRL 5000.00
+    Receitas:Salario
+
+2024/01/10 Mercado
+    Despesas:Mercado  BRL 123.45
+    Ativos:Banco
+
+2024/02/01 * Viagem
+    Despesas:Viagem  USD 100 @ BRL 5.10
+    Ativos:Banco
+
+2024/02/15 * Mercado
+    Despesas:Mercado  BRL 88.10
+    Ativos:Banco
+"""
+
+
+def _dumped(response) -> dict:
+    data = json.loads(response.model_dump_json(by_alias=True))
+    data.pop('timestamp', None)
+    return data
+
+
+def _service_answers(service) -> dict:
+    """What a LedgerService answers to a few queries that cover every index, without timestamps"""
+    answers = {
+        'balance': _dumped(service.get_balance(None, None)),
+        'cash_flow': _dumped(service.get_cash_flow('monthly', None, None)),
+        'budget': _dumped(service.get_budget_report(datetime.date(2024, 1, 1), datetime.date(2024, 3, 1))),
+    }
+    state = service._get_state()
+    for account in filter(state.register.knows, state.balance_table.accounts):
+        answers[account] = _dumped(service.get_account_transactions(account, None, None, None, 1000))
+    return answers
+
+
+@pytest.fixture
+def journal_path(tmp_path):
+    path = tmp_path / 'main.ledger'
+    path.write_text(JOURNAL)
+    return str(path)
+
+
+@pytest.fixture
+def answers():
+    return _service_answers
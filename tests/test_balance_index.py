@@ -0,0 +1,101 @@
+import datetime
+import random
+from decimal import Decimal
+
+import pytest
+
+from services.balance_index import BalanceIndex, _merged_series, format_scaled
+
+
+def empty_index() -> BalanceIndex:
+    return BalanceIndex({'': []}, {}, {}, [], [], [])
+
+
+def random_postings(rng: random.Random, count: int):
+    """(account, date ordinal, commodity, amount, cleared) postings over a few months"""
+    start = datetime.date(2024, 1, 1).toordinal()
+    return [(rng.choice(['Ativos:Banco', 'Despesas:Mercado', 'Despesas']),
+             start + rng.randrange(90),
+             rng.choice(['BRL', 'USD']),
+             Decimal(rng.randrange(-10000, 10000)).scaleb(-2),
+             rng.random() < 0.5)
+            for _ in range(count)]
+
+
+def expected_window(postings, account, lower, upper):
+    result = {}
+    for posting_account, ordinal, commodity, value, is_cleared in postings:
+        if posting_account != account:
+            continue
+        if lower and ordinal < lower.toordinal() or upper and ordinal >= upper.toordinal():
+            continue
+        total, cleared = result.get(commodity, (Decimal(0), Decimal(0)))
+        result[commodity] = (total + value, cleared + (value if is_cleared else 0))
+    return result
+
+
+def test_merged_series_inserts_after_same_day():
+    dates, totals, cleared = _merged_series([1, 2, 2, 4], [10, 30, 60, 100], [10, 10, 40, 40],
+                                            [(2, 5, True), (0, 1, False), (5, 7, False)])
+    assert dates == [0, 1, 2, 2, 2, 4, 5]
+    assert totals == [1, 11, 31, 61, 66, 106, 113]
+    assert cleared == [0, 10, 10, 40, 45, 45, 45]
+
+
+def test_merged_series_keeps_prefix_before_first_addition():
+    dates, totals, cleared = _merged_series([1, 2, 3], [1, 3, 6], [0, 0, 0], [(3, 4, False)])
+    assert dates == [1, 2, 3, 3]
+    assert totals == [1, 3, 6, 10]
+    assert cleared == [0, 0, 0, 0]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_with_postings_in_batches_matches_all_at_once(seed):
+    rng = random.Random(seed)
+    postings = random_postings(rng, 300)
+    whole = empty_index().with_postings(postings)
+    index = empty_index()
+    for i in range(0, len(postings), 37):
+        index = index.with_postings(postings[i:i + 37])
+
+    assert index.series.keys() == whole.series.keys()
+    assert index.children == whole.children
+    for lower, upper in [(None, None), (datetime.date(2024, 2, 1), datetime.date(2024, 3, 1)),
+                         (datetime.date(2024, 1, 15), None), (None, datetime.date(2024, 1, 15))]:
+        for account in ('Ativos:Banco', 'Despesas:Mercado', 'Despesas'):
+            expected = expected_window(postings, account, lower, upper)
+            assert index.window(account, lower, upper) == expected
+            assert whole.window(account, lower, upper) == expected
+
+
+def test_with_postings_adds_parent_accounts():
+    index = empty_index().with_postings([('Despesas:Casa:Luz', 738000, 'BRL', Decimal('1.50'), False)])
+    assert index.children[''] == ['Despesas']
+    assert index.children['Despesas'] == ['Despesas:Casa']
+    assert index.children['Despesas:Casa'] == ['Despesas:Casa:Luz']
+
+
+def test_with_postings_rejects_finer_scale():
+    index = empty_index().with_postings([('Ativos', 738000, 'BRL', Decimal('1.50'), False)])
+    with pytest.raises(ValueError):
+        index.with_postings([('Ativos', 738001, 'BRL', Decimal('0.001'), False)])
+
+
+@pytest.mark.parametrize('value, scale, text', [
+    (0, 2, '0'),
+    (0, 0, '0'),
+    (1234, 0, '1234'),
+    (-1234, 0, '-1234'),
+    (123456, 2, '1234.56'),
+    (-5, 2, '-0.05'),
+    (5, 3, '0.005'),
+    (-100, 2, '-1.00'),
+    (10 ** 30 + 1, 8, '10000000000000000000000.00000001'),
+])
+def test_format_scaled(value, scale, text):
+    assert format_scaled(value, scale) == text
+
+
+@pytest.mark.parametrize('value, scale', [(123456, 2), (-5, 2), (7, 4), (-100, 2), (10 ** 20, 3)])
+def test_format_scaled_matches_decimal(value, scale):
+    assert format_scaled(value, scale) == format(Decimal(value).scaleb(-scale), 'f')
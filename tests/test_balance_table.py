@@ -0,0 +1,54 @@
+import datetime
+import random
+from decimal import Decimal
+
+import pytest
+
+from services import balance_table
+from services.balance_index import BalanceIndex
+from services.balance_table import BalanceTable
+
+ACCOUNTS = ['Ativos:Banco', 'Ativos:Banco:Poupanca', 'Despesas:Mercado', 'Despesas:Casa:Luz']
+
+
+@pytest.fixture
+def table() -> BalanceTable:
+    rng = random.Random(3)
+    start = datetime.date(2024, 1, 1).toordinal()
+    postings = [(rng.choice(ACCOUNTS), start + rng.randrange(365), rng.choice(['BRL', 'USD']),
+                 Decimal(rng.randrange(-10000, 10000)).scaleb(-2), rng.random() < 0.5)
+                for _ in range(500)]
+    return BalanceTable.from_index(BalanceIndex({'': []}, {}, {}, [], [], []).with_postings(postings))
+
+
+def monthly(year: int):
+    return [(datetime.date(year, month, 1), datetime.date(year + month // 12, month % 12 + 1, 1))
+            for month in range(1, 13)]
+
+
+def columns(window):
+    return [window.amounts.tolist(), window.cleared.tolist(),
+            window.amount_shown.tolist(), window.cleared_shown.tolist()]
+
+
+def test_windows_in_chunks_match_single_chunk(table, monkeypatch):
+    bounds = monthly(2024) + [(None, None), (None, datetime.date(2024, 6, 1))]
+    whole = [columns(window) for window in table.windows(bounds)]
+    # Room for two windows per chunk
+    monkeypatch.setattr(balance_table, 'MAX_WINDOW_CELLS', 2 * len(table.accounts) * len(table.commodities))
+    assert [columns(window) for window in table.windows(bounds)] == whole
+
+
+def test_window_rolls_up_subtrees(table):
+    window = table.window(None, None)
+    for commodity in ('BRL', 'USD'):
+        assert window.subtree_total('Ativos', commodity) == (
+            window.subtree_total('Ativos:Banco', commodity))
+        assert window.subtree_total('', commodity) == (
+            window.subtree_total('Ativos', commodity) + window.subtree_total('Despesas', commodity))
+
+
+def test_months_add_up_to_the_year(table):
+    year = table.window(datetime.date(2024, 1, 1), datetime.date(2025, 1, 1))
+    months = list(table.windows(monthly(2024)))
+    assert sum(window.amounts for window in months).tolist() == year.amounts.tolist()
@@ -0,0 +1,80 @@
+import datetime
+from decimal import Decimal
+
+import pytest
+
+from services.budget_index import BudgetIndex, parse_period
+
+
+def ordinal(*args) -> int:
+    return datetime.date(*args).toordinal()
+
+
+@pytest.mark.parametrize('period, expected', [
+    ('Monthly', ('month', 1, None, None)),
+    ('  weekly ', ('week', 1, None, None)),
+    ('Quarterly', ('month', 3, None, None)),
+    ('every 2 weeks', ('week', 2, None, None)),
+    ('every quarter', ('month', 3, None, None)),
+    ('Every 3 Months', ('month', 3, None, None)),
+    ('monthly from 2024/01/15', ('month', 1, ordinal(2024, 1, 15), None)),
+    ('monthly since 2024/01', ('month', 1, ordinal(2024, 1, 1), None)),
+    ('yearly since 2023', ('year', 1, ordinal(2023, 1, 1), None)),
+    ('monthly until 2024-03', ('month', 1, None, ordinal(2024, 3, 1))),
+    ('monthly from 2024/01/01 to 2024/06/01', ('month', 1, ordinal(2024, 1, 1), ordinal(2024, 6, 1))),
+    ('every month in 2024', ('month', 1, ordinal(2024, 1, 1), ordinal(2025, 1, 1))),
+    ('weekly in 2024/02', ('week', 1, ordinal(2024, 2, 1), ordinal(2024, 3, 1))),
+])
+def test_parse_period(period, expected):
+    assert parse_period(period) == expected
+
+
+@pytest.mark.parametrize('period', [
+    '',
+    'sometimes',
+    'every',
+    'every 2',
+    'every fortnight',
+    'monthly this year',
+    'monthly from',
+    'monthly from yesterday',
+    'monthly since 2024/13',
+    'monthly between 2024/01/01 and 2024/02/01',
+])
+def test_parse_period_rejects_unsupported(period):
+    assert parse_period(period) is None
+
+
+def budget(period: str, amount: str = '300') -> BudgetIndex:
+    return BudgetIndex([('Despesas:Mercado', 'BRL', Decimal(amount)) + parse_period(period)])
+
+
+def window(index: BudgetIndex, lower: datetime.date, upper: datetime.date) -> Decimal:
+    return index.window(lower, upper).get(('Despesas:Mercado', 'BRL'))
+
+
+def test_window_counts_period_starts():
+    index = budget('monthly')
+    assert window(index, datetime.date(2024, 1, 1), datetime.date(2024, 2, 1)) == 300
+    assert window(index, datetime.date(2024, 1, 1), datetime.date(2024, 4, 1)) == 900
+    assert window(index, datetime.date(2024, 1, 15), datetime.date(2024, 2, 15)) == 300
+
+
+def test_window_within_one_period_is_pro_rata():
+    index = budget('monthly', '310')
+    assert window(index, datetime.date(2024, 1, 10), datetime.date(2024, 1, 20)) == 100
+    assert window(budget('weekly', '70'), datetime.date(2024, 1, 2), datetime.date(2024, 1, 4)) == 20
+
+
+def test_window_of_multi_unit_periods():
+    index = budget('quarterly', '900')
+    assert window(index, datetime.date(2024, 1, 1), datetime.date(2024, 4, 1)) == 900
+    assert window(index, datetime.date(2024, 1, 1), datetime.date(2024, 2, 1)) == 300
+
+
+def test_window_respects_bounds():
+    index = budget('every month in 2024')
+    assert window(index, datetime.date(2023, 12, 1), datetime.date(2024, 1, 1)) is None
+    assert window(index, datetime.date(2024, 12, 1), datetime.date(2025, 3, 1)) == 300
+    assert window(index, datetime.date(2025, 1, 1), datetime.date(2025, 2, 1)) is None
+    assert window(budget('monthly since 2024/01'), datetime.date(2024, 1, 1), datetime.date(2024, 3, 1)) == 600
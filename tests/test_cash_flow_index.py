@@ -0,0 +1,140 @@
+import datetime
+import random
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+from services.cash_flow_index import (
+    PERIODS, CashFlowIndex, int_column, next_period_start, period_starts, period_windows)
+from services.register_index import RegisterIndex
+
+D = datetime.date
+ACCOUNTS = ['Ativos:Banco', 'Ativos:Banco:Poupanca', 'Ativos:Bancos', 'Despesas:Mercado']
+
+
+def empty_register() -> RegisterIndex:
+    return RegisterIndex({}, [], [], {}, [], [], [], [], [], [])
+
+
+def random_postings(rng: random.Random, count: int):
+    """(account, date ordinal, payee, commodity, amount, cleared) postings around a year end"""
+    start = D(2023, 11, 1).toordinal()
+    return [(rng.choice(ACCOUNTS),
+             start + rng.randrange(120),
+             'payee',
+             rng.choice(['BRL', 'USD']),
+             Decimal(rng.randrange(-10000, 10000)).scaleb(-rng.choice([0, 2])),
+             rng.random() < 0.5)
+            for _ in range(count)]
+
+
+def start_of(ordinal: int, period: str) -> int:
+    day = D.fromordinal(ordinal)
+    if period == 'weekly':
+        day -= datetime.timedelta(days=day.weekday())
+    elif period == 'monthly':
+        day = day.replace(day=1)
+    elif period == 'yearly':
+        day = day.replace(month=1, day=1)
+    return day.toordinal()
+
+
+def expected_flows(postings, period, lower, upper, account=None):
+    """flows computed posting by posting"""
+    opening = {}
+    flows = {}
+    for posting_account, ordinal, _, commodity, value, _ in postings:
+        if account and posting_account != account and not posting_account.startswith(account + ':'):
+            continue
+        if lower and ordinal < lower.toordinal():
+            opening[posting_account, commodity] = opening.get((posting_account, commodity), 0) + value
+            continue
+        if upper and ordinal >= upper.toordinal():
+            continue
+        inflow, outflow = flows.get((posting_account, commodity, start_of(ordinal, period)), (0, 0))
+        flows[posting_account, commodity, start_of(ordinal, period)] = (
+            inflow + max(value, 0), outflow + min(value, 0))
+    rows = []
+    balance = {}
+    for (posting_account, commodity, start), (inflow, outflow) in sorted(flows.items()):
+        key = (posting_account, commodity)
+        balance[key] = balance.get(key, opening.get(key, 0)) + inflow + outflow
+        rows.append((start, posting_account, commodity, inflow, outflow, balance[key]))
+    return rows
+
+
+@pytest.mark.parametrize('period', PERIODS)
+def test_flows_match_postings(period):
+    rng = random.Random(13)
+    postings = random_postings(rng, 400)
+    index = CashFlowIndex.from_register(empty_register().with_postings(postings))
+    for lower, upper in [(None, None), (D(2023, 12, 20), D(2024, 1, 10)), (D(2024, 1, 1), None),
+                         (None, D(2023, 12, 31)), (D(2024, 5, 1), None)]:
+        for account in (None, 'Ativos:Banco', 'Ativos', 'Despesas:Mercado', 'Passivos'):
+            assert index.flows(period, lower, upper, account) == expected_flows(
+                postings, period, lower, upper, account), (lower, upper, account)
+
+
+def test_flows_of_appended_register_match_a_full_build():
+    rng = random.Random(5)
+    postings = random_postings(rng, 300)
+    postings.append(('Receitas:Nova', D(2023, 12, 1).toordinal(), 'payee', 'EUR', Decimal('7.5'), False))
+    base = empty_register().with_postings(postings[:200])
+    layered = CashFlowIndex.from_register(base).with_register(base.delta().with_postings(postings[200:]))
+    full = CashFlowIndex.from_register(empty_register().with_postings(postings))
+    for period in PERIODS:
+        for lower, upper in [(None, None), (D(2023, 12, 20), D(2024, 1, 10))]:
+            assert layered.flows(period, lower, upper) == full.flows(period, lower, upper)
+
+
+def test_flows_with_amounts_beyond_64_bits():
+    amounts = int_column([2 ** 70, -1, 2 ** 70])
+    assert amounts.dtype == object
+    dates = np.array([D(2024, 1, 5).toordinal(), D(2024, 1, 6).toordinal(), D(2024, 2, 1).toordinal()])
+    index = CashFlowIndex(['Ativos:Cripto'], ['SAT'], {'SAT': 0},
+                          [(dates, np.zeros(3, np.int32), np.zeros(3, np.int32), amounts)])
+    assert index.flows('monthly', None, None) == [
+        (D(2024, 1, 1).toordinal(), 'Ativos:Cripto', 'SAT', Decimal(2 ** 70), Decimal(-1), Decimal(2 ** 70 - 1)),
+        (D(2024, 2, 1).toordinal(), 'Ativos:Cripto', 'SAT', Decimal(2 ** 70), Decimal(0), Decimal(2 ** 71 - 1)),
+    ]
+    assert int_column([1, -2]).dtype == np.int64
+
+
+def test_period_starts():
+    days = [D(1969, 12, 31), D(2023, 12, 31), D(2024, 1, 1), D(2024, 2, 29), D(2024, 12, 31)]
+    ordinals = np.array([day.toordinal() for day in days], dtype=np.int64)
+    expected = {
+        'daily': days,
+        # 2024-01-01 is a Monday
+        'weekly': [D(1969, 12, 29), D(2023, 12, 25), D(2024, 1, 1), D(2024, 2, 26), D(2024, 12, 30)],
+        'monthly': [D(1969, 12, 1), D(2023, 12, 1), D(2024, 1, 1), D(2024, 2, 1), D(2024, 12, 1)],
+        'yearly': [D(1969, 1, 1), D(2023, 1, 1), D(2024, 1, 1), D(2024, 1, 1), D(2024, 1, 1)],
+    }
+    for period, starts in expected.items():
+        assert period_starts(ordinals, period).tolist() == [day.toordinal() for day in starts], period
+
+
+@pytest.mark.parametrize('period', PERIODS)
+def test_next_period_start_follows_period_starts(period):
+    for ordinal in range(D(2023, 12, 1).toordinal(), D(2025, 3, 1).toordinal()):
+        following = next_period_start(D.fromordinal(ordinal), period).toordinal()
+        starts = period_starts(np.array([ordinal, following - 1, following]), period).tolist()
+        assert starts == [starts[0], starts[0], following]
+
+
+def test_period_windows():
+    assert period_windows('monthly', D(2024, 11, 15), D(2025, 2, 10), 10) == [
+        (D(2024, 11, 15), D(2024, 12, 1)),
+        (D(2024, 12, 1), D(2025, 1, 1)),
+        (D(2025, 1, 1), D(2025, 2, 1)),
+        (D(2025, 2, 1), D(2025, 2, 10)),
+    ]
+    assert period_windows('weekly', D(2024, 1, 3), D(2024, 1, 15), 10) == [
+        (D(2024, 1, 3), D(2024, 1, 8)),
+        (D(2024, 1, 8), D(2024, 1, 15)),
+    ]
+    assert period_windows('yearly', D(2024, 1, 1), D(2024, 1, 2), 10) == [(D(2024, 1, 1), D(2024, 1, 2))]
+    assert period_windows('daily', D(2024, 1, 2), D(2024, 1, 2), 10) == []
+    # One period past the limit, so callers can tell there are more
+    assert len(period_windows('daily', D(2024, 1, 1), D(2025, 1, 1), 3)) == 4
@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from services.journal_registry import JournalRegistry, estimated_bytes, parse_journals
+from services.response_cache import ResponseCache
+
+
+def test_parse_journals():
+    assert parse_journals('') == {}
+    assert parse_journals(' casa = /data/casa.ledger, empresa=/data/empresa.ledger ,') == {
+        'casa': '/data/casa.ledger',
+        'empresa': '/data/empresa.ledger',
+    }
+
+
+@pytest.mark.parametrize('text', ['casa', 'casa=', '=/data/casa.ledger', 'ca sa=/x', 'casa/x=/x',
+                                  'casa=/a,casa=/b'])
+def test_parse_journals_rejects_invalid(text):
+    with pytest.raises(ValueError):
+        parse_journals(text)
+
+
+def test_estimated_bytes(tmp_path):
+    journal = tmp_path / 'main.ledger'
+    journal.write_text('include extra.ledger\n')
+    (tmp_path / 'extra.ledger').write_text('x' * 79 + '\n')
+    size = len('include extra.ledger\n') + 80
+    assert estimated_bytes(str(journal), 2.5) == int(size * 2.5)
+    assert estimated_bytes(str(tmp_path / 'missing.ledger')) == 0
+
+
+class StubExecutor:
+    pending = 0
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_sweep_evicts_idle_journals(tmp_path):
+    paths = {}
+    for name in ('default', 'casa', 'empresa'):
+        path = tmp_path / f'{name}.ledger'
+        path.write_text('x' * 100)
+        paths[name] = str(path)
+    executors = {}
+
+    def create_executor(name, path):
+        executors[name] = StubExecutor()
+        return executors[name]
+
+    async def scenario():
+        registry = JournalRegistry(paths, create_executor, ResponseCache, max_bytes=250,
+                                   idle_seconds=0.05, memory_per_text_byte=1, sweep_seconds=0.02)
+        registry.start()
+        await registry.get('casa')
+        # Under budget until empresa loads; casa was just used, so it stays
+        await registry.get('empresa')
+        assert [journal.name for journal in registry.loaded()] == ['default', 'casa', 'empresa']
+        await asyncio.sleep(0.2)
+        names = [journal.name for journal in registry.loaded()]
+        registry.close()
+        return names
+
+    assert asyncio.run(scenario()) == ['default', 'empresa']
+    assert executors['casa'].closed and executors['default'].closed
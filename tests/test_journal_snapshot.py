@@ -0,0 +1,73 @@
+from decimal import Decimal
+
+import pytest
+
+from services.balance_index import BalanceIndex
+from services.balance_table import BalanceTable, series_keys
+from services.budget_index import BudgetIndex
+from services.cash_flow_index import CashFlowIndex
+from services.journal_snapshot import SnapshotError, read_snapshot, write_snapshot
+from services.price_index import PriceIndex
+from services.register_index import RegisterIndex
+
+POSTINGS = [
+    ('Ativos:Banco', 738000, 'Salario', 'BRL', Decimal('5000.00'), True),
+    ('Despesas:Mercado', 738002, 'Mercado', 'BRL', Decimal('123.45'), False),
+    ('Despesas:Mercado', 738002, 'Mercado', 'USD', Decimal('-7'), False),
+    ('Ativos:Banco', 738010, 'Mercado', 'BRL', Decimal('-123.45'), True),
+]
+
+
+@pytest.fixture
+def indexes():
+    balance_index = BalanceIndex({'': []}, {}, {}, [], [], []).with_postings(
+        [(account, ordinal, commodity, value, is_cleared)
+         for account, ordinal, _, commodity, value, is_cleared in POSTINGS])
+    register_index = RegisterIndex({}, [], [], {}, [], [], [], [], [], []).with_postings(POSTINGS)
+    return balance_index, register_index
+
+
+def test_round_trip(tmp_path, indexes):
+    balance_index, register_index = indexes
+    price_index = PriceIndex({'USD': {'BRL': ([738000, 738005], [Decimal('5.10'), Decimal('5.02')])}}, {})
+    budget_index = BudgetIndex([('Despesas:Mercado', 'BRL', Decimal('800'), 'month', 1, 738000, None)])
+    path = str(tmp_path / 'journal.snapshot')
+    write_snapshot(path, balance_index, price_index, register_index, budget_index,
+                   ['/journal/main.ledger'], 'generation', 12.5, 'hash')
+
+    metadata, read_balance, read_register = read_snapshot(path)
+    assert metadata['generation'] == 'generation'
+    assert metadata['sources'] == ['/journal/main.ledger']
+    assert metadata['modified_at'] == 12.5
+    assert metadata['content_hash'] == 'hash'
+    assert BudgetIndex.from_dict(metadata['budget_index']).budgets == budget_index.budgets
+    assert PriceIndex.from_dict(metadata['price_index']).to_dict() == price_index.to_dict()
+
+    assert read_balance.children == balance_index.children
+    assert read_balance.series == balance_index.series
+    assert list(read_balance.totals) == list(balance_index.totals)
+    for account in ('Ativos:Banco', 'Despesas:Mercado'):
+        assert read_balance.window(account, None, None) == balance_index.window(account, None, None)
+        assert read_register.page(account, None, None, None, 10) == register_index.page(account, None, None, None, 10)
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / 'journal.snapshot'
+    path.write_bytes(b'not a snapshot at all')
+    with pytest.raises(SnapshotError):
+        read_snapshot(str(path))
+
+
+def test_tables_use_the_mapped_columns(tmp_path, indexes):
+    balance_index, register_index = indexes
+    path = str(tmp_path / 'journal.snapshot')
+    write_snapshot(path, balance_index, PriceIndex({}, {}), register_index, BudgetIndex([]),
+                   ['/journal/main.ledger'], 'generation', 12.5)
+    _, read_balance, read_register = read_snapshot(path)
+
+    groups = BalanceTable.from_index(read_balance).groups[0]
+    assert groups.keys.tolist() == series_keys(balance_index).tolist()
+    dates, _, commodity_ids, amounts = CashFlowIndex.from_register(read_register).segments[0]
+    # Views of the mapping, not copies made by each process
+    for column in (groups.keys, groups.totals, groups.cleared, dates, commodity_ids, amounts):
+        assert not column.flags.owndata
@@ -0,0 +1,143 @@
+import os
+
+import pytest
+
+from services.journal_tail import ParsePosition, appended_text
+from services.journal_watcher import journal_fingerprint
+
+PLAIN_TAIL = """
+; Appended by hand
+P 2024/02/20 USD BRL 5.05
+
+2024/02/20 * Mercado
+    Despesas:Mercado  BRL 40.00
+    Ativos:Banco
+"""
+
+
+def write(path, text):
+    """Write text to path, moving its modification time on so watchers see a change"""
+    stat = os.stat(path) if os.path.exists(path) else None
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    if stat is not None:
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def position_of(path, *includes) -> ParsePosition:
+    with open(path, 'rb') as f:
+        return ParsePosition.of_file([path, *includes], f.read(), 4)
+
+
+@pytest.mark.parametrize('tail, applies', [
+    (PLAIN_TAIL, True),
+    ('\n2024/02/20 Mercado\n\tDespesas:Mercado  BRL 1\n\tAtivos:Banco\n# comment\n| comment\n', True),
+    ('\naccount Despesas:Nova\n', False),
+    ('\nalias Mercado=Despesas:Mercado\n', False),
+    ('\napply account Pessoal\n', False),
+    ('\ninclude other.ledger\n', False),
+    ('\nY 2023\n', False),
+    ('\n= /Mercado/\n    (Orcamento:Mercado)  -1\n', False),
+    ('\n~ Monthly\n    Despesas:Mercado  BRL 10\n    Ativos:Banco\n', False),
+    ('\n2024/02/20 Mercado\n    Despesas:Mercado  BRL 1\n    Ativos:Banco', False),
+])
+def test_appended_text_accepts_only_plain_transactions(journal_path, tail, applies):
+    path = journal_path
+    journal = open(path, encoding='utf-8').read()
+    position = position_of(path)
+    write(path, journal + tail)
+    appended = appended_text(position, [path])
+    assert (appended == (tail.encode(), tail)) if applies else appended is None
+
+
+def test_appended_text_rejects_other_changes(tmp_path, journal_path):
+    path = journal_path
+    journal = open(path, encoding='utf-8').read()
+    include = str(tmp_path / 'extra.ledger')
+    write(include, '')
+    position = position_of(path, include)
+
+    # No change, or a truncated root file
+    assert appended_text(position, [path, include]) is None
+    write(path, journal[:-10])
+    assert appended_text(position, [path, include]) is None
+    # Earlier text rewritten, at the same size and with text appended
+    write(path, journal.replace('123.45', '321.45') + PLAIN_TAIL)
+    assert appended_text(position, [path, include]) is None
+    # A change in an include, or in the set of included files
+    write(path, journal + PLAIN_TAIL)
+    assert appended_text(position, [path, include]) is not None
+    write(include, 'P 2024/01/01 USD BRL 4.00\n')
+    assert appended_text(position, [path, include]) is None
+    assert appended_text(position_of(path, include), [path]) is None
+
+
+@pytest.fixture
+def ledger_service():
+    return pytest.importorskip('services.ledger_service')
+
+
+def reload_after(ledger_service, path, service, answers, *changes):
+    """
+    Reload service after each change and check it then answers as a full
+    parse does; whether each reload applied an append. The full parse comes
+    last, as a service reparses anyway once another one used the session.
+    """
+    applied = []
+    for change in changes:
+        change()
+        service.reload()
+        applied.append(bool(service._get_state().appended[1]))
+    assert service.generation == journal_fingerprint(ledger_service.find_journal_sources(path))
+    reparsed = ledger_service.LedgerService(path, watch='off', incremental=False)
+    try:
+        assert answers(service) == answers(reparsed)
+    finally:
+        reparsed.close()
+    return applied
+
+
+def append(path, text):
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(text)
+
+
+EXTRA = """
+2024/02/21 Extra
+    Despesas:Mercado  BRL 9.00
+    Ativos:Banco
+"""
+
+
+@pytest.mark.parametrize('change, incremental', [
+    # Plain transactions and prices appended
+    (lambda path, include, journal: append(path, PLAIN_TAIL), True),
+    # Truncated: the last transaction removed
+    (lambda path, include, journal: write(path, journal[:journal.rindex('\n2024/')]), False),
+    # An earlier amount rewritten, with text appended after it
+    (lambda path, include, journal: write(path, journal.replace('123.45', '321.45') + PLAIN_TAIL), False),
+    # An included file changed along with an append
+    (lambda path, include, journal: (write(include, EXTRA), append(path, PLAIN_TAIL)), False),
+    # A directive, an automated and a periodic transaction appended
+    (lambda path, include, journal: append(path, '\naccount Despesas:Nova\n' + PLAIN_TAIL), False),
+    (lambda path, include, journal: append(path, '\n= /Mercado/\n    (Orcamento:Mercado)  -1\n' + PLAIN_TAIL),
+     False),
+    (lambda path, include, journal: append(path, '\n~ Monthly\n    Despesas:Viagem  BRL 100\n    Ativos:Banco\n'),
+     False),
+])
+def test_reload_matches_a_full_parse(tmp_path, journal_path, ledger_service, answers, change, incremental):
+    path = journal_path
+    include = str(tmp_path / 'extra.ledger')
+    write(include, '')
+    append(path, 'include extra.ledger\n')
+    journal = open(path, encoding='utf-8').read()
+    service = ledger_service.LedgerService(path, watch='off')
+    try:
+        # Appends after the change apply incrementally, whichever way it was applied
+        assert reload_after(ledger_service, path, service, answers,
+                            lambda: change(path, include, journal),
+                            lambda: append(path, PLAIN_TAIL.replace('2024/02/20', '2024/03/02')),
+                            lambda: append(path, PLAIN_TAIL.replace('2024/02/20', '2024/01/02'))
+                            ) == [incremental, True, True]
+    finally:
+        service.close()
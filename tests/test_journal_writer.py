@@ -0,0 +1,136 @@
+import datetime
+
+import pytest
+
+from models import LedgerTransactionInput
+from services.journal_writer import append_durably, format_transaction, transaction_error
+
+ACCOUNTS = {'Ativos:Banco', 'Despesas:Mercado', 'Receitas:Salario'}
+COMMODITIES = {'BRL', 'USD', 'CM00', 'Tesouro IPCA'}
+
+
+def transaction(*postings, description='Mercado', cleared=False) -> LedgerTransactionInput:
+    return LedgerTransactionInput(date=datetime.date(2024, 3, 9), description=description, cleared=cleared,
+                                  postings=[dict(zip(('account', 'amount', 'commodity'), p)) for p in postings])
+
+
+def error(t: LedgerTransactionInput):
+    return transaction_error(t, ACCOUNTS.__contains__, COMMODITIES.__contains__)
+
+
+def test_format_transaction():
+    assert format_transaction(transaction(
+        ('Despesas:Mercado', '12.5', 'BRL'), ('Ativos:Banco', None, None), cleared=True)) == (
+        '\n2024/03/09 * Mercado\n'
+        '    Despesas:Mercado  BRL 12.5\n'
+        '    Ativos:Banco\n')
+
+
+def test_format_transaction_quotes_commodities_and_expands_exponents():
+    text = format_transaction(transaction(
+        ('Ativos:Banco', '1E+3', 'CM00'), ('Ativos:Banco', '-1000', 'CM00'),
+        ('Despesas:Mercado', '2', 'Tesouro IPCA'), ('Ativos:Banco', '-2', 'Tesouro IPCA')))
+    assert text.splitlines()[1:] == [
+        '2024/03/09 Mercado',
+        '    Ativos:Banco  "CM00" 1000',
+        '    Ativos:Banco  "CM00" -1000',
+        '    Despesas:Mercado  "Tesouro IPCA" 2',
+        '    Ativos:Banco  "Tesouro IPCA" -2',
+    ]
+
+
+def test_valid_transactions():
+    assert error(transaction(('Despesas:Mercado', '12.50', 'BRL'), ('Ativos:Banco', '-12.5', 'BRL'))) is None
+    assert error(transaction(('Despesas:Mercado', '12.50', 'BRL'), ('Ativos:Banco', None, None))) is None
+    assert error(transaction(('Despesas:Mercado', '12.50', 'BRL'), ('Ativos:Banco', '-12.50', 'BRL'),
+                             ('Despesas:Mercado', '1', 'USD'), ('Ativos:Banco', '-1', 'USD'))) is None
+
+
+@pytest.mark.parametrize('t, message', [
+    (transaction(('Despesas:Mercado', '1', 'BRL'), ('Ativos:Banco', None, None), description=' '),
+     "A description is required, on a single line"),
+    (transaction(('Despesas:Mercado', '1', 'BRL'), ('Ativos:Banco', None, None), description='a\n2024/01/01 b'),
+     "A description is required, on a single line"),
+    (transaction(('Despesas:Outros', '1', 'BRL'), ('Ativos:Banco', None, None)),
+     "Unknown account Despesas:Outros"),
+    (transaction(('Despesas:Mercado  BRL 5', '1', 'BRL'), ('Ativos:Banco', None, None)),
+     "Unknown account Despesas:Mercado  BRL 5"),
+    (transaction(('Despesas:Mercado', '1', None), ('Ativos:Banco', None, None)),
+     "Amount of Despesas:Mercado has no commodity"),
+    (transaction(('Despesas:Mercado', '1', 'EUR'), ('Ativos:Banco', None, None)),
+     "Unknown commodity EUR"),
+    (transaction(('Despesas:Mercado', '1,5', 'BRL'), ('Ativos:Banco', None, None)),
+     "Invalid amount 1,5"),
+    (transaction(('Despesas:Mercado', 'NaN', 'BRL'), ('Ativos:Banco', None, None)),
+     "Invalid amount NaN"),
+    (transaction(('Despesas:Mercado', None, None), ('Ativos:Banco', None, None)),
+     "At most one posting may leave its amount out"),
+    (transaction(('Despesas:Mercado', '1', 'BRL'), ('Despesas:Mercado', '1', 'USD'), ('Ativos:Banco', None, None)),
+     "A posting without an amount needs the others in a single commodity"),
+    (transaction(('Despesas:Mercado', '1', 'BRL'), ('Ativos:Banco', '-0.99', 'BRL')),
+     "Transaction does not balance"),
+    (transaction(('Despesas:Mercado', '1', 'BRL'), ('Ativos:Banco', '-1', 'USD')),
+     "Transaction does not balance"),
+])
+def test_invalid_transactions(t, message):
+    assert error(t) == message
+
+
+def test_append_durably(tmp_path):
+    path = tmp_path / 'main.ledger'
+    path.write_bytes(b'2024/01/01 Abertura')
+    # A newline is added when the file does not end with one, before the offset returned
+    assert append_durably(str(path), b'\nfirst\n') == len(b'2024/01/01 Abertura\n')
+    assert append_durably(str(path), b'second\n') == len(b'2024/01/01 Abertura\n\nfirst\n')
+    assert path.read_bytes() == b'2024/01/01 Abertura\n\nfirst\nsecond\n'
+
+    empty = tmp_path / 'empty.ledger'
+    empty.write_bytes(b'')
+    assert append_durably(str(empty), b'text\n') == 0
+    assert empty.read_bytes() == b'text\n'
+
+
+@pytest.fixture
+def service(journal_path):
+    ledger_service = pytest.importorskip('services.ledger_service')
+    service = ledger_service.LedgerService(journal_path, watch='off')
+    yield service
+    service.close()
+
+
+def test_write_transactions_commits_valid_groups(service, journal_path, answers):
+    before = open(journal_path, encoding='utf-8').read()
+    groups = (
+        (transaction(('Despesas:Mercado', '10.00', 'BRL'), ('Ativos:Banco', None, None), description='Feira'),),
+        (transaction(('Despesas:Mercado', '10.00', 'BRL'), ('Ativos:Banco', '-9', 'BRL'), description='Errada'),),
+        (transaction(('Despesas:Viagem', '5', 'USD'), ('Ativos:Banco', '-5', 'USD'), description='Hotel'),
+         transaction(('Ativos:Banco', '1', 'BRL'), ('Receitas:Desconhecida', '-1', 'BRL'), description='Outra')),
+        (transaction(('Ativos:Banco', '3000', 'BRL'), ('Receitas:Salario', None, None), cleared=True,
+                     description='Bonus'),
+         transaction(('Despesas:Viagem', '2', 'USD'), ('Ativos:Banco', '-2', 'USD'), description='Taxi')),
+    )
+    generation, errors = service.write_transactions(groups)
+
+    assert errors == (None, "Transaction does not balance", "Transaction 1: Unknown account Receitas:Desconhecida",
+                      None)
+    written = open(journal_path, encoding='utf-8').read()
+    assert written == before + ''.join(format_transaction(t) for t in groups[0] + groups[3])
+    assert generation == service.generation
+    # Applied as appended postings, without a full parse
+    assert len(service._get_state().appended[1]) == 6
+
+    from services.ledger_service import LedgerService
+    reparsed = LedgerService(journal_path, watch='off', incremental=False)
+    try:
+        assert answers(service) == answers(reparsed)
+    finally:
+        reparsed.close()
+
+
+def test_write_transactions_rejecting_every_group(service, journal_path):
+    before = open(journal_path, encoding='utf-8').read()
+    generation = service.generation
+    assert service.write_transactions((
+        (transaction(('Despesas:Mercado', '1', 'BRL'), ('Ativos:Banco', '-2', 'BRL')),),
+    )) == (generation, ("Transaction does not balance",))
+    assert open(journal_path, encoding='utf-8').read() == before
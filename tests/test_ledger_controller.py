@@ -0,0 +1,181 @@
+import threading
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from controllers.ledger_controller import JOURNAL_HEADER, create_ledger_router
+from services.journal_registry import JournalRegistry
+from services.response_cache import ResponseCache
+
+
+class StubExecutor:
+    """Renders "<method> <args> @ <generation>"; the generation changes with reload"""
+
+    pending = 0
+
+    def __init__(self):
+        self.generation = 'g1'
+        self.modified_at = 1700000000.0
+        self.calls = []
+        # Called while a call runs, e.g. to reload meanwhile
+        self.during_run = None
+
+    def reload(self, generation, modified_at):
+        self.generation = generation
+        self.modified_at = modified_at
+
+    async def run(self, method, *args):
+        self.calls.append((method, args))
+        generation = self.generation
+        if self.during_run is not None:
+            self.during_run()
+        return generation, f'"{args[0]} {args[1:]} @ {generation}"'.encode()
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def app():
+    executors = {}
+    # Loading casa blocks until the test lets it through
+    release_casa = threading.Event()
+
+    def create_executor(name, path):
+        if name == 'casa':
+            release_casa.wait(5)
+        executors[name] = StubExecutor()
+        return executors[name]
+
+    registry = JournalRegistry({'default': '/journals/default.ledger', 'casa': '/journals/casa.ledger'},
+                               create_executor, ResponseCache)
+    app = FastAPI()
+    app.include_router(create_ledger_router(registry))
+    app.include_router(create_ledger_router(registry, per_journal=True))
+    app.state.executors = executors
+    app.state.release_casa = release_casa
+    yield app
+    release_casa.set()
+
+
+@pytest.fixture
+def client(app):
+    with TestClient(app) as client:
+        yield client
+
+
+def test_health_does_not_load_journals(app, client):
+    response = client.get('/api/health')
+    assert response.status_code == 200
+    assert response.json()['status'] == 'OK'
+    assert 'ETag' in response.headers
+
+    # casa is not loaded, and its load would block: health answers at once
+    for response in (client.get('/api/health', headers={JOURNAL_HEADER: 'casa'}),
+                     client.get('/api/journals/casa/health')):
+        assert response.status_code == 200
+        assert 'ETag' not in response.headers
+    assert 'casa' not in app.state.executors
+
+    assert client.get('/api/health', headers={JOURNAL_HEADER: 'outro'}).status_code == 404
+
+
+def test_responses_are_cached_per_generation(app, client):
+    executor = app.state.executors['default']
+    first = client.get('/api/balance?account=Ativos')
+    assert first.json().endswith('@ g1')
+    assert client.get('/api/balance?account=Ativos').content == first.content
+    other = client.get('/api/balance?account=Despesas')
+    assert other.content != first.content
+    assert len(executor.calls) == 2
+    assert client.get('/api/cache').json() == {'hits': 1, 'misses': 2, 'evictions': 0, 'entries': 2,
+                                               'bytes': len(first.content) + len(other.content)}
+
+    # A reload makes every entry stale
+    executor.reload('g2', 1700000100.0)
+    second = client.get('/api/balance?account=Ativos')
+    assert second.json().endswith('@ g2')
+    assert len(executor.calls) == 3
+    assert client.get('/api/cache').json()['entries'] == 1
+
+
+def test_result_of_a_replaced_generation_is_not_cached_or_tagged(app, client):
+    executor = app.state.executors['default']
+    executor.during_run = lambda: executor.reload('g2', 1700000100.0)
+    response = client.get('/api/balance')
+    assert response.json().endswith('@ g1')
+    assert 'ETag' not in response.headers and 'Last-Modified' not in response.headers
+
+    executor.during_run = None
+    assert client.get('/api/balance').json().endswith('@ g2')
+    assert len(executor.calls) == 2
+
+
+def test_etag_answers_304(app, client):
+    executor = app.state.executors['default']
+    response = client.get('/api/prices/history?commodity=USD')
+    etag = response.headers['ETag']
+    assert response.headers['Cache-Control'] == 'no-cache'
+    for if_none_match in (etag, f'W/{etag}', f'"other", {etag}', '*'):
+        unchanged = client.get('/api/prices/history?commodity=USD', headers={'If-None-Match': if_none_match})
+        assert unchanged.status_code == 304
+        assert unchanged.headers['ETag'] == etag
+        assert not unchanged.content
+    assert len(executor.calls) == 1
+
+    # Other params, another journal or another generation make another tag
+    other = client.get('/api/prices/history?commodity=EUR', headers={'If-None-Match': etag})
+    assert other.status_code == 200 and other.headers['ETag'] != etag
+    app.state.release_casa.set()
+    casa = client.get('/api/journals/casa/prices/history?commodity=USD', headers={'If-None-Match': etag})
+    assert casa.status_code == 200 and casa.headers['ETag'] != etag
+    executor.reload('g2', 1700000100.0)
+    reloaded = client.get('/api/prices/history?commodity=USD', headers={'If-None-Match': etag})
+    assert reloaded.status_code == 200
+    assert reloaded.headers['ETag'] not in (etag, other.headers['ETag'])
+    assert client.get('/api/prices/history?commodity=USD',
+                      headers={'If-None-Match': reloaded.headers['ETag']}).status_code == 304
+
+
+def test_if_modified_since_answers_304(app, client):
+    executor = app.state.executors['default']
+    response = client.get('/api/cash-flow')
+    last_modified = response.headers['Last-Modified']
+    assert last_modified == 'Tue, 14 Nov 2023 22:13:20 GMT'
+
+    def status(**headers):
+        return client.get('/api/cash-flow', headers=headers).status_code
+
+    assert status(**{'If-Modified-Since': last_modified}) == 304
+    assert status(**{'If-Modified-Since': 'Wed, 15 Nov 2023 00:00:00 GMT'}) == 304
+    assert status(**{'If-Modified-Since': 'Tue, 14 Nov 2023 22:13:19 GMT'}) == 200
+    assert status(**{'If-Modified-Since': 'yesterday'}) == 200
+    # If-None-Match wins over If-Modified-Since
+    assert status(**{'If-Modified-Since': last_modified, 'If-None-Match': '"other"'}) == 200
+
+    executor.reload('g2', 1700000100.0)
+    assert status(**{'If-Modified-Since': last_modified}) == 200
+
+
+def test_generation_tag_follows_writes(journal_path, monkeypatch):
+    pytest.importorskip('services.ledger_service')
+    from main import create_app
+
+    monkeypatch.setenv('LEDGER_WATCH', 'off')
+    monkeypatch.delenv('LEDGER_JOURNALS', raising=False)
+    with TestClient(create_app(journal_path)) as client:
+        balance = client.get('/api/balance')
+        assert client.get('/api/balance', headers={'If-None-Match': balance.headers['ETag']}).status_code == 304
+
+        written = client.post('/api/transactions', json={'transactions': [{
+            'date': '2024-02-20', 'description': 'Feira',
+            'postings': [{'account': 'Despesas:Mercado', 'amount': '10.00', 'commodity': 'BRL'},
+                         {'account': 'Ativos:Banco'}]}]})
+        assert written.status_code == 201
+
+        updated = client.get('/api/balance', headers={'If-None-Match': balance.headers['ETag']})
+        assert updated.status_code == 200
+        assert updated.headers['ETag'] != balance.headers['ETag']
+        assert updated.json()['account'] != balance.json()['account']
+        assert client.get('/api/balance', headers={'If-None-Match': updated.headers['ETag']}).status_code == 304
@@ -0,0 +1,97 @@
+import asyncio
+
+from services.metrics import (
+    HTTP_EVENT_STREAM_SECONDS,
+    HTTP_IN_FLIGHT,
+    Counter,
+    Gauge,
+    Histogram,
+    MetricsMiddleware,
+    Registry,
+    )
+
+
+def metrics(registry: Registry):
+    return (Counter("calls_total", "Calls", ["method"], registry=registry),
+            Gauge("size", "Size", ["journal"], registry=registry),
+            Histogram("seconds", "Seconds", buckets=(0.1, 1.0), registry=registry))
+
+
+def test_take_and_merge_between_registries():
+    worker, parent = Registry(), Registry()
+    calls, size, seconds = metrics(worker)
+    calls.inc(method="get_balance")
+    size.set(10, journal="default")
+    seconds.observe(0.05)
+    seconds.observe(0.5)
+    parent_calls, _, _ = metrics(parent)
+    parent_calls.inc(method="get_balance")
+
+    parent.merge(worker.take(["calls_total", "size", "seconds"]))
+    exposed = parent.expose()
+    assert 'calls_total{method="get_balance"} 2.0' in exposed
+    assert 'size{journal="default"} 10.0' in exposed
+    assert 'seconds_bucket{le="0.1"} 1' in exposed
+    assert 'seconds_count 2' in exposed
+
+    # Sums are taken once; gauges keep their value
+    seconds.observe(2.0)
+    parent.merge(worker.take(["calls_total", "size", "seconds"]))
+    exposed = parent.expose()
+    assert 'calls_total{method="get_balance"} 2.0' in exposed
+    assert 'seconds_count 3' in exposed
+    assert 'size{journal="default"} 10.0' in exposed
+
+
+def test_take_only_named_metrics():
+    registry = Registry()
+    calls, size, _ = metrics(registry)
+    calls.inc(method="x")
+    assert set(registry.take(["size"])) == {"size"}
+    assert 'calls_total{method="x"} 1.0' in registry.expose()
+
+
+def test_gauge_remove():
+    registry = Registry()
+    _, size, _ = metrics(registry)
+    size.set(1, journal="a")
+    size.set(2, journal="b")
+    size.remove(journal="a")
+    size.remove(journal="missing")
+    exposed = registry.expose()
+    assert 'journal="a"' not in exposed
+    assert 'size{journal="b"} 2.0' in exposed
+
+
+def run_request(content_type: bytes, during_body):
+    """Serve one request through MetricsMiddleware, calling during_body while the body is sent"""
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", content_type)]})
+        during_body()
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def send(message):
+        pass
+
+    scope = {"type": "http", "method": "GET", "route": type("Route", (), {"path": "/test"})()}
+    asyncio.run(MetricsMiddleware(app)(scope, None, send))
+
+
+def in_flight() -> float:
+    return HTTP_IN_FLIGHT._values.get((), 0.0)
+
+
+def stream_count() -> int:
+    values = HTTP_EVENT_STREAM_SECONDS._values.get(("GET", "/test"))
+    return sum(values[0]) if values else 0
+
+
+def test_event_streams_are_not_in_flight():
+    seen = []
+    streams = stream_count()
+    run_request(b"text/event-stream; charset=utf-8", lambda: seen.append(in_flight()))
+    run_request(b"application/json", lambda: seen.append(in_flight()))
+    assert seen == [0.0, 1.0]
+    assert in_flight() == 0.0
+    assert stream_count() == streams + 1
@@ -0,0 +1,203 @@
+import datetime
+import logging
+from decimal import Decimal
+
+from services import price_index
+from services.balance_index import to_decimal
+from services.price_index import PriceIndex
+
+D = datetime.date
+
+
+def ordinal(year, month, day):
+    return D(year, month, day).toordinal()
+
+
+def directives(text):
+    return [(o, commodity, str(price.commodity), to_decimal(price))
+            for o, commodity, price in price_index._price_directives(text.splitlines(), 'main.ledger')]
+
+
+def test_price_directives():
+    assert directives(
+        'P 2024/01/02 USD BRL 4.90\n'
+        '2024/01/03 * Mercado\n'
+        '    Despesas:Mercado  BRL 10.00\n'
+        '    Ativos:Banco\n'
+        'P 2024-01-04 12:00:00 "CM00" BRL 12.5\n'
+    ) == [(ordinal(2024, 1, 2), 'USD', 'BRL', Decimal('4.90')),
+          (ordinal(2024, 1, 4), 'CM00', 'BRL', Decimal('12.5'))]
+
+
+def test_price_directives_skip_comment_and_test_blocks():
+    assert directives(
+        'comment\n'
+        'P 2024/01/01 USD BRL 1.00\n'
+        'end comment\n'
+        'P 2024/01/02 USD BRL 4.90\n'
+        'test balance\n'
+        'P 2024/01/03 USD BRL 2.00\n'
+        'end test\n'
+        'P 2024/01/05 USD BRL 4.95\n'
+    ) == [(ordinal(2024, 1, 2), 'USD', 'BRL', Decimal('4.90')),
+          (ordinal(2024, 1, 5), 'USD', 'BRL', Decimal('4.95'))]
+
+
+def test_malformed_price_directive_is_skipped(monkeypatch, caplog):
+    class Pool:
+        def parse_price_directive(self, line, do_not_add_price, no_date):
+            if 'USD' in line:
+                raise ArithmeticError("Cannot parse amount")
+            return None
+
+    monkeypatch.setattr(price_index.ledger, 'commodities', Pool())
+    with caplog.at_level(logging.WARNING, logger='services.price_index'):
+        assert directives('P 2024/01/02 USD BRL 4,9,0\nP 2024/01/02\n') == []
+    assert len(caplog.records) == 2
+    assert all('Ignoring malformed price directive' in r.getMessage() for r in caplog.records)
+
+
+def series(*points):
+    return [ordinal(*date) for date, _ in points], [Decimal(price) for _, price in points]
+
+
+def make_index() -> PriceIndex:
+    """
+    USD and EUR priced in BRL directly or through each other, JPY only by
+    a BRL price in JPY, and XAU priced in XAG only, unreachable from BRL
+    """
+    return PriceIndex({
+        'USD': {'BRL': series(((2024, 1, 1), '4.90'), ((2024, 1, 20), '4.95'), ((2024, 2, 1), '5.00'))},
+        'EUR': {'USD': series(((2024, 1, 15), '1.10'))},
+        'BRL': {'JPY': series(((2024, 1, 10), '30')),
+                'USD': series(((2024, 2, 1), '0.25'), ((2024, 3, 1), '0.16'))},
+        'XAU': {'XAG': series(((2024, 1, 1), '80'))},
+    }, {
+        'Despesas:Supermercado:Hortifruti:Banana': {'BRL': series(((2024, 1, 3), '6.00'), ((2024, 1, 20), '6.50'))},
+        'Despesas:Supermercado:Feira:Banana': {'BRL': series(((2024, 1, 10), '5.50'))},
+        'Despesas:Supermercado:Padaria:Pao': {'BRL': series(((2024, 1, 5), '0.80'))},
+        'Despesas:SupermercadoOnline:Banana': {'BRL': series(((2024, 1, 25), '9.99'))},
+    })
+
+
+def test_latest_commodity_prices():
+    index = make_index()
+    assert index.latest_commodity_prices(D(2024, 1, 12)) == {
+        'USD': {'BRL': (ordinal(2024, 1, 1), Decimal('4.90'))},
+        'BRL': {'JPY': (ordinal(2024, 1, 10), Decimal('30'))},
+        'XAU': {'XAG': (ordinal(2024, 1, 1), Decimal('80'))},
+    }
+    latest = index.latest_commodity_prices()
+    assert latest['USD'] == {'BRL': (ordinal(2024, 2, 1), Decimal('5.00'))}
+    assert latest['BRL']['USD'] == (ordinal(2024, 3, 1), Decimal('0.16'))
+    assert index.latest_commodity_prices(D(2023, 12, 31)) == {}
+
+
+def test_latest_account_prices():
+    index = make_index()
+    assert index.latest_account_prices(price_index.GROCERY_PREFIX) == {
+        'Banana': {'BRL': (ordinal(2024, 1, 20), Decimal('6.50'))},
+        'Pao': {'BRL': (ordinal(2024, 1, 5), Decimal('0.80'))},
+    }
+    # The latest of the accounts with that name wins
+    assert index.latest_account_prices(price_index.GROCERY_PREFIX, D(2024, 1, 15)) == {
+        'Banana': {'BRL': (ordinal(2024, 1, 10), Decimal('5.50'))},
+        'Pao': {'BRL': (ordinal(2024, 1, 5), Decimal('0.80'))},
+    }
+
+
+def test_conversion_rates():
+    index = make_index()
+    assert index.conversion_rates('BRL', D(2024, 1, 12)) == {
+        'BRL': 1, 'USD': Decimal('4.90'), 'JPY': 1 / Decimal(30)}
+    # On the same day the direct price wins over the inverted one
+    assert index.conversion_rates('BRL', D(2024, 2, 1)) == {
+        'BRL': 1, 'USD': Decimal('5.00'), 'JPY': 1 / Decimal(30), 'EUR': Decimal('5.5')}
+    # A later inverted price wins, and EUR follows it through USD
+    assert index.conversion_rates('BRL') == {
+        'BRL': 1, 'USD': Decimal('6.25'), 'JPY': 1 / Decimal(30), 'EUR': Decimal('6.875')}
+    assert index.conversion_rates('XAG') == {'XAG': 1, 'XAU': Decimal('80')}
+    assert index.conversion_rates('GBP') == {'GBP': 1}
+
+
+def test_conversion_rates_are_cached_per_target_and_date():
+    index = make_index()
+    rates = index.conversion_rates('BRL', D(2024, 2, 1))
+    assert index.conversion_rates('BRL', D(2024, 2, 1)) is rates
+    assert index.conversion_rates('BRL', D(2024, 2, 2)) is not rates
+    assert index.conversion_rates('USD', D(2024, 2, 1)) is not rates
+    for day in range(1, 100):
+        index.conversion_rates('BRL', D(2024, 1, 1) + datetime.timedelta(days=day))
+    assert len(index._rates) <= price_index._MAX_RATE_TABLES
+
+
+def test_commodity_history():
+    index = make_index()
+    assert index.commodity_history('USD', None, None, None) == {'BRL': [
+        (ordinal(2024, 1, 1), Decimal('4.90')),
+        (ordinal(2024, 1, 20), Decimal('4.95')),
+        (ordinal(2024, 2, 1), Decimal('5.00')),
+    ]}
+    # upper is exclusive
+    assert index.commodity_history('USD', 'BRL', D(2024, 1, 2), D(2024, 2, 1)) == {'BRL': [
+        (ordinal(2024, 1, 20), Decimal('4.95'))]}
+    # The last price of each month
+    assert index.commodity_history('USD', None, None, None, 'monthly') == {'BRL': [
+        (ordinal(2024, 1, 20), Decimal('4.95')),
+        (ordinal(2024, 2, 1), Decimal('5.00')),
+    ]}
+    assert index.commodity_history('BRL', 'JPY', None, None) == {'JPY': [(ordinal(2024, 1, 10), Decimal('30'))]}
+    assert index.commodity_history('USD', 'EUR', None, None) == {}
+    assert index.commodity_history('GBP', None, None, None) == {}
+
+
+def test_account_history_merges_accounts_with_the_same_name():
+    index = make_index()
+    assert index.account_history(price_index.GROCERY_PREFIX, 'Banana', None, None, None) == {'BRL': [
+        (ordinal(2024, 1, 3), Decimal('6.00')),
+        (ordinal(2024, 1, 10), Decimal('5.50')),
+        (ordinal(2024, 1, 20), Decimal('6.50')),
+    ]}
+    assert index.account_history(price_index.GROCERY_PREFIX, 'Banana', 'BRL', None, None, 'monthly') == {
+        'BRL': [(ordinal(2024, 1, 20), Decimal('6.50'))]}
+    assert index.account_history(price_index.GROCERY_PREFIX, 'Banana', 'USD', None, None) == {}
+
+
+HEAD = """\
+P 2024/01/01 USD BRL 4.90
+
+2024/01/03 * Feira
+    Despesas:Supermercado:Feira:Banana  2 kg @ BRL 6.00
+    Ativos:Banco
+"""
+
+TAIL = """
+P 2024/01/01 USD BRL 4.95
+P 2024/01/05 USD BRL 5.00
+
+2024/01/05 * Feira
+    Despesas:Supermercado:Feira:Banana  1 kg @ BRL 6.50
+    Despesas:Viagem  10 USD @ BRL 5.10
+    Ativos:Banco
+"""
+
+
+def test_with_journal_text_matches_a_full_build(tmp_path):
+    import ledger
+
+    path = tmp_path / 'main.ledger'
+    path.write_text(HEAD)
+    journal = ledger.read_journal(str(path))
+    index = PriceIndex.from_journal(journal, [str(path)])
+    xact_count = len(list(journal.xacts()))
+    journal = ledger.read_journal_from_string(TAIL)
+    appended = index.with_journal_text(list(journal.xacts())[xact_count:], TAIL.splitlines(), str(path))
+
+    path.write_text(HEAD + TAIL)
+    full = PriceIndex.from_journal(ledger.read_journal(str(path)), [str(path)])
+    assert appended.to_dict() == full.to_dict()
+    # Of two prices on the same day, the one read last wins
+    assert appended.latest_commodity_prices(D(2024, 1, 1))['USD']['BRL'] == (ordinal(2024, 1, 1), Decimal('4.95'))
+    assert appended.conversion_rates('BRL')['USD'] == Decimal('5.10')
+    # The index it was built from is left alone
+    assert index.conversion_rates('BRL')['USD'] == Decimal('4.90')
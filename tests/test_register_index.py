@@ -0,0 +1,164 @@
+import datetime
+import random
+from decimal import Decimal
+
+import pytest
+
+from services.register_index import LayeredRegister, RegisterIndex, _merged_rows, decode_cursor, encode_cursor
+
+ACCOUNTS = ['Ativos:Banco', 'Despesas:Mercado']
+START = datetime.date(2024, 1, 1)
+
+
+def empty_register() -> RegisterIndex:
+    return RegisterIndex({}, [], [], {}, [], [], [], [], [], [])
+
+
+def random_postings(rng: random.Random, count: int):
+    """(account, date ordinal, payee, commodity, amount, cleared) postings over a few months"""
+    return [(rng.choice(ACCOUNTS),
+             START.toordinal() + rng.randrange(90),
+             f"payee {rng.randrange(10)}",
+             rng.choice(['BRL', 'USD']),
+             Decimal(rng.randrange(-10000, 10000)).scaleb(-2),
+             rng.random() < 0.5)
+            for _ in range(count)]
+
+
+def expected_rows(postings, account):
+    """Register rows of account: by date, in posting order within a day, with running balances"""
+    rows = []
+    balances = {}
+    for _, ordinal, payee, commodity, value, is_cleared in sorted(
+            (p for p in postings if p[0] == account), key=lambda p: p[1]):
+        balances[commodity] = balances.get(commodity, Decimal(0)) + value
+        rows.append((ordinal, payee, commodity, value, balances[commodity], is_cleared))
+    return rows
+
+
+def all_rows(register, account):
+    rows, _ = register.page(account, None, None, None, 10 ** 6)
+    return rows
+
+
+def test_merged_rows_shifts_later_running_balances():
+    # dates, payees, commodities, amounts, running, cleared
+    group = [[1, 2, 3], [0, 0, 0], [0, 1, 0], [10, 5, 20], [10, 5, 30], [0, 0, 1]]
+    merged = _merged_rows(group, [(2, 1, 0, 7, 1), (0, 1, 1, 3, 0)])
+    assert merged[0] == [0, 1, 2, 2, 3]
+    assert merged[2] == [1, 0, 1, 0, 0]
+    assert merged[3] == [3, 10, 5, 7, 20]
+    assert merged[4] == [3, 10, 8, 17, 37]
+    assert merged[5] == [0, 0, 0, 1, 1]
+
+
+def test_merged_rows_leaves_group_unchanged():
+    group = [[1, 2], [0, 0], [0, 0], [1, 2], [1, 3], [0, 0]]
+    _merged_rows(group, [(1, 0, 0, 5, 0)])
+    assert group == [[1, 2], [0, 0], [0, 0], [1, 2], [1, 3], [0, 0]]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_with_postings_in_batches_matches_all_at_once(seed):
+    rng = random.Random(seed)
+    postings = random_postings(rng, 300)
+    register = empty_register()
+    for i in range(0, len(postings), 41):
+        register = register.with_postings(postings[i:i + 41])
+    whole = empty_register().with_postings(postings)
+    for account in ACCOUNTS:
+        assert all_rows(register, account) == expected_rows(postings, account)
+        assert all_rows(whole, account) == expected_rows(postings, account)
+
+
+def test_with_postings_rejects_finer_scale():
+    register = empty_register().with_postings([('Ativos', 738000, 'x', 'BRL', Decimal('1.50'), False)])
+    with pytest.raises(ValueError):
+        register.with_postings([('Ativos', 738001, 'x', 'BRL', Decimal('0.001'), False)])
+
+
+def walk(register, account, lower, upper, limit):
+    """All rows of account in [lower, upper), a page of limit at a time through encoded cursors"""
+    rows = []
+    cursor = None
+    while True:
+        page, next_cursor = register.page(account, lower, upper, cursor, limit)
+        assert len(page) <= limit
+        rows.extend(page)
+        if next_cursor is None:
+            return rows
+        assert len(page) == limit
+        cursor = decode_cursor(encode_cursor(next_cursor))
+
+
+def test_cursor_round_trip():
+    cursor = (START.toordinal(), 3)
+    assert encode_cursor(cursor) == '2024-01-01.3'
+    assert decode_cursor(encode_cursor(cursor)) == cursor
+
+
+@pytest.mark.parametrize('text', ['', '2024-01-01', '2024-13-01.0', '2024-01-01.x', '2024-01-01.-1'])
+def test_decode_cursor_rejects_malformed(text):
+    with pytest.raises(ValueError):
+        decode_cursor(text)
+
+
+@pytest.mark.parametrize('limit', [1, 2, 7, 1000])
+def test_pages_cover_window(limit):
+    postings = random_postings(random.Random(limit), 200)
+    register = empty_register().with_postings(postings)
+    lower, upper = datetime.date(2024, 1, 20), datetime.date(2024, 3, 1)
+    for account in ACCOUNTS:
+        rows = expected_rows(postings, account)
+        assert walk(register, account, None, None, limit) == rows
+        assert walk(register, account, lower, upper, limit) == [
+            row for row in rows if lower.toordinal() <= row[0] < upper.toordinal()]
+
+
+def test_cursor_counts_postings_of_the_same_day():
+    postings = [('Ativos', START.toordinal(), f"p{i}", 'BRL', Decimal(i + 1), False) for i in range(5)]
+    register = empty_register().with_postings(postings)
+    rows, cursor = register.page('Ativos', None, None, None, 2)
+    assert [row[1] for row in rows] == ['p0', 'p1']
+    assert cursor == (START.toordinal(), 2)
+    rows, cursor = register.page('Ativos', None, None, cursor, 2)
+    assert [row[1] for row in rows] == ['p2', 'p3']
+
+
+def test_page_of_unknown_account():
+    with pytest.raises(KeyError):
+        empty_register().page('Ativos', None, None, None, 10)
+
+
+def test_balance_before():
+    rng = random.Random(7)
+    postings = random_postings(rng, 200) + [('Passivos:Cartao', START.toordinal(), 'p', 'EUR', Decimal(5), False)]
+    register = empty_register().with_postings(postings)
+    for account, (start, end) in register.accounts.items():
+        for commodity_id in range(len(register.commodities)):
+            balance = 0
+            for i in range(start, end + 1):
+                assert register.balance_before(account, i, commodity_id) == balance, (account, i)
+                if i < end and register.commodity_ids[i] == commodity_id:
+                    balance = register.running[i]
+    assert register.balance_before('Passivos', 0, 0) == 0
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_layered_register_pages_match_merged_register(seed):
+    rng = random.Random(seed)
+    base_postings = random_postings(rng, 150)
+    appended = random_postings(rng, 60) + [
+        ('Passivos:Cartao', START.toordinal() + 10, 'new', 'EUR', Decimal('12.5'), False)]
+    base = empty_register().with_postings(base_postings)
+    delta = base.delta()
+    for i in range(0, len(appended), 20):
+        delta = delta.with_postings(appended[i:i + 20])
+    layered = LayeredRegister(base, delta)
+    merged = base.with_postings(appended)
+
+    assert layered.knows('Passivos:Cartao') and not base.knows('Passivos:Cartao')
+    for account in ACCOUNTS + ['Passivos:Cartao']:
+        for lower, upper in [(None, None), (datetime.date(2024, 1, 20), datetime.date(2024, 3, 1))]:
+            for limit in (1, 3, 1000):
+                assert walk(layered, account, lower, upper, limit) == walk(merged, account, lower, upper, limit)
@@ -0,0 +1,66 @@
+import asyncio
+import logging
+
+import pytest
+from fastapi import HTTPException
+
+from services.transaction_writer import TransactionWriter
+
+
+class StubExecutor:
+    """Answers write_transactions like LedgerService, rejecting groups named 'bad'"""
+
+    def __init__(self):
+        self.batches = []
+        self.release = asyncio.Event()
+
+    async def call(self, method, groups):
+        assert method == "write_transactions"
+        self.batches.append(groups)
+        await self.release.wait()
+        return f"generation {len(self.batches)}", tuple(
+            "Transaction does not balance" if group == ('bad',) else None for group in groups)
+
+
+def test_writes_arriving_during_a_batch_go_out_together():
+    async def scenario():
+        executor = StubExecutor()
+        writer = TransactionWriter(executor)
+        first = asyncio.ensure_future(writer.write(('a',)))
+        await asyncio.sleep(0)
+        waiting = [asyncio.ensure_future(writer.write(group)) for group in (('b',), ('bad',), ('c', 'd'))]
+        await asyncio.sleep(0)
+        executor.release.set()
+        results = await asyncio.gather(first, *waiting, return_exceptions=True)
+        return executor.batches, results
+
+    batches, results = asyncio.run(scenario())
+    assert batches == [(('a',),), (('b',), ('bad',), ('c', 'd'))]
+    assert results[0] == "generation 1"
+    assert results[1] == results[3] == "generation 2"
+    assert isinstance(results[2], HTTPException)
+    assert (results[2].status_code, results[2].detail) == (400, "Transaction does not balance")
+
+
+def test_executor_failure_fails_the_whole_batch():
+    class FailingExecutor:
+        async def call(self, method, groups):
+            raise OSError("No space left on device")
+
+    async def scenario():
+        writer = TransactionWriter(FailingExecutor())
+        return await asyncio.gather(writer.write(('a',)), writer.write(('b',)), return_exceptions=True)
+
+    assert all(isinstance(result, OSError) for result in asyncio.run(scenario()))
+
+
+def test_batch_without_writes_is_not_logged_as_written(caplog):
+    async def scenario():
+        executor = StubExecutor()
+        executor.release.set()
+        with pytest.raises(HTTPException):
+            await TransactionWriter(executor).write(('bad',))
+
+    with caplog.at_level(logging.INFO, logger="services.transaction_writer"):
+        asyncio.run(scenario())
+    assert not caplog.records